@@ -0,0 +1,450 @@
+"""
+CPU benchmarks of every stage of the video-to-score pipeline.
+The inputs are synthetic (random frames, random COCO keypoints and swings), no checkpoint or dataset is needed.
+The models have random weights, only their speed is measured.
+
+  python benchmark.py                      # run all benchmarks
+  python benchmark.py -k sort gast_net     # run the benchmarks whose name contains one of the words
+  python benchmark.py -o result.json       # save the results as JSON
+  python benchmark.py -b baseline.json     # flag the stages slower than a saved result (exit code 1)
+
+A benchmark whose dependencies (torch, numba, filterpy, ...) are not installed is reported as skipped.
+"""
+import os
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')  # CPU only
+
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import functools
+import contextlib
+import os.path as osp
+from collections import OrderedDict
+import numpy as np
+
+project_root = osp.dirname(osp.realpath(__file__))
+hrnet_root = osp.join(project_root, 'lib/pose/hrnet')
+
+# name --> (setup function, number of items processed by one call, unit)
+benchmarks = OrderedDict()
+
+
+def benchmark(name, items=1, unit='frame'):
+    """
+    Register a benchmark. The decorated setup function receives a numpy RandomState,
+    prepares the synthetic inputs and returns the function to time
+    """
+    def register(setup):
+        benchmarks[name] = (setup, items, unit)
+        return setup
+    return register
+
+
+def import_from(path, module_name):
+    # The detector and HRNet modules are imported with their own directory in sys.path, like gen_kpts does
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.path.pop(0)
+
+
+@contextlib.contextmanager
+def default_argv():
+    # yolo_human_det parses sys.argv, the options of this script must not reach it
+    argv = sys.argv
+    sys.argv = argv[:1]
+    try:
+        yield
+    finally:
+        sys.argv = argv
+
+
+# Synthetic inputs
+
+def random_frame(rng, width=1920, height=1080):
+    return rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def random_coco_keypoints(rng, num_frames, num_person=1, width=1920, height=1080):
+    """
+    COCO keypoints of people walking across the frame, with small random offsets: (M, T, 17, 2) and scores (M, T, 17)
+    """
+    base = rng.uniform([0.3 * width, 0.2 * height], [0.7 * width, 0.8 * height], (num_person, 1, 17, 2))
+    drift = np.linspace(0, 0.1 * width, num_frames)[np.newaxis, :, np.newaxis, np.newaxis] * [1, 0]
+    keypoints = base + drift + rng.normal(0, 5, (num_person, num_frames, 17, 2))
+    scores = rng.uniform(0.2, 1., (num_person, num_frames, 17))
+    return keypoints.astype(np.float32), scores.astype(np.float32)
+
+
+# Standing pose in the joint order of joint_mappings.keypoint_indices (meters, z up)
+standing_pose = np.array([
+    [0, 0, 0.95], [0.12, 0, 0.95], [0.13, 0, 0.5], [0.14, 0, 0.05], [-0.12, 0, 0.95], [-0.13, 0, 0.5],
+    [-0.14, 0, 0.05], [0, 0, 1.2], [0, 0, 1.45], [0, 0, 1.55], [0, 0, 1.7], [-0.18, 0, 1.42], [-0.2, 0.1, 1.15],
+    [-0.1, 0.25, 0.9], [0.18, 0, 1.42], [0.2, 0.1, 1.15], [0.1, 0.25, 0.9]])
+
+
+def synthetic_swing(rng, num_frames=150):
+    """
+    (T, 17, 3) swing: the hands rise to the top, fall to the impact, rise again to the finish and return to the address
+    """
+    from swing_sequence import SwingSequence
+
+    t = np.linspace(0, 1, num_frames)
+    keys = [0, 0.1, 0.45, 0.55, 0.68, 0.8, 1]
+    hand_height = np.interp(t, keys, [0.9, 0.9, 1.8, 0.85, 1.7, 1.6, 0.9])
+    hand_side = np.interp(t, keys, [0, 0, 0.5, 0, -0.5, -0.45, 0])
+    rotation = np.interp(t, keys, [0, 0, 1.5, 0.3, -1.2, -1.2, 0])
+
+    joints = np.repeat(standing_pose[np.newaxis], num_frames, axis=0)
+    shoulders = [11, 14]
+    joints[:, shoulders, 1] += 0.18 * np.sin(rotation)[:, np.newaxis] * [[-1, 1]]
+    for wrist in [13, 16]:
+        joints[:, wrist, 0] += hand_side
+        joints[:, wrist, 2] = hand_height
+    joints += rng.normal(0, 0.0005, joints.shape)
+    return SwingSequence(np.arange(num_frames), joints)
+
+
+# Detection and tracking
+
+def random_yolo_prediction(rng, num_people=5, inp_dim=416):
+    """
+    Raw YOLOv3 output (1, 10647, 85) with a few confident person boxes
+    """
+    import torch
+
+    prediction = np.zeros((1, 10647, 85), dtype=np.float32)
+    prediction[0, :, :2] = rng.uniform(0, inp_dim, (10647, 2))
+    prediction[0, :, 2:4] = rng.uniform(10, 200, (10647, 2))
+    prediction[0, :, 4] = rng.uniform(0, 0.6, 10647)
+    prediction[0, :, 5:] = rng.uniform(0, 1, (10647, 80))
+
+    # Several overlapping boxes per person, suppressed by NMS
+    people = rng.choice(10647, num_people * 8, replace=False)
+    prediction[0, people, 4] = rng.uniform(0.75, 1., len(people))
+    prediction[0, people, 5] = 2.
+    return torch.from_numpy(prediction)
+
+
+@benchmark('yolo_write_results', items=1, unit='image')
+def setup_write_results(rng):
+    util = import_from(osp.join(project_root, 'lib/detector/yolov3'), 'util')
+    prediction = random_yolo_prediction(rng)
+    return lambda: util.write_results(prediction.clone(), 0.7, 80, nms=True, nms_conf=0.4, det_hm=True)
+
+
+@benchmark('yolo_human_det_postprocess', items=1, unit='image')
+def setup_yolo_human_det(rng):
+    detector = import_from(osp.join(project_root, 'lib'), 'detector')
+    prediction = random_yolo_prediction(rng)
+    frame = random_frame(rng)
+
+    def fake_model(img, CUDA):
+        return prediction.clone()
+
+    def run():
+        with default_argv():
+            return detector.yolo_human_det(frame, fake_model, reso=416, confidence=0.7)
+    return run
+
+
+@benchmark('sort_update', items=1)
+def setup_sort(rng):
+    sort = import_from(osp.join(project_root, 'lib'), 'track.sort')
+    num_frames, num_people = 300, 3
+    starts = rng.uniform(100, 1500, (num_people, 2))
+    steps = rng.normal(0, 3, (num_frames, num_people, 2)).cumsum(axis=0)
+    corners = starts + steps
+    detections = np.concatenate([corners, corners + [200, 400], np.ones((num_frames, num_people, 1))], axis=2)
+
+    state = {'tracker': sort.Sort(), 'frame': 0}
+
+    def run():
+        if state['frame'] == num_frames:
+            state['tracker'], state['frame'] = sort.Sort(), 0
+        state['tracker'].update(detections[state['frame']])
+        state['frame'] += 1
+    return run
+
+
+# 2D pose estimation
+
+def hrnet_config():
+    import_from(osp.join(hrnet_root, 'pose_estimation'), '_init_paths')
+    config = import_from(osp.join(hrnet_root, 'lib'), 'config')
+    cfg = config.cfg.clone()
+    cfg.defrost()
+    cfg.merge_from_file(osp.join(hrnet_root, 'experiments/coco/hrnet/w48_384x288_adam_lr1e-3.yaml'))
+    cfg.freeze()
+    return cfg
+
+
+@benchmark('hrnet_preprocess', items=2, unit='person')
+def setup_preprocess(rng):
+    cfg = hrnet_config()
+    utilitys = import_from(osp.join(hrnet_root, 'lib'), 'utils.utilitys')
+    frame = random_frame(rng)
+    bboxs = np.array([[400, 200, 700, 900], [1100, 150, 1450, 950]], dtype=np.float32)
+    return lambda: utilitys.PreProcess(frame, bboxs, cfg, num_pos=2)
+
+
+@benchmark('hrnet_get_final_preds', items=2, unit='person')
+def setup_get_final_preds(rng):
+    cfg = hrnet_config()
+    utilitys = import_from(osp.join(hrnet_root, 'lib'), 'utils.utilitys')
+    inference = import_from(osp.join(hrnet_root, 'lib'), 'utils.inference')
+
+    width, height = cfg.MODEL.HEATMAP_SIZE
+    heatmaps = rng.uniform(0, 1, (2, 17, height, width)).astype(np.float32)
+    boxes = [[400, 200, 700, 900], [1100, 150, 1450, 950]]
+    centers, scales = zip(*[utilitys.box_to_center_scale(box, 1080, 1920) for box in boxes])
+    return lambda: inference.get_final_preds(cfg, heatmaps, np.asarray(centers), np.asarray(scales))
+
+
+# Keypoint format conversion
+
+@benchmark('coco_h36m', items=1000)
+def setup_coco_h36m(rng):
+    from tools.mpii_coco_h36m import coco_h36m
+
+    keypoints, _ = random_coco_keypoints(rng, 1000)
+    return lambda: coco_h36m(keypoints[0])
+
+
+@benchmark('h36m_coco_format', items=1000)
+def setup_h36m_coco_format(rng):
+    from tools.preprocess import h36m_coco_format
+
+    keypoints, scores = random_coco_keypoints(rng, 1000, num_person=2)
+    return lambda: h36m_coco_format(keypoints, scores)
+
+
+@benchmark('revise_kpts', items=1000)
+def setup_revise_kpts(rng):
+    from tools.preprocess import h36m_coco_format, revise_kpts
+
+    keypoints, scores = random_coco_keypoints(rng, 1000, num_person=2)
+    h36m_kpts, h36m_scores, valid_frames = h36m_coco_format(keypoints, scores)
+    return lambda: revise_kpts(h36m_kpts, h36m_scores, valid_frames)
+
+
+# 3D pose estimation
+
+def setup_gast_net(rng, rf):
+    import torch
+    from common.graph_utils import adj_mx_from_skeleton
+    from common.skeleton import Skeleton
+    from model.gast_net import SpatioTemporalModel
+
+    skeleton = Skeleton(parents=[-1, 0, 1, 2, 0, 4, 5, 0, 7, 8, 9, 8, 11, 12, 8, 14, 15],
+                        joints_left=[4, 5, 6, 11, 12, 13], joints_right=[1, 2, 3, 14, 15, 16])
+    filter_widths = [3] * int(round(np.log(rf) / np.log(3)))
+    channels = {27: 128, 81: 64, 243: 32}[rf]
+    torch.manual_seed(0)
+    model_pos = SpatioTemporalModel(adj_mx_from_skeleton(skeleton), 17, 2, 17, filter_widths=filter_widths,
+                                    channels=channels, dropout=0.05).eval()
+
+    # 128 output frames, with the test-time flip augmentation of evaluate_batched
+    inputs_2d = torch.from_numpy(rng.uniform(-1, 1, (2, 128 + rf - 1, 17, 2)).astype(np.float32))
+
+    def run():
+        with torch.no_grad():
+            return model_pos(inputs_2d)
+    return run
+
+
+for receptive_field in (27, 81, 243):
+    benchmark('gast_net_forward_%d' % receptive_field, items=128)(
+        functools.partial(setup_gast_net, rf=receptive_field))
+
+
+@benchmark('camera_to_world', items=1000)
+def setup_camera_to_world(rng):
+    from common.camera import camera_to_world
+
+    rot = np.array([0.14070565, -0.15007018, -0.7552408, 0.62232804], dtype=np.float32)
+    poses = rng.normal(0, 0.3, (1000, 17, 3)).astype(np.float32)
+    return lambda: camera_to_world(poses, R=rot, t=0)
+
+
+# Training and evaluation
+
+@benchmark('chunked_generator_batch', items=1024, unit='sample')
+def setup_chunked_generator(rng):
+    from common.generators import ChunkedGenerator
+
+    poses_2d = [rng.uniform(-1, 1, (1000, 17, 2)).astype(np.float32) for _ in range(10)]
+    poses_3d = [rng.normal(0, 0.3, (1000, 17, 3)).astype(np.float32) for _ in range(10)]
+    generator = ChunkedGenerator(1024, None, poses_3d, poses_2d, 1, pad=40, augment=True,
+                                 kps_left=[4, 5, 6, 11, 12, 13], kps_right=[1, 2, 3, 14, 15, 16],
+                                 joints_left=[4, 5, 6, 11, 12, 13], joints_right=[1, 2, 3, 14, 15, 16], endless=True)
+    batches = generator.next_epoch()
+    return lambda: next(batches)
+
+
+@benchmark('p_mpjpe', items=1024, unit='pose')
+def setup_p_mpjpe(rng):
+    from common.loss import p_mpjpe
+
+    target = rng.normal(0, 0.3, (1024, 17, 3))
+    predicted = target + rng.normal(0, 0.05, target.shape)
+    return lambda: p_mpjpe(predicted, target)
+
+
+# Scoring
+
+@benchmark('detect_swing_phases', items=1, unit='swing')
+def setup_detect_swing_phases(rng):
+    from joint_mappings import keypoint_indices
+    from swing_phase_detection import detect_swing_phases
+
+    frames = synthetic_swing(rng)
+    return lambda: detect_swing_phases(frames, keypoint_indices, verbose=False)
+
+
+@benchmark('analyze_swing', items=1, unit='swing')
+def setup_analyze_swing(rng):
+    from swing_analysis import analyze_swing
+
+    frames = synthetic_swing(rng)
+    return lambda: analyze_swing(frames)
+
+
+@benchmark('segment_swings', items=10, unit='swing')
+def setup_segment_swings(rng):
+    from swing_sequence import SwingSequence
+    from swing_segmentation import segment_swings
+
+    # 10 swings separated by 3 seconds of rest
+    swings = [synthetic_swing(rng).joints for _ in range(10)]
+    rest = [np.repeat(swing[:1], 90, axis=0) for swing in swings]
+    joints = np.concatenate([part for pair in zip(swings, rest) for part in pair])
+    session = SwingSequence(np.arange(len(joints)), joints)
+    return lambda: segment_swings(session)
+
+
+# Measurement
+
+def measure(func, repeat=30, warmup=3, min_seconds=0.):
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < repeat or time.perf_counter() - start < min_seconds:
+        t = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t)
+    return np.array(latencies)
+
+
+def summarize(latencies, items, unit):
+    ms = latencies * 1000
+    return OrderedDict([
+        ('repeat', len(latencies)),
+        ('mean_ms', float(ms.mean())),
+        ('p50_ms', float(np.percentile(ms, 50))),
+        ('p90_ms', float(np.percentile(ms, 90))),
+        ('p99_ms', float(np.percentile(ms, 99))),
+        ('max_ms', float(ms.max())),
+        ('throughput', float(items / latencies.mean())),
+        ('unit', unit + '/s'),
+    ])
+
+
+def environment():
+    info = OrderedDict([('time', time.strftime('%Y-%m-%dT%H:%M:%S')), ('python', platform.python_version()),
+                        ('platform', platform.platform()), ('processor', platform.processor()),
+                        ('cpu_count', os.cpu_count()), ('numpy', np.__version__)])
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        info['torch'] = None
+    return info
+
+
+def run_benchmarks(names, repeat=30, warmup=3, min_seconds=0., seed=0):
+    results = OrderedDict()
+    for name in names:
+        setup, items, unit = benchmarks[name]
+        try:
+            func = setup(np.random.RandomState(seed))
+        except ImportError as e:
+            results[name] = {'skipped': 'missing dependency: {}'.format(e.name or e)}
+            print('{:<28} skipped ({})'.format(name, results[name]['skipped']))
+            continue
+
+        results[name] = summarize(measure(func, repeat, warmup, min_seconds), items, unit)
+        print('{:<28} p50 {:9.3f} ms  p90 {:9.3f} ms  p99 {:9.3f} ms  {:12.1f} {}'.format(
+            name, results[name]['p50_ms'], results[name]['p90_ms'], results[name]['p99_ms'],
+            results[name]['throughput'], results[name]['unit']))
+    return results
+
+
+def compare(results, baseline, threshold=0.2, key='p50_ms'):
+    """
+    Compare the results with a baseline run. A stage is a regression if its latency is more than
+    (1 + threshold) times the baseline latency
+    :return: list of (name, baseline latency, latency, ratio) of the regressions
+    """
+    regressions = []
+    print('')
+    print('{:<28} {:>12} {:>12} {:>8}'.format('comparison (' + key + ')', 'baseline', 'current', 'ratio'))
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        if key not in result or key not in base:
+            continue
+        ratio = result[key] / base[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append((name, base[key], result[key], ratio))
+            flag = '  REGRESSION'
+        print('{:<28} {:12.3f} {:12.3f} {:8.2f}{}'.format(name, base[key], result[key], ratio, flag))
+    return regressions
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser('CPU benchmarks of the pipeline stages.')
+    parser.add_argument('-k', '--filter', type=str, nargs='*', default=None,
+                        help='run only the benchmarks whose name contains one of the words')
+    parser.add_argument('-l', '--list', action='store_true', help='list the benchmarks')
+    parser.add_argument('-n', '--repeat', type=int, default=30, help='number of timed calls of each benchmark')
+    parser.add_argument('-w', '--warmup', type=int, default=3, help='number of untimed calls before timing')
+    parser.add_argument('-t', '--min-time', type=float, default=0., help='minimum seconds spent timing each benchmark')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file of the results')
+    parser.add_argument('-b', '--baseline', type=str, default=None, help='JSON file of a previous run to compare')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown of the median latency reported as a regression')
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    names = [name for name in benchmarks if not args.filter or any(word in name for word in args.filter)]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    results = run_benchmarks(names, args.repeat, args.warmup, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'benchmarks': results}, file, indent=2)
+        print('Results saved to', args.output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)['benchmarks']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('{} regression(s) over {:.0%}'.format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Single entry point of the pipeline:
+
+    python cli.py extract-2d video.mp4 -o output/video.kpts
+    python cli.py lift-3d video.mp4 -o output/video.npz
+    python cli.py render video.mp4 -o output/animation.mp4
+    python cli.py batch videos/ -o output/batch -j 4
+    python cli.py score swing.json            (or a directory / manifest of swing files)
+    python cli.py phases swing.json
+    python cli.py cache list                  (cache invalidate video.mp4 / cache invalidate --all / cache prune)
+
+Only argparse is imported at start-up. Every subcommand imports the modules it needs when it runs,
+so scoring a swing does not load torch, OpenCV, HRNet or matplotlib.
+"""
+import argparse
+import os.path as osp
+import sys
+import time
+
+default_cache_dir = osp.join(osp.dirname(osp.realpath(__file__)), 'output', 'cache')
+
+
+def video_name(video):
+    return osp.splitext(osp.basename(video))[0]
+
+
+def reset_hrnet_argv():
+    # The HRNet options are parsed from sys.argv, which holds the options of this CLI
+    del sys.argv[1:]
+
+
+def open_cache(args):
+    if getattr(args, 'no_cache', False):
+        return None
+    from tools.cache import ResultCache
+    return ResultCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
+
+
+def extract_2d(args):
+    from gen_skes import import_hrnet
+
+    output = args.output or './output/' + video_name(args.video) + '.json'
+    reset_hrnet_argv()
+    import_hrnet().generate_ntu_kpts_json(args.video, output, num_peroson=args.num_person)
+    print('2D keypoints saved to', output)
+
+
+def lift_3d(args):
+    import gen_skes
+
+    output = args.output or './output/' + video_name(args.video) + '.npz'
+    reset_hrnet_argv()
+    if args.stream:
+        skeletons = gen_skes.generate_skeletons_stream(video=args.video, rf=args.receptive_field,
+                                                       num_person=args.num_person, chunk_size=args.stream_chunk)
+        gen_skes.save_skeletons_stream(skeletons, output, num_person=args.num_person,
+                                       fps=gen_skes.video_fps(args.video))
+    else:
+        gen_skes.generate_skeletons(video=args.video, rf=args.receptive_field, num_person=args.num_person,
+                                    output=output, cache=open_cache(args), num_workers=args.workers or None)
+    print('3D poses saved to', output)
+
+
+def render(args):
+    import gen_skes
+
+    output = args.output or './output/animation_' + video_name(args.video) + '.mp4'
+    reset_hrnet_argv()
+    gen_skes.generate_skeletons(video=args.video, rf=args.receptive_field, output_animation=True,
+                                num_person=args.num_person, matplotlib=args.matplotlib, output=output,
+                                cache=open_cache(args), num_workers=args.workers or None)
+    print('Animation saved to', output)
+
+
+def batch(args):
+    from gen_skes_batch import list_videos, run_batch
+
+    videos = list_videos(args.input)
+    input_root = osp.abspath(args.input) if osp.isdir(args.input) else None
+    records = run_batch(videos, args.output, args.receptive_field, args.num_person, args.workers or None,
+                        input_root=input_root, progress_file=args.progress, retry_failed=not args.skip_failed,
+                        cache_dir=None if args.no_cache else args.cache_dir, cache_size=args.cache_size)
+    num_errors = sum(1 for record in records if record['status'] != 'ok')
+    print(f"{len(records) - num_errors}/{len(records)} videos processed, results saved to {args.output}")
+
+
+def score(args):
+    if osp.isdir(args.input) or not args.input.endswith('.json'):
+        from score_batch import list_swing_files, score_batch
+
+        output = args.output or 'swing_scores.csv'
+        rows = score_batch(list_swing_files(args.input), output, args.workers, fps=args.fps)
+        num_errors = sum(1 for row in rows if row['error'])
+        print(f"{len(rows) - num_errors}/{len(rows)} swings scored, results saved to {output}")
+        return
+
+    from swing_sequence import load_swing_data
+    from swing_analysis import analyze_swing
+
+    try:
+        result = analyze_swing(load_swing_data(args.input), args.metrics or None, fps=args.fps)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    for name, value in result['values'].items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+
+
+def phases(args):
+    from joint_mappings import keypoint_indices
+    from swing_sequence import load_swing_data
+    from swing_phase_detection import detect_swing_phases, get_joint_coordinates, visualize_phases
+
+    frames = load_swing_data(args.json_file)
+    swing_phases = detect_swing_phases(frames, keypoint_indices, verbose=False)
+    if not swing_phases:
+        print("Failed to detect the swing phases.")
+        sys.exit(1)
+
+    for phase, frame_index in swing_phases.items():
+        print(f"{phase.capitalize()}: Frame {frame_index}")
+    if args.plot:
+        z_coords = get_joint_coordinates(frames, 'left_wrist', keypoint_indices)[:, 2]
+        visualize_phases(frames, z_coords, swing_phases)
+
+
+def cache(args):
+    result_cache = open_cache(args)
+    if args.action == 'list':
+        entries = result_cache.entries()
+        for key, size, last_access, meta in entries:
+            print('{} {:>4} {:>10.1f} KB  {}  {}'.format(key[:16], meta.get('kind', '?'), size / 1024,
+                                                       time.strftime('%Y-%m-%d %H:%M', time.localtime(last_access)),
+                                                       meta.get('video', '')))
+        print('{} entries, {:.1f} MB in {}'.format(len(entries), sum(entry[1] for entry in entries) / 1024 ** 2,
+                                                   args.cache_dir))
+    elif args.action == 'invalidate':
+        if not args.videos and not args.all:
+            print('Give the videos to invalidate, or --all')
+            sys.exit(1)
+        num_removed = result_cache.invalidate(None if args.all else args.videos)
+        print(num_removed, 'entries removed')
+    else:
+        print(result_cache.evict(), 'entries evicted')
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', type=str, default=default_cache_dir, help='directory of the result cache')
+    parser.add_argument('--cache-size', type=float, default=10., help='size bound of the result cache (GB)')
+
+
+def add_video_arguments(parser):
+    parser.add_argument('video', type=str, help='input video path')
+    parser.add_argument('-np', '--num-person', type=int, default=1, help='maximum number of estimated human poses')
+    parser.add_argument('-o', '--output', type=str, default=None, help='output file, in ./output if not set')
+
+
+def add_pose_arguments(parser):
+    add_video_arguments(parser)
+    parser.add_argument('-rf', '--receptive-field', type=int, default=27, help='number of receptive fields')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of processes generating the 2D poses of time segments of the video, 0 for all CPUs')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='generate the 2D and 3D poses again instead of reusing the cached results')
+    add_cache_arguments(parser)
+
+
+def arg_parse(argv=None):
+    parser = argparse.ArgumentParser('3D pose estimation and golf swing analysis.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    extract_parser = subparsers.add_parser('extract-2d', help='2D keypoints of a video (.json or .kpts)')
+    add_video_arguments(extract_parser)
+    extract_parser.set_defaults(func=extract_2d)
+
+    lift_parser = subparsers.add_parser('lift-3d', help='3D poses of a video (.npz)')
+    add_pose_arguments(lift_parser)
+    lift_parser.add_argument('-s', '--stream', action='store_true',
+                             help='generate 3D poses while the video is processed')
+    lift_parser.add_argument('-sc', '--stream-chunk', type=int, default=1,
+                             help='minimum number of frames lifted at once in the streaming mode')
+    lift_parser.set_defaults(func=lift_3d)
+
+    render_parser = subparsers.add_parser('render', help='animation of the 3D poses of a video')
+    add_pose_arguments(render_parser)
+    render_parser.add_argument('-mpl', '--matplotlib', action='store_true',
+                               help='render the animation with matplotlib instead of OpenCV')
+    render_parser.set_defaults(func=render)
+
+    batch_parser = subparsers.add_parser('batch', help='3D poses of a directory or a manifest of videos')
+    batch_parser.add_argument('input', type=str, help='directory of videos, a video or a manifest')
+    batch_parser.add_argument('-o', '--output', type=str, default='./output/batch', help='output directory')
+    batch_parser.add_argument('-rf', '--receptive-field', type=int, default=27, help='number of receptive fields')
+    batch_parser.add_argument('-np', '--num-person', type=int, default=1, help='maximum number of estimated human poses')
+    batch_parser.add_argument('-j', '--workers', type=int, default=1,
+                              help='number of worker processes, each with its own models. 0 for all CPUs')
+    batch_parser.add_argument('--progress', type=str, default=None,
+                              help='progress file, <output>/progress.jsonl if not set')
+    batch_parser.add_argument('--skip-failed', action='store_true', help='do not retry the videos that failed before')
+    batch_parser.add_argument('--no-cache', action='store_true',
+                              help='generate the 2D and 3D poses again instead of reusing the cached results')
+    add_cache_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch)
+
+    score_parser = subparsers.add_parser('score', help='swing metrics of a swing JSON file, or a table of many')
+    score_parser.add_argument('input', type=str, help='swing JSON file, directory of swing JSON files or manifest')
+    score_parser.add_argument('-m', '--metrics', type=str, nargs='*', default=None,
+                              help='metrics computed for a single swing, all if not set')
+    score_parser.add_argument('-o', '--output', type=str, default=None,
+                              help='output .csv or .parquet table of a directory or a manifest')
+    score_parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    score_parser.add_argument('--fps', type=float, default=30., help='frame rate of the swing videos')
+    score_parser.set_defaults(func=score)
+
+    phases_parser = subparsers.add_parser('phases', help='address, top, impact and finish frames of a swing')
+    phases_parser.add_argument('json_file', type=str, help='swing JSON file')
+    phases_parser.add_argument('-p', '--plot', action='store_true', help='plot the left wrist height and the phases')
+    phases_parser.set_defaults(func=phases)
+
+    cache_parser = subparsers.add_parser('cache', help='list, invalidate or prune the cached 2D and 3D poses')
+    cache_parser.add_argument('action', choices=['list', 'invalidate', 'prune'])
+    cache_parser.add_argument('videos', type=str, nargs='*', help='videos whose results are invalidated')
+    cache_parser.add_argument('--all', action='store_true', help='invalidate every cached result')
+    add_cache_arguments(cache_parser)
+    cache_parser.set_defaults(func=cache)
+
+    return parser.parse_args(argv)
+
+
+def main():
+    args = arg_parse()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 import numpy as np
 import torch
 
-from tools.utils import wrap
-from common.quaternion import qort, qinverse
+from common.geometry import qrot_points
 
 
 def normalize_screen_coordinates(X, w, h):
@@ -20,12 +19,11 @@ def image_coordinates(X, w, h):
 
 
 def world_to_camera(X, R, t):
-    Rt = wrap(qinverse, R)  # Invert rotation
-    return wrap(qort, np.tile(Rt, (*X.shape[:-1], 1)), X - t)  # Rotate and translate
+    return qrot_points(R, X - t, inverse=True)  # Invert rotation, rotate and translate
 
 
 def camera_to_world(X, R, t):
-    return wrap(qort, np.tile(R, (*X.shape[:-1], 1)), X) + t
+    return qrot_points(R, X) + t
 
 
 def project_to_2d(X, camera_params):
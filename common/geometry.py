@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+
+
+def quaternion_to_matrix(q, inverse=False):
+    """
+    Convert a quaternion q = (w, x, y, z) of shape (*, 4) to the rotation matrix of shape (*, 3, 3)
+    that rotates vectors in the same way as common.quaternion.qort.
+    Works on both NumPy arrays and torch tensors, and returns the same type as q.
+
+    Arguments:
+    q -- quaternion(s), assumed to be normalized when inverse is True
+    inverse -- return the matrix of the inverse rotation (see common.quaternion.qinverse)
+    """
+    assert q.shape[-1] == 4
+
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    if inverse:
+        x, y, z = -x, -y, -z
+
+    # R = I + 2w[u]x + 2[u]x^2, with u = (x, y, z)
+    rows = [1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+            2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+            2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)]
+
+    if isinstance(q, torch.Tensor):
+        R = torch.stack(rows, dim=-1)
+    else:
+        R = np.stack(rows, axis=-1)
+    return R.reshape(*q.shape[:-1], 3, 3)
+
+
+def rotate(X, R):
+    """
+    Rotate the points X of shape (*, 3) with a single rotation matrix R of shape (3, 3).
+    All points are transformed with one batched matmul.
+    """
+    assert X.shape[-1] == 3
+    assert R.shape == (3, 3)
+
+    if isinstance(X, torch.Tensor):
+        if not isinstance(R, torch.Tensor):
+            R = torch.from_numpy(np.asarray(R))
+        R = R.to(device=X.device, dtype=X.dtype)
+        return torch.matmul(X, R.t())
+    else:
+        return np.matmul(X, np.asarray(R, dtype=np.result_type(X, R)).T)
+
+
+def qrot_points(q, X, inverse=False):
+    """
+    Rotate the points X of shape (*, 3) about the rotation described by a single quaternion q of shape (4,).
+    Equivalent to qort(np.tile(q, (*X.shape[:-1], 1)), X) without tiling the quaternion.
+    """
+    assert q.shape == (4,)
+    return rotate(X, quaternion_to_matrix(q, inverse=inverse))
@@ -7,6 +7,7 @@ import re
 from glob import glob
 from shutil import rmtree
 from data.data_utils import suggest_metadata, suggest_pose_importer
+from data.shard_utils import convert_files, save_array_tree
 
 import sys
 sys.path.append('../')
@@ -21,6 +22,32 @@ cam_map = {
     '60457274': 3,
 }
 
+
+def convert_detection_file(arg):
+    f, import_func, num_joints = arg
+    path, fname = os.path.split(f)
+    subject = os.path.basename(path)
+
+    m = re.search('(.*)\\.([0-9]+)\\.mp4\\.npz', fname)
+    action = m.group(1)
+    camera = m.group(2)
+    camera_idx = cam_map[camera]
+
+    if subject == 'S11' and action == 'Directions':
+        return {} # Discard corrupted video
+
+    # Use consistent naming convention
+    canonical_name = action.replace('TakingPhoto', 'Photo') \
+                           .replace('WalkingDog', 'WalkDog')
+
+    keypoints = import_func(f)
+    assert keypoints.shape[1] == num_joints
+
+    cameras = [None, None, None, None]
+    cameras[camera_idx] = keypoints.astype('float32')
+    return {'positions_2d': {subject: {canonical_name: cameras}}}
+
+
 if __name__ == '__main__':
     if os.path.basename(os.getcwd()) != 'data':
         print('This script must be launched from the "data" directory')
@@ -30,6 +57,8 @@ if __name__ == '__main__':
     
     parser.add_argument('-i', '--input', default='', type=str, metavar='PATH', help='input path to 2D detections')
     parser.add_argument('-o', '--output', default='', type=str, metavar='PATH', help='output suffix for 2D detections (e.g. detectron_pt_coco)')
+    parser.add_argument('-j', '--workers', default=None, type=int, help='number of conversion processes (default: all CPUs)')
+    parser.add_argument('--mmap', action='store_true', help='also save every array as .npy files for memory mapping')
     
     args = parser.parse_args()
         
@@ -46,7 +75,7 @@ if __name__ == '__main__':
 
     print('Parsing 2D detections from', args.input)
 
-    output = {}
+    tasks = {}
     file_list = glob(args.input + '/S*/*.mp4.npz')
     for f in file_list:
         path, fname = os.path.split(f)
@@ -55,28 +84,18 @@ if __name__ == '__main__':
 
         if '_ALL' in fname:
             continue
-        
-        m = re.search('(.*)\\.([0-9]+)\\.mp4\\.npz', fname)
-        action = m.group(1)
-        camera = m.group(2)
-        camera_idx = cam_map[camera]
-        
-        if subject == 'S11' and action == 'Directions':
-            continue # Discard corrupted video
-        
-        # Use consistent naming convention
-        canonical_name = action.replace('TakingPhoto', 'Photo') \
-                               .replace('WalkingDog', 'WalkDog')
 
-        keypoints = import_func(f)
-        assert keypoints.shape[1] == metadata['num_joints']
-        
-        if subject not in output:
-            output[subject] = {}
-        if canonical_name not in output[subject]:
-            output[subject][canonical_name] = [None, None, None, None]
-        output[subject][canonical_name][camera_idx] = keypoints.astype('float32')
+        if subject not in tasks:
+            tasks[subject] = []
+        tasks[subject].append((f, import_func, metadata['num_joints']))
+
+    shard_dir = 'shards_' + output_prefix_2d + args.output
+    output = convert_files(tasks, convert_detection_file, shard_dir, args.workers,
+                           {'source': os.path.abspath(args.input), 'metadata': metadata}).get('positions_2d', {})
 
     print('Saving...')
     np.savez_compressed(output_prefix_2d + args.output, positions_2d=output, metadata=metadata)
+    if args.mmap:
+        save_array_tree(output, output_prefix_2d + args.output)
+    rmtree(shard_dir)
     print('Done.')
\ No newline at end of file
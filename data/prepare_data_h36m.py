@@ -11,11 +11,45 @@ sys.path.append('../')
 from common.h36m_dataset import Human36mDataset
 from common.camera import world_to_camera, project_to_2d, image_coordinates
 from tools.utils import wrap
+from data.shard_utils import convert_files, save_array_tree
 
 output_filename = 'data_3d_h36m'
 output_filename_2d = 'data_2d_h36m_gt'
 subjects = ['S1', 'S5', 'S6', 'S7', 'S8', 'S9', 'S11']
 
+
+def convert_archive_file(arg):
+    subject, f = arg
+    action = os.path.splitext(os.path.basename(f))[0]
+
+    if subject == 'S11' and action == 'Directions':
+        return {} # Discard corrupted video
+
+    with h5py.File(f) as hf:
+        positions = hf['3D_positions'].value.reshape(32, 3, -1).transpose(2, 0, 1)
+        positions /= 1000 # Meters instead of millimeters
+    return {'positions_3d': {subject: {action: positions.astype('float32')}}}
+
+
+def convert_source_file(arg):
+    from scipy.io import loadmat
+
+    subject, f = arg
+    action = os.path.splitext(os.path.splitext(os.path.basename(f))[0])[0]
+
+    if subject == 'S11' and action == 'Directions':
+        return {} # Discard corrupted video
+
+    # Use consistent naming convention
+    canonical_name = action.replace('TakingPhoto', 'Photo') \
+                           .replace('WalkingDog', 'WalkDog')
+
+    hf = loadmat(f)
+    positions = hf['data'][0, 0].reshape(-1, 32, 3)
+    positions /= 1000 # Meters instead of millimeters
+    return {'positions_3d': {subject: {canonical_name: positions.astype('float32')}}}
+
+
 if __name__ == '__main__':
     if os.path.basename(os.getcwd()) != 'data':
         print('This script must be launched from the "data" directory')
@@ -28,6 +62,9 @@ if __name__ == '__main__':
     
     # Alternatively, convert dataset from original source (the Human3.6M dataset path must be specified manually)
     parser.add_argument('--from-source', default='', type=str, metavar='PATH', help='convert original dataset')
+
+    parser.add_argument('-j', '--workers', default=None, type=int, help='number of conversion processes (default: all CPUs)')
+    parser.add_argument('--mmap', action='store_true', help='also save every array as .npy files for memory mapping')
     
     args = parser.parse_args()
     
@@ -45,21 +82,16 @@ if __name__ == '__main__':
             archive.extractall()
         
         print('Converting...')
-        output = {}
+        tasks = {}
         for subject in subjects:
-            output[subject] = {}
             file_list = glob('h36m/' + subject + '/MyPoses/3D_positions/*.h5')
             assert len(file_list) == 30, "Expected 30 files for subject " + subject + ", got " + str(len(file_list))
-            for f in file_list:
-                action = os.path.splitext(os.path.basename(f))[0]
-                
-                if subject == 'S11' and action == 'Directions':
-                    continue # Discard corrupted video
-                
-                with h5py.File(f) as hf:
-                    positions = hf['3D_positions'].value.reshape(32, 3, -1).transpose(2, 0, 1)
-                    positions /= 1000 # Meters instead of millimeters
-                    output[subject][action] = positions.astype('float32')
+            tasks[subject] = [(subject, f) for f in file_list]
+        shard_dir = 'shards_' + output_filename + '_archive'
+        output = convert_files(tasks, convert_archive_file, shard_dir, args.workers,
+                               {'source': os.path.abspath(args.from_archive)}).get('positions_3d', {})
+        # Every subject is kept, even if all of its files were discarded
+        output = {subject: output.get(subject, {}) for subject in subjects}
         
         print('Saving...')
         np.savez_compressed(output_filename, positions_3d=output)
@@ -71,28 +103,16 @@ if __name__ == '__main__':
                 
     elif args.from_source:
         print('Converting original Human3.6M dataset from', args.from_source)
-        output = {}
-        
-        from scipy.io import loadmat
-        
+        tasks = {}
         for subject in subjects:
-            output[subject] = {}
             file_list = glob(args.from_source + '/' + subject + '/MyPoseFeatures/D3_Positions/*.cdf.mat')
             assert len(file_list) == 30, "Expected 30 files for subject " + subject + ", got " + str(len(file_list))
-            for f in file_list:
-                action = os.path.splitext(os.path.splitext(os.path.basename(f))[0])[0]
-                
-                if subject == 'S11' and action == 'Directions':
-                    continue # Discard corrupted video
-                    
-                # Use consistent naming convention
-                canonical_name = action.replace('TakingPhoto', 'Photo') \
-                                       .replace('WalkingDog', 'WalkDog')
-                
-                hf = loadmat(f)
-                positions = hf['data'][0, 0].reshape(-1, 32, 3)
-                positions /= 1000 # Meters instead of millimeters
-                output[subject][canonical_name] = positions.astype('float32')
+            tasks[subject] = [(subject, f) for f in file_list]
+        shard_dir = 'shards_' + output_filename + '_source'
+        output = convert_files(tasks, convert_source_file, shard_dir, args.workers,
+                               {'source': os.path.abspath(args.from_source)}).get('positions_3d', {})
+        # Every subject is kept, even if all of its files were discarded
+        output = {subject: output.get(subject, {}) for subject in subjects}
         
         print('Saving...')
         np.savez_compressed(output_filename, positions_3d=output)
@@ -102,6 +122,11 @@ if __name__ == '__main__':
     else:
         print('Please specify the dataset source')
         exit(0)
+
+    # The shards are only needed to resume an interrupted conversion
+    rmtree(shard_dir)
+    if args.mmap:
+        save_array_tree(output, output_filename)
         
     # Create 2D pose file
     print('')
@@ -127,5 +152,7 @@ if __name__ == '__main__':
         'keypoints_symmetry': [dataset.skeleton().joints_left(), dataset.skeleton().joints_right()]
     }
     np.savez_compressed(output_filename_2d, positions_2d=output_2d_poses, metadata=metadata)
+    if args.mmap:
+        save_array_tree(output_2d_poses, output_filename_2d)
     
     print('Done.')
@@ -7,6 +7,7 @@ import re
 from glob import glob
 from shutil import rmtree
 from data.data_utils import suggest_metadata, suggest_pose_importer
+from data.shard_utils import convert_files, save_array_tree
 
 import sys
 sys.path.append('../')
@@ -94,6 +95,88 @@ sync_data = {
     'S4': {}
 }
 
+
+def convert_mocap_file(arg):
+    from scipy.io import loadmat
+
+    subject, f = arg
+    split, subject_name = subject.split('/')
+    action = os.path.splitext(os.path.basename(f))[0]
+
+    # Use consistent naming convention
+    canonical_name = action.replace('_', ' ')
+
+    hf = loadmat(f)
+    positions = hf['poses_3d']
+    positions_2d = hf['poses_2d'].transpose(1, 0, 2, 3) # Ground-truth 2D poses
+    assert positions.shape[0] == positions_2d.shape[0] and positions.shape[1] == positions_2d.shape[2]
+
+    # Sanity check for the sequence length
+    assert positions.shape[0] == index[subject][canonical_name][1] - index[subject][canonical_name][0]
+
+    # Split corrupted motion capture streams into contiguous chunks
+    # e.g. 012XX567X9 is split into "012", "567", and "9".
+    all_chunks = [list(v) for k, v in groupby(positions, lambda x: np.isfinite(x).all())]
+    all_chunks_2d = [list(v) for k, v in groupby(positions_2d, lambda x: np.isfinite(x).all())]
+    assert len(all_chunks) == len(all_chunks_2d)
+    current_index = index[subject][canonical_name][0]
+    chunk_indices = []
+    output = {}
+    output_2d = {}
+    for i, chunk in enumerate(all_chunks):
+        next_index = current_index + len(chunk)
+        name = canonical_name + ' chunk' + str(i)
+        if np.isfinite(chunk).all():
+            output[name] = np.array(chunk, dtype='float32') / 1000
+            output_2d[name] = list(np.array(all_chunks_2d[i], dtype='float32').transpose(1, 0, 2, 3))
+        chunk_indices.append((current_index, next_index, np.isfinite(chunk).all(), split, name))
+        current_index = next_index
+    assert current_index == index[subject][canonical_name][1]
+
+    return {'positions_3d': {subject: output}, 'positions_2d': {subject: output_2d},
+            'frame_mapping': {subject: {canonical_name: chunk_indices}},
+            'num_joints': {subject: {canonical_name: positions.shape[1]}}}
+
+
+def convert_detection_file(arg):
+    f, import_func, num_joints, frame_mapping = arg
+    path, fname = os.path.split(f)
+    subject = os.path.basename(path)
+
+    m = re.search('(.*) \\((.*)\\)', fname.replace('_', ' '))
+    action = m.group(1)
+    camera = m.group(2)
+    camera_idx = cam_map[camera]
+
+    keypoints = import_func(f)
+    assert keypoints.shape[1] == num_joints
+
+    if action in sync_data[subject]:
+        sync_offset = sync_data[subject][action][camera_idx] - 1
+    else:
+        sync_offset = 0
+
+    output = {}
+    if subject in frame_mapping and action in frame_mapping[subject]:
+        chunks = frame_mapping[subject][action]
+        for (start_idx, end_idx, labeled, split, name) in chunks:
+            canonical_subject = split + '/' + subject
+            if not labeled:
+                canonical_subject = 'Unlabeled/' + canonical_subject
+            if canonical_subject not in output:
+                output[canonical_subject] = {}
+            kps = keypoints[start_idx+sync_offset:end_idx+sync_offset]
+            assert len(kps) == end_idx - start_idx, "Got len {}, expected {}".format(len(kps), end_idx - start_idx)
+
+            output[canonical_subject][name] = [None, None, None]
+            output[canonical_subject][name][camera_idx] = kps.astype('float32')
+    else:
+        canonical_subject = 'Unlabeled/' + subject
+        output[canonical_subject] = {action: [None, None, None]}
+        output[canonical_subject][action][camera_idx] = keypoints.astype('float32')
+    return {'positions_2d': output}
+
+
 if __name__ == '__main__':
     if os.path.basename(os.getcwd()) != 'data':
         print('This script must be launched from the "data" directory')
@@ -105,6 +188,8 @@ if __name__ == '__main__':
     parser.add_argument('--convert-3d', action='store_true', help='convert 3D mocap data')
     parser.add_argument('--convert-2d', default='', type=str, metavar='PATH', help='convert user-supplied 2D detections')
     parser.add_argument('-o', '--output', default='', type=str, metavar='PATH', help='output suffix for 2D detections (e.g. detectron_pt_coco)')
+    parser.add_argument('-j', '--workers', default=None, type=int, help='number of conversion processes (default: all CPUs)')
+    parser.add_argument('--mmap', action='store_true', help='also save every array as .npy files for memory mapping')
     
     args = parser.parse_args()
         
@@ -115,57 +200,30 @@ if __name__ == '__main__':
  
     if args.path:
         print('Parsing HumanEva dataset from', args.path)
+        tasks = {}
+        for subject in subjects:
+            file_list = glob(args.path + '/' + subject + '/*.mat')
+            tasks[subject] = [(subject, f) for f in file_list]
+        outputs = convert_files(tasks, convert_mocap_file, 'shards_humaneva_mocap', args.workers,
+                                {'source': os.path.abspath(args.path)})
+
         output = {}
         output_2d = {}
         frame_mapping = {}
-        
-        from scipy.io import loadmat
-        
         num_joints = None
-        
         for subject in subjects:
-            output[subject] = {}
-            output_2d[subject] = {}
+            output[subject] = outputs.get('positions_3d', {}).get(subject, {})
+            output_2d[subject] = outputs.get('positions_2d', {}).get(subject, {})
             split, subject_name = subject.split('/')
             if subject_name not in frame_mapping:
                 frame_mapping[subject_name] = {}
-            
-            file_list = glob(args.path + '/' + subject + '/*.mat')
-            for f in file_list:
-                action = os.path.splitext(os.path.basename(f))[0]
-                    
-                # Use consistent naming convention
-                canonical_name = action.replace('_', ' ')
-                
-                hf = loadmat(f)
-                positions = hf['poses_3d']
-                positions_2d = hf['poses_2d'].transpose(1, 0, 2, 3) # Ground-truth 2D poses
-                assert positions.shape[0] == positions_2d.shape[0] and positions.shape[1] == positions_2d.shape[2]
-                assert num_joints is None or num_joints == positions.shape[1], "Joint number inconsistency among files"
-                num_joints = positions.shape[1]
-                
-                # Sanity check for the sequence length
-                assert positions.shape[0] == index[subject][canonical_name][1] - index[subject][canonical_name][0]
-                
-                # Split corrupted motion capture streams into contiguous chunks
-                # e.g. 012XX567X9 is split into "012", "567", and "9".
-                all_chunks = [list(v) for k, v in groupby(positions, lambda x: np.isfinite(x).all())]
-                all_chunks_2d = [list(v) for k, v in groupby(positions_2d, lambda x: np.isfinite(x).all())]
-                assert len(all_chunks) == len(all_chunks_2d)
-                current_index = index[subject][canonical_name][0]
-                chunk_indices = []
-                for i, chunk in enumerate(all_chunks):
-                    next_index = current_index + len(chunk)
-                    name = canonical_name + ' chunk' + str(i)
-                    if np.isfinite(chunk).all():
-                        output[subject][name] = np.array(chunk, dtype='float32') / 1000
-                        output_2d[subject][name] = list(np.array(all_chunks_2d[i], dtype='float32').transpose(1, 0, 2, 3))
-                    chunk_indices.append((current_index, next_index, np.isfinite(chunk).all(), split, name))
-                    current_index = next_index
-                assert current_index == index[subject][canonical_name][1]
+            for canonical_name, chunk_indices in outputs.get('frame_mapping', {}).get(subject, {}).items():
                 if canonical_name not in frame_mapping[subject_name]:
                     frame_mapping[subject_name][canonical_name] = []
                 frame_mapping[subject_name][canonical_name] += chunk_indices
+            for file_num_joints in outputs.get('num_joints', {}).get(subject, {}).values():
+                assert num_joints is None or num_joints == file_num_joints, "Joint number inconsistency among files"
+                num_joints = file_num_joints
         
         metadata = suggest_metadata('humaneva' + str(num_joints))
         output_filename = 'data_3d_' + metadata['layout_name']
@@ -175,7 +233,11 @@ if __name__ == '__main__':
             print('Saving...')
             np.savez_compressed(output_filename, positions_3d=output)
             np.savez_compressed(output_prefix_2d + 'gt', positions_2d=output_2d, metadata=metadata)
+            if args.mmap:
+                save_array_tree(output, output_filename)
+                save_array_tree(output_2d, output_prefix_2d + 'gt')
             print('Done.')
+        rmtree('shards_humaneva_mocap')
         
     else:
         print('Please specify the dataset source')
@@ -191,49 +253,24 @@ if __name__ == '__main__':
             
         print('Parsing 2D detections from', args.convert_2d)
         
-        output = {}
+        tasks = {}
         file_list = glob(args.convert_2d + '/S*/*.avi.npz')
         for f in file_list:
             path, fname = os.path.split(f)
             subject = os.path.basename(path)
             assert subject.startswith('S'), subject + ' does not look like a subject directory'
-            
-            m = re.search('(.*) \\((.*)\\)', fname.replace('_', ' '))
-            action = m.group(1)
-            camera = m.group(2)
-            camera_idx = cam_map[camera]
-            
-            keypoints = import_func(f)
-            assert keypoints.shape[1] == metadata['num_joints']
-            
-            if action in sync_data[subject]:
-                sync_offset = sync_data[subject][action][camera_idx] - 1
-            else:
-                sync_offset = 0
-
-            if subject in frame_mapping and action in frame_mapping[subject]:
-                chunks = frame_mapping[subject][action]
-                for (start_idx, end_idx, labeled, split, name) in chunks:
-                    canonical_subject = split + '/' + subject
-                    if not labeled:
-                        canonical_subject = 'Unlabeled/' + canonical_subject
-                    if canonical_subject not in output:
-                        output[canonical_subject] = {}
-                    kps = keypoints[start_idx+sync_offset:end_idx+sync_offset]
-                    assert len(kps) == end_idx - start_idx, "Got len {}, expected {}".format(len(kps), end_idx - start_idx)
-                    
-                    if name not in output[canonical_subject]:
-                        output[canonical_subject][name] = [None, None, None]
-                    
-                    output[canonical_subject][name][camera_idx] = kps.astype('float32')
-            else:
-                canonical_subject = 'Unlabeled/' + subject
-                if canonical_subject not in output:
-                    output[canonical_subject] = {}
-                if action not in output[canonical_subject]:
-                        output[canonical_subject][action] = [None, None, None]
-                output[canonical_subject][action][camera_idx] = keypoints.astype('float32')
+            if subject not in tasks:
+                tasks[subject] = []
+            tasks[subject].append((f, import_func, metadata['num_joints'], frame_mapping))
+
+        shard_dir = 'shards_' + output_prefix_2d + args.output
+        # The detections are cut into the chunks of the mocap data
+        config = {'source': os.path.abspath(args.convert_2d), 'metadata': metadata, 'frame_mapping': frame_mapping}
+        output = convert_files(tasks, convert_detection_file, shard_dir, args.workers, config).get('positions_2d', {})
                 
         print('Saving...')
         np.savez_compressed(output_prefix_2d + args.output, positions_2d=output, metadata=metadata)
+        if args.mmap:
+            save_array_tree(output, output_prefix_2d + args.output)
+        rmtree(shard_dir)
         print('Done.')
\ No newline at end of file
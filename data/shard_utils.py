@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import os.path as osp
+from multiprocessing import Pool
+import numpy as np
+
+
+def merge_outputs(output, fragment):
+    # Merge nested dicts. Lists of cameras are merged element by element, missing cameras are None
+    for key, value in fragment.items():
+        if key not in output:
+            output[key] = value
+        elif isinstance(value, dict):
+            merge_outputs(output[key], value)
+        elif isinstance(value, list):
+            output[key] = [a if b is None else b for a, b in zip(output[key], value)]
+        else:
+            output[key] = value
+    return output
+
+
+def shard_path(shard_dir, subject):
+    return osp.join(shard_dir, subject.replace('/', '_') + '.npz')
+
+
+config_name = '__config__'
+
+
+def save_shard(path, outputs, config=''):
+    # Written under a temporary name first, so that an interrupted run never leaves a partial shard
+    with open(path + '.part', 'wb') as f:
+        np.savez(f, **outputs, **{config_name: np.array(config)})
+    os.replace(path + '.part', path)
+
+
+def load_shard(path):
+    data = np.load(path, allow_pickle=True)
+    return {name: data[name].item() for name in data.files if name != config_name}
+
+
+def shard_config(path):
+    # The configuration of the conversion that wrote a shard, None if there is no readable shard
+    try:
+        with np.load(path, allow_pickle=True) as data:
+            return str(data[config_name]) if config_name in data.files else None
+    except (OSError, ValueError):
+        return None
+
+
+def _convert_task(task):
+    convert_file, subject, arg = task
+    return subject, convert_file(arg)
+
+
+def convert_files(tasks, convert_file, shard_dir, num_workers=None, config=None):
+    """
+    Convert files over a process pool. The results of every subject are saved in a shard as soon as all of its files
+    are converted, so an interrupted run only converts the remaining subjects again.
+
+    tasks -- dict subject -> list of arguments of convert_file
+    convert_file -- picklable function returning a dict output name -> nested dict (e.g. {subject: {action: array}})
+    config -- JSON-serializable options of the conversion (e.g. the source path, the metadata). A shard is only
+              reused by a run with the same convert_file and config, it stores their SHA-256
+    Returns the dict output name -> nested dict of all subjects, merged in the order of tasks.
+    """
+    config = hashlib.sha256(json.dumps({'convert_file': convert_file.__name__, 'config': config}, sort_keys=True,
+                                       default=str).encode()).hexdigest()
+    os.makedirs(shard_dir, exist_ok=True)
+    todo = {subject: args for subject, args in tasks.items()
+            if shard_config(shard_path(shard_dir, subject)) != config}
+    if len(todo) < len(tasks):
+        print('Resuming:', len(tasks) - len(todo), 'of', len(tasks), 'subjects already converted in', shard_dir)
+
+    remaining = {subject: len(args) for subject, args in todo.items()}
+    fragments = {subject: {} for subject in todo}
+    for subject in [subject for subject, count in remaining.items() if count == 0]:
+        save_shard(shard_path(shard_dir, subject), fragments.pop(subject), config)
+
+    jobs = [(convert_file, subject, arg) for subject, args in todo.items() for arg in args]
+    if len(jobs) > 0:
+        with Pool(min(num_workers or os.cpu_count(), len(jobs))) as pool:
+            for subject, fragment in pool.imap_unordered(_convert_task, jobs):
+                merge_outputs(fragments[subject], fragment)
+                remaining[subject] -= 1
+                if remaining[subject] == 0:
+                    save_shard(shard_path(shard_dir, subject), fragments.pop(subject), config)
+                    print('Converted', subject)
+
+    outputs = {}
+    for subject in tasks:
+        merge_outputs(outputs, load_shard(shard_path(shard_dir, subject)))
+    return outputs
+
+
+def save_array_tree(tree, directory):
+    # Save every array of a nested dict as an uncompressed .npy file, which can be loaded with np.load(mmap_mode='r').
+    # Lists of cameras are saved as <name>.<camera index>.npy, missing cameras are skipped
+    for key, value in tree.items():
+        path = osp.join(directory, key)
+        if isinstance(value, dict):
+            save_array_tree(value, path)
+            continue
+
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        if isinstance(value, list):
+            for camera_idx, array in enumerate(value):
+                if array is not None:
+                    np.save(path + '.' + str(camera_idx) + '.npy', array)
+        else:
+            np.save(path + '.npy', value)
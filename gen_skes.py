@@ -5,7 +5,8 @@ import os
 import argparse
 import cv2
 import time
-import h5py
+import json
+from collections import deque
 from tqdm import tqdm
 
 sys.path.insert(0, osp.dirname(osp.realpath(__file__)))
@@ -15,17 +16,45 @@ from model.gast_net import SpatioTemporalModel, SpatioTemporalModelOptimized1f
 from common.skeleton import Skeleton
 from common.graph_utils import adj_mx_from_skeleton
 from common.generators import *
-from tools.vis_h36m import render_animation
-from tools.preprocess import load_kpts_json, h36m_coco_format, revise_kpts, revise_skes
-from tools.inference import gen_pose
-from tools.vis_kpts import plot_keypoint
+from tools.preprocess import load_kpts_json, h36m_coco_format, revise_kpts, revise_skes, h36m_coco_format_frame, \
+    SkesReviser, revise_skes_real_time
+from tools.inference import gen_pose, gen_pose_frame, StreamingPoseLifter
+from tools.live import LiveCapture, LatencyStats
+from tools import tracing, metrics
+sys.path.pop(0)
 
 cur_dir, chk_root, data_root, lib_root, output_root = get_path(__file__)
 model_dir = chk_root + 'gastnet/'
-sys.path.insert(1, lib_root)
-from lib.pose import gen_video_kpts as hrnet_pose
-sys.path.pop(1)
-sys.path.pop(0)
+
+
+def import_hrnet():
+    """
+    Import the HRNet and YOLOv3 modules (lib/pose). They load the HRNet configuration and the detector,
+    so they are only imported when 2D poses are generated
+    """
+    sys.path.insert(0, cur_dir)
+    sys.path.insert(1, lib_root)
+    import lib.pose as hrnet
+    sys.path.pop(1)
+    sys.path.pop(0)
+    return hrnet
+
+
+def hrnet_cache_config(video, cache, det_dim=416, num_person=1):
+    """
+    The configuration of the 2D keypoints of a video in the result cache: the video content, the YOLOv3 and HRNet
+    files and the detection options of gen_video_kpts
+    """
+    # The HRNet options as gen_video_kpts parses them
+    hrnet_args = import_hrnet().parse_args()
+    files = {'yolov3_weights': chk_root + 'yolov3/yolov3.weights',
+             'yolov3_cfg': lib_root + 'detector/yolov3/cfg/yolov3.cfg',
+             'hrnet_cfg': hrnet_args.cfg,
+             'hrnet_weights': hrnet_args.modelDir}
+    config = {name: cache.file_digest(path) for name, path in files.items()}
+    config.update({'video_digest': cache.file_digest(video), 'det_dim': det_dim,
+                   'thred_score': hrnet_args.thred_score, 'hrnet_opts': hrnet_args.opts, 'num_person': num_person})
+    return config
 
 
 skeleton = Skeleton(parents=[-1, 0, 1, 2, 0, 4, 5, 0, 7, 8, 9, 8, 11, 12, 8, 14, 15],
@@ -97,49 +126,87 @@ def load_model_layer(rf=27):
     return model_pos
 
 
-def generate_skeletons(video='', rf=27, output_animation=False, num_person=1, ab_dis=False):
+def generate_skeletons(video='', rf=27, output_animation=False, num_person=1, ab_dis=False, matplotlib=False,
+                       output=None, cache=None, num_workers=1, hrnet_models=None, model_pos=None):
     """
     :param video: The input video name. The video is placed in the Data folder
-    :param output_npz: The output file. If the output_npz is set to true, the output_animation must be false
     :param rf: receptive fields
     :param output_animation: Generating animation video
-    :param num_person: The number of 3D poses generated in the video. 1 or 2
+    :param num_person: The maximum number of 3D poses generated in the video
     :param ab_dis: Whether the 3D pose generates the absolute distance of the plane (x, y)
+    :param matplotlib: Render the animation with matplotlib instead of the faster OpenCV renderer
+    :param output: The output animation or npz file, in ./output named after the video if None
+    :param cache: tools.cache.ResultCache of the 2D keypoints and the 3D poses, not used if None
+    :param num_workers: The number of processes generating the 2D poses, every process handles a time segment
+    :param hrnet_models: The (YOLOv3, HRNet) models, loaded for this video if None
+    :param model_pos: The GAST-Net model of the receptive field rf, loaded for this video if None
     """
 
     # video = data_root + video
     cap = cv2.VideoCapture(video)
     width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
     height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-    keypoints, scores = hrnet_pose(video, det_dim=416, num_peroson=num_person, gen_output=True)
-    keypoints, scores, valid_frames = h36m_coco_format(keypoints, scores)
-    re_kpts = revise_kpts(keypoints, scores, valid_frames)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    kpts_config = hrnet_cache_config(video, cache, num_person=num_person) if cache is not None else None
+    kpts_key = cache.key('2d', **kpts_config) if cache is not None else None
+    cached = cache.get(kpts_key) if cache is not None else None
+    if cached is not None:
+        print('Loading the cached 2D poses ...')
+        keypoints, scores = cached['keypoints'], cached['scores']
+    else:
+        keypoints, scores = import_hrnet().gen_video_kpts(video, det_dim=416, num_peroson=num_person,
+                                                          gen_output=True, num_workers=num_workers,
+                                                          models=hrnet_models)
+        if cache is not None:
+            cache.put(kpts_key, {'keypoints': keypoints, 'scores': scores}, kind='2d', video=osp.abspath(video),
+                      video_digest=kpts_config['video_digest'])
+    with tracing.span('format_conversion'):
+        keypoints, scores, valid_frames = h36m_coco_format(keypoints, scores)
+        re_kpts = revise_kpts(keypoints, scores, valid_frames)
     num_person = len(re_kpts)
 
-    # Loading 3D pose model
-    model_pos = load_model_layer(rf)
-
-    print('Generating 3D human pose ...')
-    # pre-process keypoints
-
-    pad = (rf - 1) // 2  # Padding on each side
-    causal_shift = 0
-
-    # Generating 3D poses
-    prediction = gen_pose(re_kpts, valid_frames, width, height, model_pos, pad, causal_shift)
+    skes_key = None
+    cached = None
+    if cache is not None:
+        chk = model_dir + '{}_frame_model.bin'.format(rf)
+        skes_key = cache.key('3d', kpts_key=kpts_key, rf=rf, model=cache.file_digest(chk), ab_dis=ab_dis)
+        cached = cache.get(skes_key)
 
-    # Adding absolute distance to 3D poses and rebase the height
-    if num_person == 2:
-        prediction = revise_skes(prediction, re_kpts, valid_frames)
-    elif ab_dis:
-        prediction[0][:, :, 2] -= np.expand_dims(np.amin(prediction[0][:, :, 2], axis=1), axis=1).repeat([17], axis=1)
+    if cached is not None:
+        print('Loading the cached 3D poses ...')
+        prediction = [cached['reconstruction_%d' % i] for i in range(len(cached))]
     else:
-        prediction[0][:, :, 2] -= np.amin(prediction[0][:, :, 2])
-
-    # If output two 3D human poses, put them in the same 3D coordinate system
+        # Loading 3D pose model
+        if model_pos is None:
+            model_pos = load_model_layer(rf)
+
+        print('Generating 3D human pose ...')
+        # pre-process keypoints
+
+        pad = (rf - 1) // 2  # Padding on each side
+        causal_shift = 0
+
+        # Generating 3D poses, all people are lifted in one batch
+        prediction = gen_pose(re_kpts, valid_frames, width, height, model_pos, pad, causal_shift)
+        metrics.frames_total.inc(sum(len(frames) for frames in valid_frames), stage='lift_3d')
+
+        # Adding absolute distance to 3D poses and rebase the height
+        if num_person > 1:
+            prediction = revise_skes(prediction, re_kpts, valid_frames)
+        elif ab_dis:
+            prediction[0][:, :, 2] -= np.expand_dims(np.amin(prediction[0][:, :, 2], axis=1),
+                                                     axis=1).repeat([17], axis=1)
+        else:
+            prediction[0][:, :, 2] -= np.amin(prediction[0][:, :, 2])
+
+        if cache is not None:
+            cache.put(skes_key, {'reconstruction_%d' % i: pose for i, pose in enumerate(prediction)}, kind='3d',
+                      video=osp.abspath(video), video_digest=kpts_config['video_digest'])
+
+    # If output several 3D human poses, put them in the same 3D coordinate system
     same_coord = False
-    if num_person == 2:
+    if num_person > 1:
         same_coord = True
 
     anim_output = {}
@@ -147,19 +214,186 @@ def generate_skeletons(video='', rf=27, output_animation=False, num_person=1, ab
         anim_output.update({'Reconstruction %d' % (i+1): anim_prediction})
 
     if output_animation:
-        viz_output = './output/' + 'animation_' + video.split('/')[-1].split('.')[0] + '.mp4'
+        viz_output = output or './output/' + 'animation_' + video.split('/')[-1].split('.')[0] + '.mp4'
         print('Generating animation ...')
         # re_kpts: (M, T, N, 2) --> (T, M, N, 2)
         re_kpts = re_kpts.transpose(1, 0, 2, 3)
-        render_animation(re_kpts, keypoints_metadata, anim_output, skeleton, 25, 30000, np.array(70., dtype=np.float32),
-                         viz_output, input_video_path=video, viewport=(width, height), com_reconstrcution=same_coord)
+        if matplotlib:
+            from tools.vis_h36m import render_animation as render
+        else:
+            from tools.render_cv import render_animation as render
+        with tracing.span('render'):
+            render(re_kpts, keypoints_metadata, anim_output, skeleton, 25, 30000, np.array(70., dtype=np.float32),
+                   viz_output, input_video_path=video, viewport=(width, height), com_reconstrcution=same_coord)
     else:
         print('Saving 3D reconstruction...')
-        output_npz = './output/' + video.split('/')[-1].split('.')[0] + '.npz'
-        np.savez_compressed(output_npz, reconstruction=prediction)
+        output_npz = output or './output/' + video.split('/')[-1].split('.')[0] + '.npz'
+        with tracing.span('save'):
+            np.savez_compressed(output_npz, reconstruction=prediction, fps=fps)
         print('Completing saving...')
 
 
+def generate_skeletons_stream(video='', rf=27, num_person=1, ab_dis=False, chunk_size=1):
+    """
+    Streaming version of generate_skeletons. The 2D poses flow frame by frame through the format conversion,
+    the keypoint repair and GAST-Net, and every 3D pose is generated as soon as the receptive field after it is filled.
+    The memory does not depend on the length of the video
+    :param video: The input video path
+    :param rf: receptive fields
+    :param num_person: The maximum number of 3D poses generated in the video
+    :param ab_dis: Whether the 3D pose generates the absolute distance of the plane (x, y)
+    :param chunk_size: The minimum number of frames lifted in one forward pass of GAST-Net
+
+    :return: generator of 3D poses (M, 17, 3) and whether every person is visible (M, ), in frame order
+    """
+    cap = cv2.VideoCapture(video)
+    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+    # Loading 3D pose model
+    model_pos = load_model_layer(rf)
+    pad = (rf - 1) // 2  # Padding on each side
+
+    lifter = StreamingPoseLifter(model_pos, num_person, width, height, pad, chunk_size)
+    reviser = SkesReviser(num_person, ab_dis)
+
+    for _, keypoints, scores, _, _ in import_hrnet().iter_video_kpts(video, det_dim=416, num_peroson=num_person):
+        with tracing.span('format_conversion'):
+            re_kpts, _, valid = h36m_coco_format_frame(keypoints, scores)
+        for _, poses, re_kpts, valid in lifter.push(re_kpts, valid):
+            metrics.frames_total.inc(stage='lift_3d')
+            yield reviser(poses, re_kpts, valid), valid
+
+    for _, poses, re_kpts, valid in lifter.flush():
+        metrics.frames_total.inc(stage='lift_3d')
+        yield reviser(poses, re_kpts, valid), valid
+
+
+def video_fps(video):
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps
+
+
+def save_skeletons_stream(skeletons, output_npz, num_person=1, fps=0.):
+    """
+    Write the 3D poses of generate_skeletons_stream to disk as they arrive,
+    and pack them into the same npz file as generate_skeletons at the end
+    :param fps: The frame rate of the video, saved for the playback (0 if unknown)
+    """
+    part_file = output_npz + '.part'
+    num_frames = 0
+    with open(part_file, 'wb') as fw:
+        for poses, valid in skeletons:
+            # A single person is only saved in the frames where it is visible
+            if num_person == 1 and not valid[0]:
+                continue
+            with tracing.span('save'):
+                fw.write(poses.astype(np.float32).tobytes())
+            num_frames += 1
+            metrics.frames_total.inc(stage='save')
+
+    if num_frames > 0:
+        # (T, M, N, 3) --> (M, T, N, 3)
+        prediction = np.memmap(part_file, dtype=np.float32, mode='r', shape=(num_frames, num_person, 17, 3))
+        prediction = prediction.transpose(1, 0, 2, 3)
+    else:
+        prediction = np.zeros((num_person, 0, 17, 3), dtype=np.float32)
+    with tracing.span('save'):
+        np.savez_compressed(output_npz, reconstruction=prediction, fps=fps)
+
+    del prediction
+    os.remove(part_file)
+
+
+def generate_skeletons_live(source='0', rf=81, num_person=1, det_dim=416, publish=None, report_interval=5.):
+    """
+    Generate 3D poses from a camera or a video stream with the causal GAST-Net.
+    Every tracked person keeps a sliding window of its last rf 2D poses, and the causal model lifts the newest
+    frame of every window in one forward pass. Frames that arrive while a frame is processed are dropped
+    :param source: A camera index or a video path. A video file is played at its native frame rate
+    :param rf: receptive fields of the causal model, 27 or 81
+    :param num_person: The maximum number of tracked people
+    :param det_dim: The input dimension of YOLOv3. [160, 320, 416]
+    :param publish: Called with (frame index, track IDs, 3D poses (M, 17, 3), latencies) for every processed frame
+    :param report_interval: Seconds between two prints of the latency statistics
+
+    :return: The latency statistics
+    """
+    hrnet = import_hrnet()
+    human_model, pose_model, people_sort, hrnet_args = hrnet.load_img_models(det_dim, argv=[])
+    model_pos = load_model_realtime(rf)
+
+    capture = LiveCapture(source)
+    width, height = capture.width, capture.height
+
+    windows = {}  # track ID --> last rf h36m keypoints
+    stats = LatencyStats()
+    last_report = time.time()
+    try:
+        while True:
+            item = capture.read()
+            if item is None:
+                break
+            frame_index, capture_time, frame = item
+            latencies = {}
+            start = time.time()
+            latencies['wait'] = start - capture_time
+
+            keypoints, scores, track_ids = hrnet.gen_img_kpts(frame, human_model, pose_model, people_sort, det_dim,
+                                                              num_person, hrnet_args)
+            latencies['2d'] = time.time() - start
+
+            track_ids = [] if track_ids is None else [int(track_id) for track_id in track_ids]
+            poses = np.zeros((0, 17, 3), dtype=np.float32)
+            if track_ids:
+                start = time.time()
+                num_tracks = len(track_ids)
+                with tracing.span('format_conversion'):
+                    re_kpts, _, valid = h36m_coco_format_frame(keypoints[:num_tracks], scores[:num_tracks, :, 0])
+                track_ids = [track_id for track_id, is_valid in zip(track_ids, valid) if is_valid]
+                re_kpts = re_kpts[valid]
+                for track_id, kpts in zip(track_ids, re_kpts):
+                    windows.setdefault(track_id, deque(maxlen=rf)).append(kpts)
+                latencies['format'] = time.time() - start
+
+                if track_ids:
+                    start = time.time()
+                    # A new track is edge-padded on the left until its window is filled
+                    batch = np.stack([np.pad(np.array(windows[track_id]), ((rf - len(windows[track_id]), 0),
+                                                                           (0, 0), (0, 0)), 'edge')
+                                      for track_id in track_ids])
+                    prediction = gen_pose_frame(batch, width, height, model_pos, pad=0)
+                    latencies['3d'] = time.time() - start
+
+                    start = time.time()
+                    poses = revise_skes_real_time(prediction, re_kpts, width)
+                    latencies['revise'] = time.time() - start
+
+            # Sort forgets lost tracks, so do their windows
+            for track_id in list(windows):
+                if track_id not in track_ids:
+                    del windows[track_id]
+
+            latencies['total'] = time.time() - capture_time
+            for stage, seconds in latencies.items():
+                stats.add(stage, seconds)
+            metrics.frames_total.inc(stage='live')
+            if publish is not None:
+                publish(frame_index, track_ids, poses, latencies)
+
+            if time.time() - last_report > report_interval:
+                print('Frame {} ({} dropped): {}'.format(frame_index, capture.num_dropped, stats))
+                last_report = time.time()
+    finally:
+        capture.release()
+
+    print('Processed {} frames, dropped {}: {}'.format(capture.num_read - capture.num_dropped, capture.num_dropped,
+                                                        stats))
+    return stats
+
+
 def arg_parse():
     """
     Parse arguments for the skeleton module
@@ -168,13 +402,88 @@ def arg_parse():
     parser.add_argument('-rf', '--receptive-field', type=int, default=81, help='number of receptive fields')
     parser.add_argument('-v', '--video', type=str, default='baseball.mp4', help='input video')
     parser.add_argument('-a', '--animation', action='store_true', help='output animation')
-    parser.add_argument('-np', '--num-person', type=int, default=1, help='number of estimated human poses. [1, 2]')
+    parser.add_argument('-mpl', '--matplotlib', action='store_true',
+                        help='render the animation with matplotlib instead of OpenCV')
+    parser.add_argument('-np', '--num-person', type=int, default=1, help='maximum number of estimated human poses')
+    parser.add_argument('-s', '--stream', action='store_true', help='generate 3D poses while the video is processed')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of processes generating the 2D poses of time segments of the video, 0 for all CPUs')
+    parser.add_argument('-sc', '--stream-chunk', type=int, default=1,
+                        help='minimum number of frames lifted at once in the streaming mode')
+    parser.add_argument('-l', '--live', type=str, default=None,
+                        help='camera index or video path lifted in real time with the causal model')
+    parser.add_argument('-lo', '--live-output', type=str, default=None,
+                        help='JSON lines file of the 3D poses generated in the live mode')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='reuse the 2D and 3D poses of a video already processed with the same models')
+    parser.add_argument('--cache-dir', type=str, default=output_root + 'cache', help='directory of the result cache')
+    parser.add_argument('--cache-size', type=float, default=10., help='size bound of the result cache (GB)')
+    parser.add_argument('-t', '--trace', type=str, default=None,
+                        help='Chrome trace JSON file of the processing stages (chrome://tracing or ui.perfetto.dev)')
+    parser.add_argument('-mp', '--metrics-port', type=int, default=None,
+                        help='serve the pipeline metrics in the Prometheus text format on this local port')
+    parser.add_argument('-mj', '--metrics-json', type=str, default=None,
+                        help='JSON file to which the pipeline metrics are dumped periodically')
+    parser.add_argument('-mi', '--metrics-interval', type=float, default=10., help='seconds between two JSON dumps')
     args = parser.parse_args()
+    if args.stream and args.animation:
+        parser.error('--stream saves the 3D poses, it cannot output an animation (-a)')
+    if args.matplotlib and not args.animation:
+        parser.error('-mpl selects the renderer of the animation, it needs -a')
 
     return args
 
 
 if __name__ == "__main__":
     args = arg_parse()
+    # The HRNet and YOLOv3 options are parsed from sys.argv, which holds the options of this script
+    del sys.argv[1:]
     video_path = data_root + 'video/' + args.video
-    generate_skeletons(video=video_path, output_animation=args.animation, num_person=args.num_person)
+    if args.trace is not None:
+        tracing.enable()
+    metrics_server, metrics_dumper = None, None
+    if args.metrics_port is not None or args.metrics_json is not None:
+        metrics.enable()
+    if args.metrics_port is not None:
+        metrics_server = metrics.start_http_server(args.metrics_port)
+    if args.metrics_json is not None:
+        metrics_dumper = metrics.JsonDumper(args.metrics_json, args.metrics_interval).start()
+
+    try:
+        if args.live is not None:
+            print('Generating 3D human pose in the live mode ...')
+            fw = open(args.live_output, 'w') if args.live_output else None
+
+            def publish(frame_index, track_ids, poses, latencies):
+                if fw is not None:
+                    fw.write(json.dumps({'frame_index': frame_index, 'track_ids': track_ids,
+                                         'poses': np.round(poses, 4).tolist()}) + '\n')
+
+            generate_skeletons_live(args.live, rf=args.receptive_field, num_person=args.num_person, publish=publish)
+            if fw is not None:
+                fw.close()
+        elif args.stream:
+            print('Generating 3D human pose in the streaming mode ...')
+            output_npz = './output/' + args.video.split('/')[-1].split('.')[0] + '.npz'
+            skeletons = generate_skeletons_stream(video=video_path, rf=args.receptive_field, num_person=args.num_person,
+                                                  chunk_size=args.stream_chunk)
+            save_skeletons_stream(skeletons, output_npz, num_person=args.num_person, fps=video_fps(video_path))
+            print('Completing saving...')
+        else:
+            cache = None
+            if args.cache:
+                from tools.cache import ResultCache
+                cache = ResultCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
+            generate_skeletons(video=video_path, output_animation=args.animation, num_person=args.num_person,
+                               matplotlib=args.matplotlib, cache=cache, num_workers=args.workers or None)
+    finally:
+        # A failed run still saves its trace and its last metrics
+        if metrics_dumper is not None:
+            metrics_dumper.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if args.trace is not None:
+            tracer = tracing.disable()
+            tracer.export_chrome_trace(args.trace)
+            print(tracer.report())
+            print('Saved the trace to', args.trace)
@@ -0,0 +1,264 @@
+"""
+Generate the 3D poses of a directory (or a manifest) of videos over a pool of worker processes.
+Every worker loads YOLOv3, HRNet and GAST-Net once and keeps them for all of its videos.
+The longest videos are scheduled first, so that a long video does not start last and delay the end of the run.
+The result of every video is appended to a progress file, and a run started again skips the videos already done.
+A worker killed by the system (out of memory, segfault) breaks the pool, which is restarted. Only the video that killed
+the worker fails: the other videos of the broken pool are processed again one at a time.
+"""
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import os.path as osp
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+
+video_exts = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm')
+
+
+def list_videos(path):
+    """
+    The videos of a directory (recursively), a single video, or a manifest with one video per line
+    (relative paths are resolved from the location of the manifest)
+    """
+    if osp.isdir(path):
+        return sorted(file for file in glob.glob(osp.join(path, '**', '*'), recursive=True)
+                      if file.lower().endswith(video_exts))
+    if path.lower().endswith(video_exts):
+        return [path]
+
+    root = osp.dirname(osp.abspath(path))
+    with open(path, 'r') as file:
+        lines = [line.strip() for line in file]
+    return [osp.join(root, line) for line in lines if line and not line.startswith('#')]
+
+
+def video_length(video):
+    import cv2
+    cap = cv2.VideoCapture(video)
+    length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return length
+
+
+def output_path(video, input_root, output_dir):
+    # The outputs mirror the directory structure of the inputs
+    name = osp.relpath(osp.abspath(video), input_root) if input_root else osp.basename(video)
+    return osp.join(output_dir, osp.splitext(name)[0] + '.npz')
+
+
+def load_progress(progress_file):
+    """
+    :return: {video: the last record of the video} of the progress file
+    """
+    progress = {}
+    if osp.exists(progress_file):
+        with open(progress_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut by an interrupted run
+                    continue
+                progress[record['video']] = record
+    return progress
+
+
+_worker = {}
+
+
+def init_worker(rf, det_dim, cache_dir, cache_size):
+    """
+    Load the models of a worker once. A failure is reported by every job of the worker,
+    an exception would make the pool start new workers forever
+    """
+    # The HRNet options are parsed from sys.argv, which holds the options of the batch runner
+    del sys.argv[1:]
+    try:
+        import gen_skes
+
+        hrnet = gen_skes.import_hrnet()
+        human_model, pose_model, _, _ = hrnet.load_img_models(det_dim, argv=[])
+        _worker['gen_skes'] = gen_skes
+        _worker['hrnet_models'] = (human_model, pose_model)
+        _worker['model_pos'] = gen_skes.load_model_layer(rf)
+        _worker['cache'] = None
+        if cache_dir:
+            from tools.cache import ResultCache
+            _worker['cache'] = ResultCache(cache_dir, int(cache_size * 1024 ** 3))
+    except (Exception, SystemExit):
+        _worker['init_error'] = traceback.format_exc()
+
+
+def process_video(job):
+    """
+    Generate the 3D poses of a video with the models of the worker. Errors are returned instead of raised,
+    so one broken video does not stop the batch
+    """
+    video, output, rf, num_person = job
+    record = {'video': video, 'output': output, 'pid': os.getpid()}
+    start = time.time()
+    if 'init_error' in _worker:
+        record.update({'status': 'error', 'error': 'Loading the models failed', 'traceback': _worker['init_error'],
+                       'seconds': 0.})
+        return record
+    try:
+        os.makedirs(osp.dirname(output) or '.', exist_ok=True)
+        _worker['gen_skes'].generate_skeletons(video=video, rf=rf, num_person=num_person, output=output,
+                                               cache=_worker['cache'], hrnet_models=_worker['hrnet_models'],
+                                               model_pos=_worker['model_pos'])
+        record['status'] = 'ok'
+    except (Exception, SystemExit) as e:
+        # The HRNet and YOLOv3 code may call exit(), which must not end the worker
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['traceback'] = traceback.format_exc()
+    record['seconds'] = time.time() - start
+    return record
+
+
+def run_batch(videos, output_dir, rf=27, num_person=1, num_workers=1, det_dim=416, input_root=None,
+              progress_file=None, retry_failed=True, cache_dir=None, cache_size=10.):
+    """
+    :param videos: The video paths
+    :param output_dir: The directory of the npz files
+    :param num_workers: The number of worker processes. Every worker holds its own copy of the models
+    :param input_root: The outputs are saved under output_dir with their path relative to input_root
+    :param progress_file: JSON lines of the finished videos, <output_dir>/progress.jsonl if None
+    :param retry_failed: Process the videos that failed in a previous run again
+    :param cache_dir: The directory of the tools.cache.ResultCache of the workers, no cache if None
+    :return: The records of the videos processed in this run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    progress_file = progress_file or osp.join(output_dir, 'progress.jsonl')
+    progress = load_progress(progress_file)
+
+    jobs = []
+    for video in videos:
+        output = output_path(video, input_root, output_dir)
+        record = progress.get(video)
+        if record is not None and (record['status'] == 'ok' and osp.exists(output) or
+                                   record['status'] == 'error' and not retry_failed):
+            continue
+        jobs.append((video, output, rf, num_person))
+    if len(jobs) < len(videos):
+        print('Resuming:', len(videos) - len(jobs), 'of', len(videos), 'videos already processed')
+
+    # Longest processing time first
+    lengths = {video: video_length(video) for video, *_ in jobs}
+    jobs.sort(key=lambda job: lengths[job[0]], reverse=True)
+
+    records = []
+    if len(jobs) == 0:
+        return records
+
+    num_workers = min(num_workers or os.cpu_count(), len(jobs))
+    with open(progress_file, 'a') as fw, tqdm(total=len(jobs)) as progress_bar:
+        def finish(record):
+            record['num_frames'] = lengths[record['video']]
+            fw.write(json.dumps({key: value for key, value in record.items() if key != 'traceback'}) + '\n')
+            fw.flush()
+            if record['status'] != 'ok':
+                print('Failed:', record['video'])
+                print(record['traceback'])
+            records.append(record)
+            progress_bar.update()
+
+        initargs = (rf, det_dim, cache_dir, cache_size)
+        suspects = []
+        while jobs:
+            jobs, lost = run_pool(jobs, num_workers, initargs, finish)
+            if len(lost) == 1:
+                finish(lost_record(*lost[0]))
+            else:
+                suspects += lost
+            if jobs:
+                print('A worker process died, restarting the pool for the', len(jobs), 'remaining videos')
+
+        # The videos lost together are processed again one at a time, only the video that kills its worker fails
+        suspects = [job for job, _ in suspects]
+        while suspects:
+            suspects, lost = run_pool(suspects, 1, initargs, finish)
+            for job_error in lost:
+                finish(lost_record(*job_error))
+    return records
+
+
+def run_pool(jobs, num_workers, initargs, finish):
+    """
+    Process the jobs in a pool of workers, at most one job per worker at a time, so that the jobs lost with a killed
+    worker are known
+    :param finish: Called with the record of every finished job
+    :return: The jobs not started when a worker died ([] when all jobs are done),
+             and the (job, error) of the jobs that were running in the pool when it broke
+    """
+    jobs = list(jobs)
+    running = {}
+    # The workers are spawned, CUDA cannot be used in forked processes
+    executor = ProcessPoolExecutor(min(num_workers, len(jobs)), mp_context=mp.get_context('spawn'),
+                                   initializer=init_worker, initargs=initargs)
+    try:
+        while jobs or running:
+            while jobs and len(running) < num_workers:
+                job = jobs.pop(0)
+                running[executor.submit(process_video, job)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            lost = []
+            for future in done:
+                job = running.pop(future)
+                try:
+                    finish(future.result())
+                except BrokenProcessPool as e:
+                    lost.append((job, e))
+            if lost:
+                # The other jobs of the pool are lost with it
+                lost += [(job, BrokenProcessPool('a worker process died')) for job in running.values()]
+                return jobs, lost
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [], []
+
+
+def lost_record(job, error):
+    video, output, *_ = job
+    error = f"{type(error).__name__}: {error}"
+    return {'video': video, 'output': output, 'pid': None, 'status': 'error', 'error': error, 'traceback': error,
+            'seconds': None}
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser('Batch generation of 3D poses.')
+    parser.add_argument('input', type=str, help='directory of videos, a video or a manifest')
+    parser.add_argument('-o', '--output', type=str, default='./output/batch', help='output directory of the npz files')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes, each with its own models. 0 for all CPUs')
+    parser.add_argument('-rf', '--receptive-field', type=int, default=27, help='number of receptive fields')
+    parser.add_argument('-np', '--num-person', type=int, default=1, help='maximum number of estimated human poses')
+    parser.add_argument('--progress', type=str, default=None, help='progress file, <output>/progress.jsonl if not set')
+    parser.add_argument('--skip-failed', action='store_true', help='do not retry the videos that failed before')
+    parser.add_argument('--cache-dir', type=str, default=None, help='directory of the result cache, no cache if not set')
+    parser.add_argument('--cache-size', type=float, default=10., help='size bound of the result cache (GB)')
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    videos = list_videos(args.input)
+    input_root = osp.abspath(args.input) if osp.isdir(args.input) else None
+    records = run_batch(videos, args.output, args.receptive_field, args.num_person, args.workers or None,
+                        input_root=input_root, progress_file=args.progress, retry_failed=not args.skip_failed,
+                        cache_dir=args.cache_dir, cache_size=args.cache_size)
+
+    num_errors = sum(1 for record in records if record['status'] != 'ok')
+    print(f"{len(records) - num_errors}/{len(records)} videos processed, results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
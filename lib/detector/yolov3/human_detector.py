@@ -54,10 +54,10 @@ def write(x, img, colors):
     return img
 
 
-def arg_parse():
+def arg_parse(argv=None):
     """"
     Parse arguements to the detect module
-
+    :param argv: The options, read from the command line if None
     """
     parser = argparse.ArgumentParser(description='YOLO v3 Cam Demo')
     parser.add_argument('--confidence', dest='confidence', type=float, default=0.70,
@@ -73,12 +73,13 @@ def arg_parse():
     parser.add_argument('-i', '--image', type=str, default=cur_dir + '/data/dog-cycle-car.png',
                         help='The input video path')
     parser.add_argument('-np', '--num-person', type=int, default=1, help='number of estimated human poses. [1, 2]')
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def load_model(args=None, CUDA=None, inp_dim=416):
+    # The command line belongs to the calling script, the default files are used if no options are given
     if args is None:
-        args = arg_parse()
+        args = arg_parse([])
 
     if CUDA is None:
         CUDA = torch.cuda.is_available()
@@ -103,15 +104,14 @@ def load_model(args=None, CUDA=None, inp_dim=416):
     return model
 
 
-def yolo_human_det(img, model=None, reso=416, confidence=0.70):
-    args = arg_parse()
+def yolo_human_det(img, model=None, reso=416, confidence=0.70, nms_thresh=0.4):
     # args.reso = reso
     inp_dim = reso
     num_classes = 80
 
     CUDA = torch.cuda.is_available()
     if model is None:
-        model = load_model(args, CUDA, inp_dim)
+        model = load_model(CUDA=CUDA, inp_dim=inp_dim)
 
     if type(img) == str:
         assert os.path.isfile(img), 'The image path does not exist'
@@ -125,7 +125,7 @@ def yolo_human_det(img, model=None, reso=416, confidence=0.70):
             img_dim = img_dim.cuda()
             img = img.cuda()
         output = model(img, CUDA)
-        output = write_results(output, confidence, num_classes, nms=True, nms_conf=args.nms_thresh, det_hm=True)
+        output = write_results(output, confidence, num_classes, nms=True, nms_conf=nms_thresh, det_hm=True)
 
         if len(output) == 0:
             return None, None
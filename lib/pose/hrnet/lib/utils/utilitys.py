@@ -1,13 +1,17 @@
 import cv2
 import sys
 import torch
-import json
 import torchvision.transforms as transforms
 import _init_paths
 from utils.transforms import *
 
 from utils.coco_h36m import coco_h36m
 import numpy as np
+import os.path as osp
+
+sys.path.insert(0, osp.join(osp.dirname(osp.realpath(__file__)), '../../../../..'))
+from tools.kpts_io import load_kpts
+sys.path.pop(0)
 
 joint_pairs = [[0, 1], [1, 3], [0, 2], [2, 4],
                [5, 6], [5, 7], [7, 9], [6, 8], [8, 10],
@@ -60,33 +64,8 @@ def write(x, img):
 
 
 def load_json(file_path):
-    with open(file_path, 'r') as fr:
-        video_info = json.load(fr)
-
-    label = video_info['label']
-    label_index = video_info['label_index']
-
-    num_frames = video_info['data'][-1]['frame_index']
-    keypoints = np.zeros((2, num_frames, 17, 2), dtype=np.float32)  # (M, T, N, 2)
-    scores = np.zeros((2, num_frames, 17), dtype=np.float32)  # (M, T, N)
-
-    for frame_info in video_info['data']:
-        frame_index = frame_info['frame_index']
-
-        for index, skeleton_info in enumerate(frame_info['skeleton']):
-            pose = skeleton_info['pose']
-            score = skeleton_info['score']
-            bbox = skeleton_info['bbox']
-
-            if len(bbox) == 0 or index+1 > 2:
-                continue
-
-            pose = np.asarray(pose, dtype=np.float32)
-            score = np.asarray(score, dtype=np.float32)
-            score = score.reshape(-1)
-
-            keypoints[index, frame_index-1] = pose
-            scores[index, frame_index-1] = score
+    # Both keypoints JSON files and .kpts files are supported, JSON files are parsed incrementally
+    keypoints, scores, label, label_index = load_kpts(file_path, 2)  # (M, T, N, 2), (M, T, N)
 
     new_kpts = []
     for i in range(keypoints.shape[0]):
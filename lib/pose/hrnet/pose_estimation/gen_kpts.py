@@ -6,7 +6,10 @@ import sys
 import os
 import os.path as osp
 import argparse
+import multiprocessing as mp
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 import numpy as np
 from tqdm import tqdm
 import json
@@ -32,10 +35,16 @@ sys.path.insert(0, lib_root)
 from detector import load_model as yolo_model
 from detector import yolo_human_det as yolo_det
 from track.sort import Sort
+from track.stitch import stitch_segments
+sys.path.pop(0)
+
+sys.path.insert(0, osp.join(lib_root, '..'))
+from tools.kpts_io import KptsWriter, KPTS_EXT
+from tools import tracing, metrics
 sys.path.pop(0)
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Train keypoints network')
     # general
     parser.add_argument('--cfg', type=str, default=cfg_dir + 'w48_384x288_adam_lr1e-3.yaml',
@@ -54,7 +63,7 @@ def parse_args():
                         help='The maximum number of estimated poses')
     parser.add_argument("-v", "--video", type=str, default='camera',
                         help="input video file name")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
@@ -89,6 +98,24 @@ def model_load(config):
     return model
 
 
+def load_img_models(det_dim=416, argv=None):
+    """
+    Load the models of gen_img_kpts once
+    :param det_dim: The input dimension of YOLOv3. [160, 320, 416]
+    :param argv: The HRNet options, read from the command line if None
+
+    :return: human_model, pose_model, a new sort tracker and the parsed options
+    """
+    args = parse_args(argv)
+    reset_config(args)
+
+    human_model = yolo_model(inp_dim=det_dim)
+    pose_model = model_load(cfg)
+    people_sort = Sort()
+
+    return human_model, pose_model, people_sort, args
+
+
 def load_default_model():
     args = parse_args()
     reset_config(args)
@@ -112,7 +139,7 @@ def load_default_model():
     return model
 
 
-def gen_img_kpts(image, human_model, pose_model, human_sort, det_dim=416, num_peroson=2):
+def gen_img_kpts(image, human_model, pose_model, human_sort, det_dim=416, num_peroson=2, args=None):
     """
     :param image: Input image matrix instead of image path
     :param human_model: The YOLOv3 model
@@ -120,6 +147,7 @@ def gen_img_kpts(image, human_model, pose_model, human_sort, det_dim=416, num_pe
     :param human_sort: Input initialized sort tracker
     :param det_dim: The input dimension of YOLOv3. [160, 320, 416]
     :param num_peroson: The number of tracked people
+    :param args: The options returned by load_img_models. The options are parsed again on every call if None
 
     :return:
             kpts: (M, N, 2)
@@ -128,38 +156,44 @@ def gen_img_kpts(image, human_model, pose_model, human_sort, det_dim=416, num_pe
             human_sort: Updated human_sort
     """
 
-    args = parse_args()
-    reset_config(args)
+    if args is None:
+        args = parse_args()
+        reset_config(args)
 
     thred_score = args.thred_score
 
-    bboxs, bbox_scores = yolo_det(image, human_model, reso=det_dim, confidence=thred_score)
+    with tracing.span('detect'):
+        bboxs, bbox_scores = yolo_det(image, human_model, reso=det_dim, confidence=thred_score)
 
     if bboxs is None or not bboxs.any():
+        metrics.detection_misses.inc()
         return None, None, None
 
     # Using Sort to track people
     # people_track: Num_bbox × [x1, y1, x2, y2, ID]
-    people_track = human_sort.update(bboxs)
+    with tracing.span('track'):
+        people_track = human_sort.update(bboxs)
 
-    # Track the first two people in the video and remove the ID
-    if people_track.shape[0] == 1:
-        bboxs_track = people_track[-1].reshape(1, 5)
-    else:
-        people_track_ = people_track[-num_peroson:].reshape(num_peroson, 5)
-        bboxs_track = people_track_[::-1]
+    # Track the first num_peroson people in the video (Sort returns the newest track first)
+    bboxs_track = people_track[::-1][:num_peroson].reshape(-1, 5)
+    if bboxs_track.shape[0] == 0:
+        return None, None, None
 
     with torch.no_grad():
         # bbox is coordinate location
-        inputs, origin_img, center, scale = PreProcess(image, bboxs_track, cfg, num_peroson)
-        inputs = inputs[:, [2, 1, 0]]
+        with tracing.span('crop'):
+            inputs, origin_img, center, scale = PreProcess(image, bboxs_track, cfg, num_peroson)
+            inputs = inputs[:, [2, 1, 0]]
 
-        if torch.cuda.is_available():
-            inputs = inputs.cuda()
-        output = pose_model(inputs)
+        with tracing.span('hrnet_forward', people=len(bboxs_track)):
+            if torch.cuda.is_available():
+                inputs = inputs.cuda()
+            output = pose_model(inputs)
+            heatmaps = output.cpu().numpy()
 
         # compute coordinate
-        preds, maxvals = get_final_preds(cfg, output.clone().cpu().numpy(), np.asarray(center), np.asarray(scale))
+        with tracing.span('heatmap_decode'):
+            preds, maxvals = get_final_preds(cfg, heatmaps, np.asarray(center), np.asarray(scale))
 
         kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
         scores = np.zeros((num_peroson, 17, 1), dtype=np.float32)
@@ -175,7 +209,50 @@ def gen_img_kpts(image, human_model, pose_model, human_sort, det_dim=416, num_pe
     return kpts, scores, human_indexes
 
 
-def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False):
+def assign_track_slots(track_ids, slot_ids):
+    """
+    Map Sort track IDs onto a fixed number of person slots, so that every identity keeps its slot across frames.
+
+    :param track_ids: The track IDs of the current frame, in order of priority
+    :param slot_ids: The track ID held by each slot (None if free). Updated in place
+    :return: list of (slot, index into track_ids) pairs
+    """
+    slot_rows = []
+    new_rows = []
+    for row, track_id in enumerate(track_ids):
+        if track_id in slot_ids:
+            slot_rows.append((slot_ids.index(track_id), row))
+        else:
+            new_rows.append(row)
+
+    # A new identity takes over a free slot, or the slot of a track that is no longer visible
+    free_slots = [slot for slot, track_id in enumerate(slot_ids) if track_id is None or track_id not in track_ids]
+    for slot, row in zip(free_slots, new_rows):
+        slot_ids[slot] = track_ids[row]
+        slot_rows.append((slot, row))
+
+    return sorted(slot_rows)
+
+
+def iter_video_tracks(video, det_dim=416, num_peroson=1, start=0, end=None, models=None):
+    """
+    Generate the 2D poses of the tracked people of a video frame by frame. Frames without tracked people are skipped
+    :param video: The input video path
+    :param det_dim: The input dimension of YOLOv3. [160, 320, 416]
+    :param num_peroson: The number of person slots, at most num_peroson tracks are estimated in every frame
+    :param start: The first frame
+    :param end: The frame after the last frame, the end of the video if None
+    :param models: The (YOLOv3, HRNet) models of load_img_models, loaded again if None
+
+    :return: generator of
+            frame_index: The index of the frame in the video
+            frame: The decoded frame
+            track_ids: The Sort IDs of the tracked people, oldest track first
+            track_bboxs: The boxes of the tracked people
+            preds: (K, N, 2) keypoints of the tracked people
+            maxvals: (K, N, 1) scores of the keypoints
+            slots: The person slot of every tracked box
+    """
     # Updating configuration
     args = parse_args()
     reset_config(args)
@@ -184,81 +261,196 @@ def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False):
     assert cap.isOpened(), 'Cannot capture source'
 
     # Loading detector and pose model, initialize sort for track
-    human_model = yolo_model(inp_dim=det_dim)
-    pose_model = model_load(cfg)
+    if models is None:
+        human_model = yolo_model(inp_dim=det_dim)
+        pose_model = model_load(cfg)
+    else:
+        human_model, pose_model = models
     people_sort = Sort()
 
     video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     # video_length = 1000
+    end = video_length if end is None else min(end, video_length)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
 
     # collect keypoints coordinate
     print('Generating 2D pose ...')
 
-    kpts_result = []
-    scores_result = []
-    for i in tqdm(range(video_length)):
-        ret, frame = cap.read()
+    slot_ids = [None] * num_peroson
+    for i in tqdm(range(start, end)):
+        with tracing.span('decode'):
+            ret, frame = cap.read()
         if not ret:
+            metrics.dropped_frames.inc(reason='decode_error')
             continue
-        # start = time.time()
+        metrics.frames_total.inc(stage='decode')
         try:
-            bboxs, scores = yolo_det(frame, human_model, reso=det_dim, confidence=args.thred_score)
+            with tracing.span('detect'):
+                bboxs, scores = yolo_det(frame, human_model, reso=det_dim, confidence=args.thred_score)
 
             if bboxs is None or not bboxs.any():
                 print('No person detected!')
-                # print('FPS of the video is {:5.2f}'.format(1 / (time.time() - start)))
+                metrics.detection_misses.inc()
+                metrics.dropped_frames.inc(reason='no_detection')
                 continue
 
             # Using Sort to track people
-            people_track = people_sort.update(bboxs)
-
-            # Track the first two people in the video and remove the ID
-            if people_track.shape[0] == 1:
-                people_track_ = people_track[-1, :-1].reshape(1, 4)
-            elif people_track.shape[0] >= 2:
-                people_track_ = people_track[-num_peroson:, :-1].reshape(num_peroson, 4)
-                people_track_ = people_track_[::-1]
-            else:
+            with tracing.span('track'):
+                people_track = people_sort.update(bboxs)
+                if people_track.shape[0] == 0:
+                    metrics.dropped_frames.inc(reason='no_track')
+                    continue
+
+                # Keep every tracked identity in the same person slot across frames, oldest track first
+                people_track = people_track[::-1]
+                previous_ids = list(slot_ids)
+                slot_rows = assign_track_slots(people_track[:, -1].tolist(), slot_ids)
+                metrics.tracker_resets.inc(sum(previous_id is not None and previous_id != track_id
+                                               for previous_id, track_id in zip(previous_ids, slot_ids)))
+            if len(slot_rows) == 0:
+                metrics.dropped_frames.inc(reason='no_slot')
                 continue
+            slots, rows = zip(*slot_rows)
+            slots, rows = list(slots), list(rows)
 
             track_bboxs = []
-            for bbox in people_track_:
+            for bbox in people_track[rows, :-1]:
                 bbox = [round(i, 2) for i in list(bbox)]
                 track_bboxs.append(bbox)
 
         except Exception as e:
-            print(e)
-            exit(0)
-            continue
+            # Raised instead of exit(), which would kill a worker process of gen_video_kpts_parallel silently
+            raise RuntimeError('Tracking failed at frame {} of {}: {}'.format(i, video, e)) from e
 
         with torch.no_grad():
             # bbox is coordinate location
-            inputs, origin_img, center, scale = PreProcess(frame, track_bboxs, cfg, num_peroson)
-            inputs = inputs[:, [2, 1, 0]]
+            with tracing.span('crop'):
+                inputs, origin_img, center, scale = PreProcess(frame, track_bboxs, cfg, len(track_bboxs))
+                inputs = inputs[:, [2, 1, 0]]
 
-            if torch.cuda.is_available():
-                inputs = inputs.cuda()
-            output = pose_model(inputs)
+            # The copy of the heatmaps to the CPU waits for the GPU, so it is part of the forward span
+            with tracing.span('hrnet_forward', people=len(track_bboxs)):
+                if torch.cuda.is_available():
+                    inputs = inputs.cuda()
+                output = pose_model(inputs)
+                heatmaps = output.cpu().numpy()
 
             # compute coordinate
-            preds, maxvals = get_final_preds(cfg, output.clone().cpu().numpy(), np.asarray(center), np.asarray(scale))
+            with tracing.span('heatmap_decode'):
+                preds, maxvals = get_final_preds(cfg, heatmaps, np.asarray(center), np.asarray(scale))
 
-        if gen_output:
-            kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
-            scores = np.zeros((num_peroson, 17), dtype=np.float32)
-            for i, kpt in enumerate(preds):
-                kpts[i] = kpt
+        metrics.frames_total.inc(stage='pose_2d')
+
+        yield i, frame, people_track[rows, -1].tolist(), track_bboxs, preds, maxvals, slots
+
+
+def iter_video_kpts(video, det_dim=416, num_peroson=1, models=None):
+    """
+    Generate the 2D poses of a video frame by frame. Frames without tracked people are skipped
+    :param video: The input video path
+    :param det_dim: The input dimension of YOLOv3. [160, 320, 416]
+    :param num_peroson: The number of person slots
+    :param models: The (YOLOv3, HRNet) models of load_img_models, loaded again if None
+
+    :return: generator of
+            frame: The decoded frame
+            kpts: (M, N, 2), zeros for empty person slots
+            scores: (M, N)
+            track_bboxs: The boxes of the tracked people
+            slots: The person slot of every tracked box
+    """
+    for _, frame, _, track_bboxs, preds, maxvals, slots in iter_video_tracks(video, det_dim, num_peroson, models=models):
+        kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
+        scores = np.zeros((num_peroson, 17), dtype=np.float32)
+        kpts[slots] = preds
+        scores[slots] = maxvals[..., 0]
 
-            for i, score in enumerate(maxvals):
-                scores[i] = score.squeeze()
+        yield frame, kpts, scores, track_bboxs, slots
+
+
+def extract_segment(task):
+    """
+    Worker of gen_video_kpts_parallel: the tracks of the frames [start, end) of a video, without the decoded frames
+    """
+    video, start, end, det_dim, num_peroson = task
+    return [(frame_index, track_ids, np.asarray(track_bboxs, dtype=np.float32), preds, maxvals[..., 0])
+            for frame_index, _, track_ids, track_bboxs, preds, maxvals, _
+            in iter_video_tracks(video, det_dim, num_peroson, start, end)]
+
+
+def gen_video_kpts_parallel(video, det_dim=416, num_peroson=1, num_workers=None, overlap=30):
+    """
+    Generate the 2D poses of a video with one process per time segment.
+    Every segment is tracked from overlap frames before its start, and its tracks take over the identities of the
+    tracks of the previous segment they match in these frames (lib/track/stitch.py). The person slots are then
+    assigned over the whole video, as in iter_video_kpts
+
+    :param num_workers: The number of processes (and segments), all CPUs if None.
+                        Every process loads its own YOLOv3 and HRNet models
+    :param overlap: The number of frames processed by two consecutive segments
+    :return: keypoints (M, T, N, 2) and scores (M, T, N) of the frames with tracked people, as gen_video_kpts
+    """
+    cap = cv2.VideoCapture(video)
+    video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    # Segments shorter than a few overlaps would spend most of their time in the overlap
+    num_segments = max(1, min(num_workers or os.cpu_count(), video_length // (4 * overlap)))
+    edges = np.linspace(0, video_length, num_segments + 1).astype(int)
+    bounds = list(zip(edges[:-1], edges[1:]))
+    tasks = [(video, max(0, start - overlap), end, det_dim, num_peroson) for start, end in bounds]
+
+    # The workers are spawned (CUDA cannot be used in forked processes) and import this module by its name.
+    # An error in a segment is raised here, and a worker killed by the system raises BrokenProcessPool
+    sys.path.insert(0, cur_dir)
+    try:
+        with ProcessPoolExecutor(num_segments, mp_context=mp.get_context('spawn')) as executor:
+            segments = list(executor.map(extract_segment, tasks))
+    finally:
+        sys.path.pop(0)
+
+    kpts_result = []
+    scores_result = []
+    slot_ids = [None] * num_peroson
+    for _, track_ids, _, preds, maxvals in stitch_segments(segments, bounds):
+        slot_rows = assign_track_slots(track_ids, slot_ids)
+        if len(slot_rows) == 0:
+            continue
+        slots, rows = zip(*slot_rows)
+        slots, rows = list(slots), list(rows)
 
+        kpts = np.zeros((num_peroson, 17, 2), dtype=np.float32)
+        scores = np.zeros((num_peroson, 17), dtype=np.float32)
+        kpts[slots] = preds[rows]
+        scores[slots] = maxvals[rows]
+        kpts_result.append(kpts)
+        scores_result.append(scores)
+
+    keypoints = np.array(kpts_result).reshape(-1, num_peroson, 17, 2)
+    scores = np.array(scores_result).reshape(-1, num_peroson, 17)
+    return keypoints.transpose(1, 0, 2, 3), scores.transpose(1, 0, 2)
+
+
+def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False, num_workers=1, models=None):
+    """
+    :param num_workers: The number of processes generating the output (gen_output) with gen_video_kpts_parallel
+    :param models: The (YOLOv3, HRNet) models of load_img_models, loaded again if None
+    """
+    if gen_output and num_workers != 1:
+        return gen_video_kpts_parallel(video, det_dim, num_peroson, num_workers)
+
+    kpts_result = []
+    scores_result = []
+    for frame, kpts, scores, track_bboxs, slots in iter_video_kpts(video, det_dim, num_peroson, models):
+        if gen_output:
             kpts_result.append(kpts)
             scores_result.append(scores)
 
         else:
-            index_bboxs = [bbox + [i] for i, bbox in enumerate(track_bboxs)]
+            index_bboxs = [bbox + [slot] for slot, bbox in zip(slots, track_bboxs)]
             list(map(lambda x: write(x, frame), index_bboxs))
-            plot_keypoint(frame, preds, maxvals, 0.3)
+            plot_keypoint(frame, kpts[slots], scores[slots][..., np.newaxis], 0.3)
 
             # print('FPS of the video is {:5.2f}'.format(1 / (time.time() - start)))
             cv2.imshow('frame', frame)
@@ -275,7 +467,11 @@ def gen_video_kpts(video, det_dim=416, num_peroson=1, gen_output=False):
         return keypoints, scores
 
 
-def generate_ntu_kpts_json(video_path, kpts_file):
+def generate_ntu_kpts_json(video_path, kpts_file, num_peroson=2):
+    """
+    Generate the 2D keypoints of a video in the NTU JSON format,
+    or in the binary .kpts format (see tools/kpts_io.py) if kpts_file ends with .kpts
+    """
     args = parse_args()
     reset_config(args)
 
@@ -284,7 +480,11 @@ def generate_ntu_kpts_json(video_path, kpts_file):
     pose_model = model_load(cfg)
     people_sort = Sort()
 
-    with torch.no_grad():
+    slot_ids = [None] * num_peroson
+
+    # The partial .kpts column files are removed if the generation fails
+    writer = KptsWriter(kpts_file, num_peroson) if kpts_file.endswith(KPTS_EXT) else nullcontext()
+    with writer as kpts_writer, torch.no_grad():
         cap = cv2.VideoCapture(video_path)
         video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
@@ -301,68 +501,62 @@ def generate_ntu_kpts_json(video_path, kpts_file):
 
                 if bboxs is None or not bboxs.any():
                     print('No person detected!')
+                    metrics.detection_misses.inc()
+                    metrics.dropped_frames.inc(reason='no_detection')
                     continue
                 # Using Sort to track people
                 people_track = people_sort.update(bboxs)
 
-                # Track the first two people in the video and remove the ID
-                if people_track.shape[0] == 1:
-                    people_track_ = people_track[-1, :-1].reshape(1, 4)
-                elif people_track.shape[0] >= 2:
-                    people_track_ = people_track[-2:, :-1].reshape(2, 4)
-                    people_track_ = people_track_[::-1]
-                else:
-                    skeleton = {'skeleton': [{'pose': [], 'score': [], 'bbox': []}]}
-                    frame_info.update(skeleton)
-                    data.append(frame_info)
+                if people_track.shape[0] == 0:
+                    if kpts_writer is None:
+                        skeleton = {'skeleton': [{'pose': [], 'score': [], 'bbox': []}]}
+                        frame_info.update(skeleton)
+                        data.append(frame_info)
 
                     continue
 
-                track_bboxs = []
-                for bbox in people_track_:
-                    bbox = [round(i, 3) for i in list(bbox)]
-                    track_bboxs.append(bbox)
+                # Keep every tracked identity in the same person slot across frames, oldest track first
+                people_track = people_track[::-1]
+                slot_rows = assign_track_slots(people_track[:, -1].tolist(), slot_ids)
+                if len(slot_rows) == 0:
+                    continue
+                slots, rows = zip(*slot_rows)
+                slots, rows = list(slots), list(rows)
+
+                track_bboxs = np.round(people_track[rows, :-1], 3)
+                track_ids = people_track[rows, -1].astype(np.int32)
 
             except Exception as e:
                 print(e)
                 continue
 
             # bbox is coordinate location
-            inputs, origin_img, center, scale = PreProcess(frame, bboxs, cfg, args.num_person)
+            inputs, origin_img, center, scale = PreProcess(frame, track_bboxs, cfg, len(track_bboxs))
             inputs = inputs[:, [2, 1, 0]]
             if torch.cuda.is_available():
                 inputs = inputs.cuda()
-            output = pose_model(inputs.cuda())
+            output = pose_model(inputs)
             # compute coordinate
             preds, maxvals = get_final_preds(cfg, output.clone().cpu().numpy(), np.asarray(center),
                                              np.asarray(scale))
 
-            skeleton = []
-            for num, bbox in enumerate(track_bboxs):
-                pose = preds[num].tolist()
-                score = maxvals[num].tolist()
-                pose = round_list(pose)
-                score = round_list(score)
+            if kpts_writer is not None:
+                kpts_writer.write(i + 1, preds, maxvals, track_bboxs, track_ids, slots)
+                continue
 
-                one_skeleton = {'pose': pose,
-                                'score': score,
-                                'bbox': bbox}
-                skeleton.append(one_skeleton)
+            # Empty skeletons keep the position of every person slot
+            skeleton = [{'pose': [], 'score': [], 'bbox': []} for _ in range(max(slots) + 1)]
+            for num, slot in enumerate(slots):
+                skeleton[slot] = {'pose': np.round(preds[num], 3).tolist(),
+                                  'score': np.round(maxvals[num], 3).tolist(),
+                                  'bbox': track_bboxs[num].tolist(),
+                                  'track_id': int(track_ids[num])}
 
             frame_info.update({'skeleton': skeleton})
             data.append(frame_info)
 
-        kpts_info.update({'data': data})
-        with open(kpts_file, 'w') as fw:
-            json.dump(kpts_info, fw)
+        if kpts_writer is None:
+            kpts_info.update({'data': data})
+            with open(kpts_file, 'w') as fw:
+                json.dump(kpts_info, fw)
     print('Finishing!')
-
-
-def round_list(input_list, decimals=3):
-    dim = len(input_list)
-
-    for i in range(dim):
-        for j in range(len(input_list[i])):
-            input_list[i][j] = round(input_list[i][j], decimals)
-
-    return input_list
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Stitch the Sort tracks of video segments processed independently.
+Consecutive segments overlap by a few frames: the tracks of the next segment are matched to the tracks of the previous
+segment in the overlap by bounding box IoU and pose similarity, and take over their identities.
+"""
+import numpy as np
+
+
+def bbox_iou(bbox_a, bbox_b):
+    """
+    IoU of two boxes [x1, y1, x2, y2]
+    """
+    w = max(0., min(bbox_a[2], bbox_b[2]) - max(bbox_a[0], bbox_b[0]))
+    h = max(0., min(bbox_a[3], bbox_b[3]) - max(bbox_a[1], bbox_b[1]))
+    intersection = w * h
+    union = (bbox_a[2] - bbox_a[0]) * (bbox_a[3] - bbox_a[1]) + (bbox_b[2] - bbox_b[0]) * (bbox_b[3] - bbox_b[1]) \
+        - intersection
+    return intersection / union if union > 0 else 0.
+
+
+def pose_similarity(kpts_a, kpts_b, bbox, kappa=0.1):
+    """
+    Object keypoint similarity of two poses (N, 2): 1 for the same pose, close to 0 for poses far apart
+    relative to the size of the box [x1, y1, x2, y2]
+    """
+    area = max((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]), 1.)
+    distances = np.sum((np.asarray(kpts_a) - np.asarray(kpts_b)) ** 2, axis=-1)
+    return float(np.mean(np.exp(-distances / (2 * area * kappa ** 2))))
+
+
+def match_tracks(previous, following, min_score=0.3):
+    """
+    Match the tracks of two segments in their common frames
+
+    :param previous: {frame index: {track ID: (bbox, kpts)}} of the previous segment
+    :param following: the same for the following segment
+    :param min_score: The minimum mean of the IoU and the pose similarity of a match
+    :return: {following track ID: previous track ID}
+    """
+    totals = {}
+    for frame_index in set(previous) & set(following):
+        for previous_id, (previous_bbox, previous_kpts) in previous[frame_index].items():
+            for following_id, (following_bbox, following_kpts) in following[frame_index].items():
+                score = (bbox_iou(previous_bbox, following_bbox) +
+                         pose_similarity(previous_kpts, following_kpts, previous_bbox)) / 2
+                total, count = totals.get((previous_id, following_id), (0., 0))
+                totals[(previous_id, following_id)] = (total + score, count + 1)
+
+    # Greedy assignment, best pairs first (there are only a few people in a frame)
+    pairs = sorted(((total / count, previous_id, following_id)
+                    for (previous_id, following_id), (total, count) in totals.items()), reverse=True)
+    matches = {}
+    matched_previous = set()
+    for score, previous_id, following_id in pairs:
+        if score < min_score:
+            break
+        if previous_id in matched_previous or following_id in matches:
+            continue
+        matches[following_id] = previous_id
+        matched_previous.add(previous_id)
+    return matches
+
+
+def _frame_tracks(records, start, end):
+    tracks = {}
+    for frame_index, track_ids, bboxs, kpts, _ in records:
+        if start <= frame_index < end:
+            tracks[frame_index] = {track_id: (bbox, kpt) for track_id, bbox, kpt in zip(track_ids, bboxs, kpts)}
+    return tracks
+
+
+def stitch_segments(segments, bounds, min_score=0.3):
+    """
+    Merge the tracks of segments into tracks of the whole video with unique identities
+
+    :param segments: For every segment, its list of (frame index, track IDs, bboxs (K, 4), kpts (K, N, 2),
+                     scores (K, N)) in frame order. A segment may start before its bounds (the overlap)
+    :param bounds: The (start, end) frames owned by every segment, contiguous
+    :param min_score: The minimum similarity of two tracks taking the same identity
+    :return: list of (frame index, track IDs, bboxs, kpts, scores) of the owned frames of all segments, in frame order
+    """
+    merged = []
+    next_id = 0
+    previous_tracks = {}
+    for records, (start, end) in zip(segments, bounds):
+        overlap_start = min([frame_index for frame_index, *_ in records if frame_index < start], default=start)
+        matches = match_tracks(previous_tracks, _frame_tracks(records, overlap_start, start), min_score)
+
+        # The identities of the previous segment are kept, the other tracks get new identities
+        identities = dict(matches)
+        records = [record for record in records if start <= record[0] < end]
+        for _, track_ids, *_ in records:
+            for track_id in track_ids:
+                if track_id not in identities:
+                    identities[track_id] = next_id
+                    next_id += 1
+        next_id = max([next_id] + [identity + 1 for identity in identities.values()])
+
+        records = [(frame_index, [identities[track_id] for track_id in track_ids], bboxs, kpts, scores)
+                   for frame_index, track_ids, bboxs, kpts, scores in records]
+        merged += records
+        # The overlap with the next segment is at the end of this one
+        previous_tracks = _frame_tracks(records, start, end)
+    return merged
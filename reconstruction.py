@@ -2,7 +2,6 @@ import torch
 import torch.nn as nn
 import torch
 import numpy as np
-import json
 import cv2
 import os
 import argparse
@@ -14,6 +13,7 @@ from common.camera import normalize_screen_coordinates, camera_to_world
 from common.generators import *
 from model.gast_net import *
 from tools.visualization import render_animation
+from tools.kpts_io import load_kpts
 
 
 # h36m_skeleton = Skeleton(parents=[-1, 0, 1, 2, 0, 4, 5, 0, 7, 8, 9, 8, 11, 12, 8, 14, 15],
@@ -103,42 +103,12 @@ def get_joints_info(num_joints):
 
 
 def load_json(file_path, num_joints, num_person=2):
-    with open(file_path, 'r') as fr:
-        video_info = json.load(fr)
+    # Both keypoints JSON files and .kpts files are supported, JSON files are parsed incrementally
+    keypoints, scores, label, label_index = load_kpts(file_path, num_person)
 
     # Loading whole-body keypoints including body(17)+hand(42)+foot(6)+facial(68) joints
     # 2D Whole-body human pose estimation paper: https://arxiv.org/abs/2007.11858
     if num_joints == 19:
-        num_joints_revise = 133
-    else:
-        num_joints_revise = 17
-
-    label = video_info['label']
-    label_index = video_info['label_index']
-
-    num_frames = video_info['data'][-1]['frame_index']
-    keypoints = np.zeros((num_person, num_frames, num_joints_revise, 2), dtype=np.float32)
-    scores = np.zeros((num_person, num_frames, num_joints_revise), dtype=np.float32)
-
-    for frame_info in video_info['data']:
-        frame_index = frame_info['frame_index']
-
-        for index, skeleton_info in enumerate(frame_info['skeleton']):
-            pose = skeleton_info['pose']
-            score = skeleton_info['score']
-            bbox = skeleton_info['bbox']
-
-            if len(bbox) == 0 or index+1 > num_person:
-                continue
-
-            pose = np.asarray(pose, dtype=np.float32)
-            score = np.asarray(score, dtype=np.float32)
-            score = score.reshape(-1)
-
-            keypoints[index, frame_index-1] = pose
-            scores[index, frame_index-1] = score
-
-    if num_joints != num_joints_revise:
         # body(17) + foot(6) = 23
         return keypoints[:, :, :23], scores[:, :, :23], label, label_index
     else:
@@ -0,0 +1,110 @@
+import argparse
+import csv
+import glob
+import os
+import os.path as osp
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+from swing_sequence import load_swing_data
+from swing_analysis import analyze_swing
+
+
+def list_swing_files(path):
+    """
+    採点するスイングファイルの一覧を取得する
+    path がディレクトリの場合は配下の全JSONファイル、JSONファイルの場合はそのファイル、
+    それ以外の場合は1行に1ファイルのマニフェストとして読み込む（相対パスはマニフェストの場所から解決する）
+    """
+    if osp.isdir(path):
+        return sorted(glob.glob(osp.join(path, '**', '*.json'), recursive=True))
+    if path.endswith('.json'):
+        return [path]
+
+    root = osp.dirname(osp.abspath(path))
+    with open(path, 'r') as file:
+        lines = [line.strip() for line in file]
+    return [osp.join(root, line) for line in lines if line and not line.startswith('#')]
+
+
+def score_swing(json_file, fps=30.):
+    """
+    1ファイルのスイングのフェーズ検出、スウェースコアとXファクタースコアの計算を行う
+    """
+    return score_frames(load_swing_data(json_file), fps)
+
+
+def score_frames(frames, fps=30.):
+    """
+    1スイング分の SwingSequence のフェーズ検出と全指標の計算を行う
+    fps は撮影のフレームレート（テンポと手首の速度に使う）
+    """
+    result = {'num_frames': len(frames)}
+    result.update(analyze_swing(frames, fps=fps)['values'])
+    return result
+
+
+def score_swing_safe(json_file, fps=30.):
+    """
+    score_swing の例外を結果の error 列に記録する
+    """
+    row = {'file': json_file, 'error': ''}
+    try:
+        row.update(score_swing(json_file, fps))
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def write_table(rows, output_file):
+    """
+    採点結果を1つの表として保存する。拡張子が .parquet の場合は Parquet（pandas が必要）、それ以外は CSV
+    """
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+
+    if output_file.endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(rows, columns=columns).to_parquet(output_file, index=False)
+    else:
+        with open(output_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def score_batch(json_files, output_file, num_workers=None, chunksize=16, fps=30.):
+    """
+    複数のスイングファイルをプロセスプールで採点し、結果を output_file に保存する
+    """
+    num_workers = num_workers or os.cpu_count()
+    with Pool(num_workers) as pool:
+        rows = list(tqdm(pool.imap(partial(score_swing_safe, fps=fps), json_files, chunksize=chunksize),
+                         total=len(json_files)))
+
+    write_table(rows, output_file)
+    return rows
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser('Batch scoring of swing files.')
+    parser.add_argument('input', type=str, help='directory of swing JSON files, a swing JSON file or a manifest')
+    parser.add_argument('-o', '--output', type=str, default='swing_scores.csv', help='output .csv or .parquet table')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-c', '--chunksize', type=int, default=16, help='number of files sent to a worker at once')
+    parser.add_argument('--fps', type=float, default=30., help='frame rate of the swing videos')
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    json_files = list_swing_files(args.input)
+    rows = score_batch(json_files, args.output, args.workers, args.chunksize, args.fps)
+
+    num_errors = sum(1 for row in rows if row['error'])
+    print(f"{len(rows) - num_errors}/{len(rows)} swings scored, results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
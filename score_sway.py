@@ -2,37 +2,7 @@ import json
 import numpy as np
 import sys
 from joint_mappings import keypoint_indices
-
-def load_swing_data(json_file):
-    """
-    JSONファイルからスイングデータをロードする
-    """
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-    return data['frames']
-
-def get_joint_position(frames, frame_number, joint_name, keypoints_mapping):
-    """
-    指定されたフレーム番号と関節名に対応する3D座標を取得する
-    """
-    frame = next((f for f in frames if f['frame_index'] == frame_number), None)
-    if frame is None:
-        raise ValueError(f"Frame {frame_number} が見つかりません。")
-    
-    joint_index = keypoints_mapping[joint_name]
-    joint = next((j for j in frame['joints'] if j['joint_index'] == joint_index), None)
-    if joint is None:
-        raise ValueError(f"Joint '{joint_name}' (index {joint_index}) がフレーム {frame_number} に見つかりません。")
-    
-    if 'coordinates' not in joint or any(coord not in joint['coordinates'] for coord in ['x', 'y', 'z']):
-        raise ValueError(f"Joint '{joint_name}' の座標データが不完全です。")
-    
-    position = np.array([
-        joint['coordinates']['x'],
-        joint['coordinates']['y'],
-        joint['coordinates']['z']
-    ])
-    return position
+from swing_sequence import load_swing_data, get_joint_position, normalize_phases
 
 def calculate_rotation_matrix(axis_unit, y_unit):
     """
@@ -62,20 +32,27 @@ def rotate_and_translate(coord, translation, rotation_matrix):
     local_coord = rotation_matrix.T @ translated_coord
     return local_coord
 
-def calculate_sway_score(frames, keypoints_mapping, phase_frames):
+def transform_to_local(coords, translation, rotation_matrix):
     """
-    スウェーのスコアを計算する
+    rotate_and_translate を全フレーム・全関節に対して一度の行列積で計算する
+    coords: (..., 3)
+    """
+    return (coords - translation) @ rotation_matrix
+
+def calculate_ankle_frame(frames, keypoints_mapping, address_frame, log=print):
+    """
+    アドレス時の足首から局所座標系（原点と回転行列）を計算する
     """
     # アドレス時の足首の位置を取得
-    left_ankle_address = get_joint_position(frames, phase_frames['address'], 'left_ankle', keypoints_mapping)
-    right_ankle_address = get_joint_position(frames, phase_frames['address'], 'right_ankle', keypoints_mapping)
+    left_ankle_address = get_joint_position(frames, address_frame, 'left_ankle', keypoints_mapping)
+    right_ankle_address = get_joint_position(frames, address_frame, 'right_ankle', keypoints_mapping)
     
-    print(f"Address フェーズの left_ankle 座標: {left_ankle_address}")
-    print(f"Address フェーズの right_ankle 座標: {right_ankle_address}")
+    log(f"Address フェーズの left_ankle 座標: {left_ankle_address}")
+    log(f"Address フェーズの right_ankle 座標: {right_ankle_address}")
     
     # 足首の中点を基準点とする
     ankle_center_address = (left_ankle_address + right_ankle_address) / 2
-    print(f"アドレス時の足首の中点（ankle_center_address）: {ankle_center_address}")
+    log(f"アドレス時の足首の中点（ankle_center_address）: {ankle_center_address}")
     
     # 左足首から右足首へのベクトルを基準軸とする
     ankle_axis = right_ankle_address - left_ankle_address
@@ -83,58 +60,144 @@ def calculate_sway_score(frames, keypoints_mapping, phase_frames):
     if axis_norm == 0:
         raise ValueError("左足首と右足首の位置が同一です。")
     axis_unit = ankle_axis / axis_norm  # 正規化した基準軸
-    print(f"基準軸（左足首から右足首へのベクトル）: {ankle_axis}")
-    print(f"正規化された基準軸（axis_unit）: {axis_unit}")
+    log(f"基準軸（左足首から右足首へのベクトル）: {ankle_axis}")
+    log(f"正規化された基準軸（axis_unit）: {axis_unit}")
     
     # Y軸を前後方向と仮定
     y_unit = np.array([0, 1, 0])
     
     # 回転行列の計算
     rotation_matrix = calculate_rotation_matrix(axis_unit, y_unit)
-    print(f"回転行列（rotation_matrix）:\n{rotation_matrix}")
-    
+    log(f"回転行列（rotation_matrix）:\n{rotation_matrix}")
+    return ankle_center_address, rotation_matrix
+
+# 局所座標系に変換する部位と関節名
+sway_body_parts = {'pelvis': 'center_hip', 'head': 'head_top', 'left_knee': 'left_knee', 'right_knee': 'right_knee'}
+
+def summarize_sway(pelvis_lateral, frame_indices, address, top=None, finish=None):
+    """
+    骨盤の左右位置 (T, )（cm）からスウェー（トップ側への移動）とスライド（その反対側への移動）の時系列と最大値を求める
+    移動量はアドレス時の骨盤の位置からの差とする（構えた時の足首の中点からのずれは含めない）
+    address, top, finish は行番号。スウェーはアドレスからトップ、スライドはトップからフィニッシュまでで最大値を求める
+    """
+    if finish is None:
+        finish = len(pelvis_lateral) - 1
+    movement = pelvis_lateral - pelvis_lateral[address]
+
+    # トップで骨盤が移動している側をスウェーの向きとする
+    direction = 1.0 if top is None or not movement[top] < 0 else -1.0
+    sway = np.maximum(direction * movement, 0)
+    slide = np.maximum(-direction * movement, 0)
+
+    result = {'sway': sway, 'slide': slide}
+    for name, series, start, end in [('sway', sway, address, top if top is not None else finish),
+                                     ('slide', slide, top if top is not None else address, finish)]:
+        window = series[start:end + 1]
+        if len(window) == 0 or np.isnan(window).all():
+            continue
+        peak = start + np.nanargmax(window)
+        result['max_' + name] = series[peak]
+        result['max_' + name + '_frame'] = int(frame_indices[peak])
+    return result
+
+def evaluate_sway(max_deviation, allowable_sway=5.0, max_sway=20.0):
+    """
+    骨盤の最大の左右移動量（cm）からスウェーのスコアを計算する
+    allowable_sway: 許容スウェー量（cm）、max_sway: 最大スウェー量（cm）
+    """
+    if max_deviation <= allowable_sway:
+        score = 100
+    elif max_deviation >= max_sway:
+        score = 0
+    else:
+        penalty_factor = 100 / (max_sway - allowable_sway)
+        score = max(0, 100 - ((max_deviation - allowable_sway) * penalty_factor))
+    return score
+
+def calculate_sway_series(frames, keypoints_mapping, phase_frames, verbose=False):
+    """
+    全フレームの骨盤・頭・両膝の位置をアドレス時の足首の局所座標系（cm）に変換し、
+    アドレスからの骨盤の左右移動からスウェー（トップ側への移動）とスライド（その反対側への移動）の時系列と最大値を計算する
+    phase_frames には 'address' が必要。'top' と 'finish' があれば、スウェーはアドレスからトップ、
+    スライドはトップからフィニッシュまでで最大値を求める
+    """
+    log = print if verbose else (lambda *args: None)
+    phase_frames = normalize_phases(phase_frames)
+
+    ankle_center_address, rotation_matrix = calculate_ankle_frame(frames, keypoints_mapping,
+                                                                  phase_frames['address'], log)
+
+    # (T, P, 3) の座標を一度の行列積でローカル座標系に変換する（メートルからセンチメートルに変換）
+    joint_indices = [keypoints_mapping[joint_name] for joint_name in sway_body_parts.values()]
+    local_coords = transform_to_local(frames.joints[:, joint_indices], ankle_center_address, rotation_matrix) * 100
+    lateral = local_coords[..., 0]
+    pelvis = lateral[:, 0]
+
+    address = frames.row(phase_frames['address'])
+    top = frames.row(phase_frames['top']) if 'top' in phase_frames else None
+    finish = frames.row(phase_frames['finish']) if 'finish' in phase_frames else len(frames) - 1
+
+    result = {
+        'frame_indices': frames.frame_indices,
+        'local_coords': {part: local_coords[:, i] for i, part in enumerate(sway_body_parts)},
+        'lateral': {part: lateral[:, i] for i, part in enumerate(sway_body_parts)},
+    }
+    result.update(summarize_sway(pelvis, frames.frame_indices, address, top, finish))
+    for name, label in [('sway', 'スウェー'), ('slide', 'スライド')]:
+        if 'max_' + name in result:
+            log(f"最大{label}量: {result['max_' + name]:.2f} cm (Frame {result['max_' + name + '_frame']})")
+
+    return result
+
+def calculate_sway_score(frames, keypoints_mapping, phase_frames, verbose=False, return_series=False):
+    """
+    スウェーのスコアを計算する
+    verbose が True の場合は途中経過を表示する
+    return_series が True の場合は calculate_sway_series の結果も返す
+    """
+    log = print if verbose else (lambda *args: None)
+
+    phase_frames = normalize_phases(phase_frames)
+    series = calculate_sway_series(frames, keypoints_mapping, phase_frames, verbose)
+    pelvis_local = series['local_coords']['pelvis']
+
     deviations = {}
     max_deviation = 0
-    allowable_sway = 5.0  # 許容スウェー量（cm）
-    max_sway = 20.0        # 最大スウェー量（cm）
     
     for phase_name in ['top', 'impact', 'finish']:
-        # 各フェーズでのcenter_hipの位置を取得
-        center_hip_phase = get_joint_position(frames, phase_frames[phase_name], 'center_hip', keypoints_mapping)
-        print(f"{phase_name.capitalize()} フェーズの center_hip 座標: {center_hip_phase}")
-        
-        # ローカル座標系に変換
-        center_hip_local = rotate_and_translate(center_hip_phase, ankle_center_address, rotation_matrix)
-        print(f"{phase_name.capitalize()} フェーズの center_hip ローカル座標系での位置: {center_hip_local}")
+        # 各フェーズでのcenter_hipのローカル座標系での位置（cm）
+        center_hip_local = pelvis_local[frames.row(phase_frames[phase_name])]
+        if np.isnan(center_hip_local).any():
+            raise ValueError(f"Joint 'center_hip' がフレーム {phase_frames[phase_name]} に見つかりません。")
+        log(f"{phase_name.capitalize()} フェーズの center_hip ローカル座標系での位置: {center_hip_local / 100}")
         
         # 左右移動量（X軸方向）
-        lateral_movement_cm = center_hip_local[0] * 100  # メートルからセンチメートルに変換
+        lateral_movement_cm = center_hip_local[0]
         deviations[phase_name] = lateral_movement_cm
         max_deviation = max(max_deviation, abs(lateral_movement_cm))
-        print(f"{phase_name.capitalize()} フェーズの左右移動量: {lateral_movement_cm:.2f} cm")
+        log(f"{phase_name.capitalize()} フェーズの左右移動量: {lateral_movement_cm:.2f} cm")
     
     # スコアの計算
-    if max_deviation <= allowable_sway:
-        score = 100
-    elif max_deviation >= max_sway:
-        score = 0
-    else:
-        penalty_factor = 100 / (max_sway - allowable_sway)
-        score = max(0, 100 - ((max_deviation - allowable_sway) * penalty_factor))
-    
+    score = evaluate_sway(max_deviation)
+
+    if return_series:
+        return score, deviations, series
     return score, deviations
 
 def main():
-    if len(sys.argv) != 6:
-        print("Usage: python sway_score.py <json_file> <address_frame> <top_frame> <impact_frame> <finish_frame>")
+    # -v で途中経過を表示する
+    verbose = '-v' in sys.argv[1:]
+    argv = [arg for arg in sys.argv if arg != '-v']
+    if len(argv) != 6:
+        print("Usage: python sway_score.py [-v] <json_file> <address_frame> <top_frame> <impact_frame> <finish_frame>")
         sys.exit(1)
     
-    json_file = sys.argv[1]
+    json_file = argv[1]
     try:
-        address_frame = int(sys.argv[2])
-        top_frame = int(sys.argv[3])
-        impact_frame = int(sys.argv[4])
-        finish_frame = int(sys.argv[5])
+        address_frame = int(argv[2])
+        top_frame = int(argv[3])
+        impact_frame = int(argv[4])
+        finish_frame = int(argv[5])
     except ValueError:
         print("フレーム番号は整数で指定してください。")
         sys.exit(1)
@@ -156,7 +219,8 @@ def main():
     }
     
     try:
-        score, deviations = calculate_sway_score(frames, keypoint_indices, phase_frames)
+        score, deviations, series = calculate_sway_score(frames, keypoint_indices, phase_frames, verbose,
+                                                         return_series=True)
     except ValueError as e:
         print(e)
         sys.exit(1)
@@ -167,5 +231,9 @@ def main():
         deviation_cm = deviations[phase]
         print(f"{phase.capitalize()}: {deviation_cm:.2f} cm")
 
+    for name, label in [('sway', 'スウェー'), ('slide', 'スライド')]:
+        if 'max_' + name in series:
+            print(f"最大{label}量: {series['max_' + name]:.2f} cm (Frame {series['max_' + name + '_frame']})")
+
 if __name__ == "__main__":
     main()
@@ -2,29 +2,8 @@ import json
 import numpy as np
 import sys
 from joint_mappings import keypoint_indices
-
-def load_swing_data(json_file):
-    """
-    JSONファイルからスイングデータをロードする
-    """
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-    return data['frames']
-
-def get_joint_position(frames, frame_number, joint_name, keypoints_mapping):
-    """
-    指定されたフレーム番号と関節名に対応する3D座標を取得する
-    """
-    frame = next((f for f in frames if f['frame_index'] == frame_number), None)
-    if frame is None:
-        raise ValueError(f"Frame {frame_number} が見つかりません。")
-    
-    joint_index = keypoints_mapping[joint_name]
-    joint = next((j for j in frame['joints'] if j['joint_index'] == joint_index), None)
-    if joint is None:
-        raise ValueError(f"Joint '{joint_name}' がフレーム {frame_number} に見つかりません。")
-    
-    return np.array([joint['coordinates']['x'], joint['coordinates']['y'], joint['coordinates']['z']])
+from swing_sequence import load_swing_data, get_joint_position
+from swing_phase_detection import detect_swing_phases
 
 def normalize_vector(vector):
     norm = np.linalg.norm(vector)
@@ -56,6 +35,34 @@ def calculate_rotation_angle(vector_ref, vector_target, axis):
 
     return angle_deg
 
+def calculate_rotation_angles(vectors_ref, vector_target, axis):
+    """
+    calculate_rotation_angle を全フレームに対して一度に計算する
+    vectors_ref: (T, 3), vector_target: (3, ) または (T, 3), axis: (3, )
+    戻り値は (T, ) の角度 [0, 360)。投影がゼロベクトルになるフレームは 0、欠損フレームは NaN とする
+    """
+    vectors_ref = np.asarray(vectors_ref, dtype=np.float64)
+    vector_target = np.broadcast_to(np.asarray(vector_target, dtype=np.float64), vectors_ref.shape)
+
+    # 回転軸に垂直な平面へまとめて投影する
+    v1_proj = vectors_ref - (vectors_ref @ axis)[:, np.newaxis] * axis
+    v2_proj = vector_target - (vector_target @ axis)[:, np.newaxis] * axis
+    v1_norm = np.linalg.norm(v1_proj, axis=1)
+    v2_norm = np.linalg.norm(v2_proj, axis=1)
+    degenerate = (v1_norm == 0) | (v2_norm == 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        orthonormal1 = v1_proj / v1_norm[:, np.newaxis]
+        v2_unit = v2_proj / v2_norm[:, np.newaxis]
+    orthonormal2 = np.cross(axis, orthonormal1)
+
+    x = np.einsum('ij,ij->i', v2_unit, orthonormal1)
+    y = np.einsum('ij,ij->i', v2_unit, orthonormal2)
+
+    angle_deg = np.degrees(np.arctan2(y, x)) % 360
+    angle_deg[degenerate] = 0.0
+    return angle_deg
+
 def calculate_x_factor(shoulder_rotation, waist_rotation):
     """
     Xファクター (肩と腰の回転角度の差) を計算
@@ -81,15 +88,123 @@ def evaluate_x_factor(x_factor):
 
     return score
 
+def calculate_spine_axis(frames, keypoints_mapping, address_frame):
+    """
+    アドレス時の腰から背骨中央への単位ベクトル（上向き）を回転軸とする
+    """
+    address_spine_axis = get_joint_position(frames, address_frame, "center_spine", keypoints_mapping) - \
+        get_joint_position(frames, address_frame, "center_hip", keypoints_mapping)
+
+    try:
+        spine_axis = normalize_vector(address_spine_axis)
+    except ValueError:
+        raise ValueError(f"Frame {address_frame} spine axis is a zero vector.")
+
+    if spine_axis[2] < 0:
+        spine_axis = -spine_axis
+    return spine_axis
+
+def calculate_x_factor_score(frames, keypoints_mapping, address_frame, top_frame):
+    """
+    アドレスからトップまでの腰と肩の回転角度、Xファクターとその評価スコアを計算する
+    """
+    joints_needed = ["left_shoulder", "right_shoulder", "left_hip", "right_hip"]
+
+    address_positions = {joint: get_joint_position(frames, address_frame, joint, keypoints_mapping) for joint in joints_needed}
+    top_positions = {joint: get_joint_position(frames, top_frame, joint, keypoints_mapping) for joint in joints_needed}
+
+    spine_axis = calculate_spine_axis(frames, keypoints_mapping, address_frame)
+
+    address_waist_vector = address_positions["right_hip"] - address_positions["left_hip"]
+    top_waist_vector = top_positions["right_hip"] - top_positions["left_hip"]
+
+    address_shoulder_vector = address_positions["right_shoulder"] - address_positions["left_shoulder"]
+    top_shoulder_vector = top_positions["right_shoulder"] - top_positions["left_shoulder"]
+
+    waist_rotation_top = calculate_rotation_angle(top_waist_vector, address_waist_vector, spine_axis)
+    shoulder_rotation_top = calculate_rotation_angle(top_shoulder_vector, address_shoulder_vector, spine_axis)
+
+    waist_rotation_top = waist_rotation_top % 360
+    shoulder_rotation_top = shoulder_rotation_top % 360
+
+    # Xファクターを計算
+    x_factor = calculate_x_factor(shoulder_rotation_top, waist_rotation_top)
+    x_factor_score = evaluate_x_factor(x_factor)
+
+    return x_factor_score, x_factor, waist_rotation_top, shoulder_rotation_top
+
+def calculate_x_factors(shoulder_rotation, waist_rotation):
+    """
+    全フレームのXファクター。肩と腰の回転角度の差を [-180, 180) に折り返した絶対値とする
+    """
+    return np.abs((shoulder_rotation - waist_rotation + 180) % 360 - 180)
+
+def summarize_x_factor(x_factor, frame_indices, top=None, end=None, address=None):
+    """
+    Xファクターの時系列 (T, ) から address から end（行番号、含む）までの最大値と、
+    トップから end までのXファクターストレッチを求める（フォロースルーは含めない）
+    address を指定しない場合は最初のフレームから、end を指定しない場合は最後のフレームまでとする
+    """
+    result = {}
+    start = 0 if address is None else address
+    stop = len(x_factor) if end is None else end + 1
+    swing = x_factor[start:max(stop, start + 1)]
+    if np.isnan(swing).all():
+        return result
+
+    peak = start + np.nanargmax(swing)
+    result['peak_x_factor'] = x_factor[peak]
+    result['peak_x_factor_frame'] = int(frame_indices[peak])
+
+    if top is not None:
+        downswing = x_factor[top:max(stop, top + 1)]
+        stretch = np.nanargmax(downswing) if not np.isnan(downswing).all() else 0
+        result['x_factor_top'] = x_factor[top]
+        result['x_factor_stretch'] = downswing[stretch] - x_factor[top]
+        result['x_factor_stretch_frame'] = int(frame_indices[top + stretch])
+
+    return result
+
+def calculate_x_factor_series(frames, keypoints_mapping, address_frame, top_frame=None, impact_frame=None):
+    """
+    全フレームの腰と肩の回転角度とXファクターを一度に計算する
+    Xファクターは肩と腰の回転角度の差を [-180, 180) に折り返した絶対値とする
+    （差の絶対値が180度以下のフレームでは calculate_x_factor と一致し、それ以外では 360 から引いた値になる）
+    最大値はアドレスからインパクト（未指定の場合は最後のフレーム）までの間で求める
+    top_frame を指定した場合は、トップからインパクトまでの間で
+    トップ時より増えたXファクターの最大値をXファクターストレッチとする
+    """
+    spine_axis = calculate_spine_axis(frames, keypoints_mapping, address_frame)
+    row = frames.row(address_frame)
+
+    waist_vectors = frames.joint("right_hip") - frames.joint("left_hip")
+    shoulder_vectors = frames.joint("right_shoulder") - frames.joint("left_shoulder")
+
+    waist_rotation = calculate_rotation_angles(waist_vectors, waist_vectors[row], spine_axis)
+    shoulder_rotation = calculate_rotation_angles(shoulder_vectors, shoulder_vectors[row], spine_axis)
+    x_factor = calculate_x_factors(shoulder_rotation, waist_rotation)
+
+    result = {
+        'frame_indices': frames.frame_indices,
+        'waist_rotation': waist_rotation,
+        'shoulder_rotation': shoulder_rotation,
+        'x_factor': x_factor,
+    }
+    top = frames.row(top_frame) if top_frame is not None else None
+    end = frames.row(impact_frame) if impact_frame is not None else None
+    result.update(summarize_x_factor(x_factor, frames.frame_indices, top, end, row))
+    return result
+
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: python script.py <json_file> <address_frame> <top_frame>")
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python script.py <json_file> <address_frame> <top_frame> [impact_frame]")
         sys.exit(1)
 
     json_file = sys.argv[1]
     try:
         address_frame = int(sys.argv[2])
         top_frame = int(sys.argv[3])
+        impact_frame = int(sys.argv[4]) if len(sys.argv) == 5 else None
     except ValueError:
         print("Frame numbers must be integers.")
         sys.exit(1)
@@ -103,41 +218,12 @@ def main():
         print(f"Error decoding JSON from file '{json_file}'.")
         sys.exit(1)
     
-    joints_needed = ["center_spine", "center_hip", "left_shoulder", "right_shoulder", "left_hip", "right_hip"]
-    
     try:
-        address_positions = {joint: get_joint_position(frames, address_frame, joint, keypoint_indices) for joint in joints_needed}
-        top_positions = {joint: get_joint_position(frames, top_frame, joint, keypoint_indices) for joint in joints_needed}
+        x_factor_score, x_factor, waist_rotation_top, shoulder_rotation_top = \
+            calculate_x_factor_score(frames, keypoint_indices, address_frame, top_frame)
     except ValueError as e:
         print(e)
         sys.exit(1)
-    
-    address_spine_axis = address_positions["center_spine"] - address_positions["center_hip"]
-    
-    try:
-        spine_axis = normalize_vector(address_spine_axis)
-    except ValueError:
-        print(f"Frame {address_frame} spine axis is a zero vector.")
-        sys.exit(1)
-    
-    if spine_axis[2] < 0:
-        spine_axis = -spine_axis
-    
-    address_waist_vector = address_positions["right_hip"] - address_positions["left_hip"]
-    top_waist_vector = top_positions["right_hip"] - top_positions["left_hip"]
-    
-    address_shoulder_vector = address_positions["right_shoulder"] - address_positions["left_shoulder"]
-    top_shoulder_vector = top_positions["right_shoulder"] - top_positions["left_shoulder"]
-    
-    waist_rotation_top = calculate_rotation_angle(top_waist_vector, address_waist_vector, spine_axis)
-    shoulder_rotation_top = calculate_rotation_angle(top_shoulder_vector, address_shoulder_vector, spine_axis)
-    
-    waist_rotation_top = waist_rotation_top % 360
-    shoulder_rotation_top = shoulder_rotation_top % 360
-    
-    # Xファクターを計算
-    x_factor = calculate_x_factor(shoulder_rotation_top, waist_rotation_top)
-    x_factor_score = evaluate_x_factor(x_factor)
 
     print(f"\nFrame {address_frame} to {top_frame} rotation angles:")
     print(f"Waist rotation at top: {waist_rotation_top:.2f} degrees")
@@ -145,5 +231,14 @@ def main():
     print(f"X Factor: {x_factor:.2f} degrees")
     print(f"X Factor Score: {x_factor_score}/100")
 
+    if impact_frame is None:
+        # インパクトが指定されていない場合は検出する（フォロースルーを最大値に含めないため）
+        phases = detect_swing_phases(frames, keypoint_indices, verbose=False)
+        impact_frame = phases['impact'] if phases else None
+    series = calculate_x_factor_series(frames, keypoint_indices, address_frame, top_frame, impact_frame)
+    if 'peak_x_factor' in series:
+        print(f"Peak X Factor: {series['peak_x_factor']:.2f} degrees at frame {series['peak_x_factor_frame']}")
+        print(f"X Factor Stretch: {series['x_factor_stretch']:.2f} degrees at frame {series['x_factor_stretch_frame']}")
+
 if __name__ == "__main__":
     main()
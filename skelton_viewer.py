@@ -1,3 +1,9 @@
+import os
+import struct
+import tempfile
+import shutil
+import time
+import zipfile
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
@@ -15,20 +21,87 @@ connections = [
     (8, 14), (14, 15), (15, 16)  # 左脚
 ]
 
+default_fps = 30  # NPZ ファイルに fps が保存されていない場合のフレームレート
+
 # グローバル変数
 skeleton_data = None
+extract_dir = None  # 圧縮された NPZ から展開した .npy の一時ディレクトリ（終了時に削除する）
 is_playing = False  # 再生中かどうかを示すフラグ
 current_frame = 0  # 現在のフレーム
 total_frames = 0  # フレームの総数
+fps = default_fps  # 再生するフレームレート
 progress_bar_updating = False  # プログレスバーを更新中かどうかのフラグ
+playback_start = None  # 再生を開始した時刻とフレーム
+pending_frame = None  # スライダー操作で次に描画するフレーム
+background = None  # ブリッティング用の背景
 
 def load_skeleton_data(npz_file):
-    data = np.load(npz_file)
-    return data['reconstruction']
+    """
+    reconstruction 配列をメモリマップで読み込む。必要なフレームだけがディスクから読まれる
+    無圧縮の NPZ（np.savez）はファイルを直接マップし、圧縮された NPZ（np.savez_compressed）は
+    一時ディレクトリに一度だけ展開してからマップする
+    """
+    with zipfile.ZipFile(npz_file) as archive:
+        info = archive.getinfo('reconstruction.npy')
+        if info.compress_type == zipfile.ZIP_STORED:
+            with open(npz_file, 'rb') as file:
+                # ローカルファイルヘッダ（30バイト + ファイル名 + 拡張フィールド）の後に .npy のデータが続く
+                file.seek(info.header_offset)
+                name_length, extra_length = struct.unpack('<HH', file.read(30)[26:30])
+                file.seek(info.header_offset + 30 + name_length + extra_length)
+                data = open_npy_memmap(file, npz_file)
+            return data if data is not None else np.load(npz_file, allow_pickle=True)['reconstruction']
 
-def visualize_skeleton(frame):
+        global extract_dir
+        if extract_dir is None:
+            extract_dir = tempfile.mkdtemp(prefix='skeleton_viewer_')
+        stat = os.stat(npz_file)
+        cache_file = os.path.join(extract_dir, '{}_{}_{}.npy'.format(
+            os.path.splitext(os.path.basename(npz_file))[0], stat.st_size, int(stat.st_mtime)))
+        if not os.path.exists(cache_file):
+            with archive.open(info) as source, open(cache_file + '.part', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.replace(cache_file + '.part', cache_file)
+
+    with open(cache_file, 'rb') as file:
+        data = open_npy_memmap(file, cache_file)
+    return data if data is not None else np.load(cache_file, allow_pickle=True)
+
+def open_npy_memmap(file, filename):
+    """
+    file の現在位置にある .npy のデータを読み込み専用でメモリマップする
+    オブジェクト配列（人ごとにフレーム数が異なる場合）はマップできないので None を返す
+    """
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    if dtype.hasobject:
+        return None
+    return np.memmap(filename, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                     order='F' if fortran_order else 'C')
+
+def load_fps(npz_file):
+    with np.load(npz_file) as data:
+        fps = float(data['fps']) if 'fps' in data.files else 0
+    return fps if fps > 0 else default_fps
+
+def on_close():
+    """
+    メモリマップを解放してから展開した一時ファイルを削除する
+    """
     global skeleton_data
-    ax.clear()
+    stop_playback()
+    skeleton_data = None
+    if extract_dir is not None:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+    root.destroy()
+
+def create_artists():
+    """
+    散布図と骨の線を一度だけ作成する。以降のフレームではデータだけを更新する
+    """
     ax.set_xlabel('X')
     ax.set_ylabel('Y')
     ax.set_zlabel('Z')
@@ -37,108 +110,163 @@ def visualize_skeleton(frame):
     ax.set_ylim3d([-1, 1])
     ax.set_zlim3d([0, 2])
 
-    x_data = frame[:, 0]
-    y_data = frame[:, 1]
-    z_data = frame[:, 2]
-    ax.scatter(x_data, y_data, z_data, color='b')
+    joints = ax.scatter([], [], [], color='b', animated=True)
+    bones = [ax.plot([], [], [], color=h36m_color_edge(start), animated=True)[0] for start, _ in connections]
+    return joints, bones
+
+def on_draw(event):
+    """
+    図全体が再描画された時（ウィンドウのサイズ変更や視点の回転）に背景を取り直す
+    """
+    global background
+    background = canvas.copy_from_bbox(fig.bbox)
+    draw_artists()
+
+def draw_artists():
+    joints_artist.do_3d_projection()
+    ax.draw_artist(joints_artist)
+    for bone in bone_artists:
+        ax.draw_artist(bone)
 
-    for (start, end) in connections:
+def visualize_skeleton(frame):
+    frame = np.asarray(frame)
+    joints_artist._offsets3d = (frame[:, 0], frame[:, 1], frame[:, 2])
+
+    for bone, (start, end) in zip(bone_artists, connections):
         if start < frame.shape[0] and end < frame.shape[0]:
-            color = h36m_color_edge(start)
-            ax.plot([frame[start, 0], frame[end, 0]], 
-                    [frame[start, 1], frame[end, 1]], 
-                    [frame[start, 2], frame[end, 2]], color=color)
+            bone.set_data_3d([frame[start, 0], frame[end, 0]],
+                             [frame[start, 1], frame[end, 1]],
+                             [frame[start, 2], frame[end, 2]])
+
+    if background is None:
+        canvas.draw()
+        return
+    # 背景を復元して骨格だけを描き直す
+    canvas.restore_region(background)
+    draw_artists()
+    canvas.blit(fig.bbox)
 
-    canvas.draw()
+def set_progress(frame_index):
+    global progress_bar_updating
+    # プログレスバー更新フラグを設定
+    progress_bar_updating = True
+    progress_bar.set(frame_index)
+    progress_bar_updating = False
 
 def play_skeleton():
-    global is_playing, current_frame, total_frames, progress_bar_updating
-    if is_playing and current_frame < total_frames:
-        print(f"Playing frame {current_frame}/{total_frames}")  # デバッグ用出力
+    global is_playing, current_frame
+    if not is_playing:
+        return
+
+    # 再生開始からの経過時間で表示するフレームを決め、描画が間に合わない場合はフレームを飛ばす
+    start_time, start_frame = playback_start
+    target_frame = start_frame + int((time.perf_counter() - start_time) * fps)
+    if target_frame >= total_frames:
+        current_frame = total_frames
+        print("Playback finished.")
+        is_playing = False  # 再生が終了したのでフラグをFalseにする
+        return
+
+    if target_frame != current_frame:
+        current_frame = target_frame
         visualize_skeleton(skeleton_data[0][current_frame])
-        current_frame += 1
-
-        # プログレスバー更新フラグを設定
-        progress_bar_updating = True
-        progress_bar.set(current_frame)
-        progress_bar_updating = False
-
-        if current_frame < total_frames:
-            root.after(100, play_skeleton)  # 100ミリ秒後に次のフレームを描画
-        else:
-            print("Playback finished.")
-            is_playing = False  # 再生が終了したのでフラグをFalseにする
-    else:
-        print("Playback stopped or reached the end of frames.")
+        set_progress(current_frame)
+
+    # 次のフレームの表示時刻まで待つ
+    next_time = start_time + (target_frame + 1 - start_frame) / fps
+    root.after(max(int((next_time - time.perf_counter()) * 1000), 1), play_skeleton)
 
 def start_playback():
-    global is_playing, current_frame  # グローバル変数として宣言
+    global is_playing, current_frame, playback_start  # グローバル変数として宣言
     if total_frames == 0:
         print("No data loaded or no frames to play.")
         return
-    if current_frame >= total_frames:
+    if is_playing:
+        return
+    if current_frame >= total_frames - 1:
         current_frame = 0  # 全フレーム再生後にリセット
+        visualize_skeleton(skeleton_data[0][current_frame])
+        set_progress(current_frame)
     is_playing = True
+    playback_start = (time.perf_counter(), current_frame)
     print("Playback started.")
     play_skeleton()  # 再生を開始
 
 def stop_playback():
     global is_playing
+    if is_playing:
+        print("Playback stopped.")
     is_playing = False
-    print("Playback stopped.")
 
 def reset_playback():
     global current_frame
     stop_playback()
     current_frame = 0
-    progress_bar.set(0)
-    visualize_skeleton(skeleton_data[0][current_frame])
+    set_progress(0)
+    if total_frames > 0:
+        visualize_skeleton(skeleton_data[0][current_frame])
 
 def on_progress_change(value):
-    global current_frame, is_playing, progress_bar_updating
+    global pending_frame
     # プログラムからの更新中は処理をスキップ
-    if progress_bar_updating:
+    if progress_bar_updating or total_frames == 0:
         return
     stop_playback()  # 再生中にスライダーを動かすと一旦再生を止める
-    current_frame = int(float(value))
-    print(f"Jumping to frame {current_frame}") 
+
+    # 連続したスライダーのイベントはまとめて、アイドル時に最後のフレームだけを描画する
+    if pending_frame is None:
+        root.after_idle(draw_pending_frame)
+    pending_frame = min(int(float(value)), total_frames - 1)
+
+def draw_pending_frame():
+    global current_frame, pending_frame
+    current_frame = pending_frame
+    pending_frame = None
     visualize_skeleton(skeleton_data[0][current_frame])
 
 def open_file():
-    global skeleton_data, total_frames, current_frame
+    global skeleton_data, total_frames, current_frame, fps
     file_path = filedialog.askopenfilename(filetypes=[("NPZ files", "*.npz")])
     if file_path:
+        stop_playback()
         skeleton_data = load_skeleton_data(file_path)
+        fps = load_fps(file_path)
         total_frames = len(skeleton_data[0])
         current_frame = 0
         progress_bar.config(to=total_frames - 1)
-        print(f"Loaded {total_frames} frames.")  # デバッグ用出力
+        set_progress(0)
+        print(f"Loaded {total_frames} frames ({fps:g} fps).")  # デバッグ用出力
         visualize_skeleton(skeleton_data[0][current_frame])
 
-# tkinterを使ったシンプルなGUIの作成
-root = tk.Tk()
-root.title("3D Skeleton Viewer")
-root.geometry("400x300")
+if __name__ == "__main__":
+    # tkinterを使ったシンプルなGUIの作成
+    root = tk.Tk()
+    root.title("3D Skeleton Viewer")
+    root.geometry("400x300")
+
+    open_button = tk.Button(root, text="Open NPZ File", command=open_file)
+    open_button.pack(pady=5)
 
-open_button = tk.Button(root, text="Open NPZ File", command=open_file)
-open_button.pack(pady=5)
+    progress_bar = ttk.Scale(root, from_=0, to=100, orient="horizontal", length=300, command=on_progress_change)
+    progress_bar.pack(pady=5)
 
-progress_bar = ttk.Scale(root, from_=0, to=100, orient="horizontal", length=300, command=on_progress_change)
-progress_bar.pack(pady=5)
+    play_button = tk.Button(root, text="Play", command=start_playback)
+    play_button.pack(pady=5)
 
-play_button = tk.Button(root, text="Play", command=start_playback)
-play_button.pack(pady=5)
+    stop_button = tk.Button(root, text="Stop", command=stop_playback)
+    stop_button.pack(pady=5)
 
-stop_button = tk.Button(root, text="Stop", command=stop_playback)
-stop_button.pack(pady=5)
+    reset_button = tk.Button(root, text="Reset", command=reset_playback)
+    reset_button.pack(pady=5)
 
-reset_button = tk.Button(root, text="Reset", command=reset_playback)
-reset_button.pack(pady=5)
+    # matplotlib Figureをtkinterに埋め込むための設定
+    fig = plt.Figure()
+    ax = fig.add_subplot(111, projection='3d')
+    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas.get_tk_widget().pack()
 
-# matplotlib Figureをtkinterに埋め込むための設定
-fig = plt.Figure()
-ax = fig.add_subplot(111, projection='3d')
-canvas = FigureCanvasTkAgg(fig, master=root)
-canvas.get_tk_widget().pack()
+    joints_artist, bone_artists = create_artists()
+    canvas.mpl_connect('draw_event', on_draw)
 
-root.mainloop()
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.mainloop()
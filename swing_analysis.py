@@ -0,0 +1,211 @@
+import sys
+from collections import OrderedDict
+import numpy as np
+from joint_mappings import keypoint_indices
+from swing_sequence import load_swing_data, normalize_phases, phase_names
+from swing_phase_detection import detect_swing_phases
+from score_sway import calculate_ankle_frame, transform_to_local, summarize_sway, evaluate_sway
+from score_xFactor import calculate_spine_axis, calculate_rotation_angles, calculate_x_factors, summarize_x_factor, \
+    evaluate_x_factor
+
+# 名前 --> (関数, 入力の名前)
+quantities = OrderedDict()
+metrics = OrderedDict()
+
+
+def quantity(name, inputs=()):
+    """
+    複数の指標で共有する中間量を登録するデコレータ。関数は inputs の値を順に引数として受け取る
+    """
+    def register(func):
+        quantities[name] = (func, tuple(inputs))
+        return func
+    return register
+
+
+def metric(name, inputs=()):
+    """
+    指標を登録するデコレータ。関数は inputs の値を順に引数として受け取り、
+    スカラー値の辞書（表の列）と時系列の辞書を返す
+    """
+    def register(func):
+        metrics[name] = (func, tuple(inputs))
+        return func
+    return register
+
+
+class SwingAnalysis:
+    """
+    1スイングの解析。中間量は最初に必要になった時に一度だけ計算し、すべての指標で共有する
+    frames, keypoints_mapping, fps は中間量として参照できる。phases を指定した場合はフェーズ検出を省略する
+    """
+
+    def __init__(self, frames, keypoints_mapping=keypoint_indices, fps=30., phases=None):
+        self.cache = {'frames': frames, 'keypoints_mapping': keypoints_mapping, 'fps': fps}
+        if phases is not None:
+            self.cache['phases'] = normalize_phases(phases)
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            func, inputs = quantities[name]
+            self.cache[name] = func(*[self[input_name] for input_name in inputs])
+        return self.cache[name]
+
+    def evaluate(self, metric_names=None):
+        """
+        :param metric_names: 計算する指標の名前。None の場合は登録されているすべての指標
+        :return: フェーズ、スカラー値（表の列）、時系列
+        :raises ValueError: 登録されていない指標が指定された場合
+        """
+        metric_names = metric_names or list(metrics)
+        unknown = [name for name in metric_names if name not in metrics]
+        if unknown:
+            raise ValueError(f"不明な指標です: {unknown}。指定できる指標: {list(metrics)}")
+        values = OrderedDict((phase + '_frame', self['phases'][phase]) for phase in phase_names)
+        series = {}
+        for name in metric_names:
+            func, inputs = metrics[name]
+            metric_values, metric_series = func(*[self[input_name] for input_name in inputs])
+            values.update(metric_values)
+            series.update(metric_series)
+        return {'phases': self['phases'], 'values': values, 'series': series}
+
+
+def analyze_swing(frames, metric_names=None, keypoints_mapping=keypoint_indices, fps=30., phases=None):
+    return SwingAnalysis(frames, keypoints_mapping, fps, phases).evaluate(metric_names)
+
+
+# 共有する中間量
+
+@quantity('phases', inputs=('frames', 'keypoints_mapping'))
+def phases_quantity(frames, keypoints_mapping):
+    phases = detect_swing_phases(frames, keypoints_mapping, verbose=False)
+    if phases is None:
+        raise ValueError("フェーズの検出に失敗しました。")
+    return phases
+
+
+@quantity('phase_rows', inputs=('frames', 'phases'))
+def phase_rows_quantity(frames, phases):
+    return {phase: frames.row(frame_index) for phase, frame_index in phases.items()}
+
+
+@quantity('ankle_frame', inputs=('frames', 'keypoints_mapping', 'phases'))
+def ankle_frame_quantity(frames, keypoints_mapping, phases):
+    return calculate_ankle_frame(frames, keypoints_mapping, phases['address'], log=lambda *args: None)
+
+
+@quantity('local_coords', inputs=('frames', 'ankle_frame'))
+def local_coords_quantity(frames, ankle_frame):
+    # 全フレーム・全関節のアドレス時の足首の局所座標 (T, J, 3)（cm）
+    return transform_to_local(frames.joints, *ankle_frame) * 100
+
+
+@quantity('spine_axis', inputs=('frames', 'keypoints_mapping', 'phases'))
+def spine_axis_quantity(frames, keypoints_mapping, phases):
+    return calculate_spine_axis(frames, keypoints_mapping, phases['address'])
+
+
+@quantity('segment_vectors', inputs=('frames', ))
+def segment_vectors_quantity(frames):
+    return {'waist': frames.joint('right_hip') - frames.joint('left_hip'),
+            'shoulder': frames.joint('right_shoulder') - frames.joint('left_shoulder')}
+
+
+@quantity('rotations', inputs=('segment_vectors', 'spine_axis', 'phase_rows'))
+def rotations_quantity(segment_vectors, spine_axis, phase_rows):
+    address = phase_rows['address']
+    return {name: calculate_rotation_angles(vectors, vectors[address], spine_axis)
+            for name, vectors in segment_vectors.items()}
+
+
+@quantity('velocities', inputs=('frames', 'fps'))
+def velocities_quantity(frames, fps):
+    # 全関節の速度 (T, J, 3)（m/s）
+    if len(frames) < 2:
+        return np.zeros_like(frames.joints)
+    return np.gradient(frames.joints, axis=0) * fps
+
+
+# 指標
+
+@metric('sway', inputs=('frames', 'keypoints_mapping', 'local_coords', 'phase_rows'))
+def sway_metric(frames, keypoints_mapping, local_coords, phase_rows):
+    pelvis = local_coords[:, keypoints_mapping['center_hip'], 0]
+
+    values = OrderedDict()
+    deviations = pelvis[[phase_rows[phase] for phase in ['top', 'impact', 'finish']]]
+    if np.isnan(deviations).any():
+        raise ValueError("Joint 'center_hip' がフェーズのフレームに見つかりません。")
+    values['sway_score'] = float(evaluate_sway(np.abs(deviations).max()))
+    for phase, deviation in zip(['top', 'impact', 'finish'], deviations):
+        values['sway_' + phase + '_cm'] = float(deviation)
+
+    summary = summarize_sway(pelvis, frames.frame_indices, phase_rows['address'], phase_rows['top'],
+                             phase_rows['finish'])
+    for name in ['max_sway', 'max_sway_frame', 'max_slide', 'max_slide_frame']:
+        values[name] = summary.get(name)
+    return values, {'pelvis_lateral': pelvis, 'sway': summary['sway'], 'slide': summary['slide']}
+
+
+@metric('x_factor', inputs=('frames', 'rotations', 'phase_rows'))
+def x_factor_metric(frames, rotations, phase_rows):
+    top = phase_rows['top']
+    waist_rotation, shoulder_rotation = rotations['waist'], rotations['shoulder']
+
+    values = OrderedDict()
+    x_factor_top = abs(shoulder_rotation[top] - waist_rotation[top])
+    values['x_factor_score'] = float(evaluate_x_factor(x_factor_top))
+    values['x_factor'] = float(x_factor_top)
+    values['waist_rotation_top'] = float(waist_rotation[top])
+    values['shoulder_rotation_top'] = float(shoulder_rotation[top])
+
+    x_factor = calculate_x_factors(shoulder_rotation, waist_rotation)
+    summary = summarize_x_factor(x_factor, frames.frame_indices, top, phase_rows['impact'],
+                                 phase_rows['address'])
+    for name in ['peak_x_factor', 'peak_x_factor_frame', 'x_factor_stretch', 'x_factor_stretch_frame']:
+        values[name] = summary.get(name)
+    return values, {'waist_rotation': waist_rotation, 'shoulder_rotation': shoulder_rotation, 'x_factor': x_factor}
+
+
+@metric('tempo', inputs=('phase_rows', 'fps'))
+def tempo_metric(phase_rows, fps):
+    backswing = (phase_rows['top'] - phase_rows['address']) / fps
+    downswing = (phase_rows['impact'] - phase_rows['top']) / fps
+    values = OrderedDict([('backswing_seconds', backswing), ('downswing_seconds', downswing),
+                          ('tempo_ratio', backswing / downswing if downswing > 0 else None)])
+    return values, {}
+
+
+@metric('hand_speed', inputs=('frames', 'keypoints_mapping', 'velocities', 'phase_rows'))
+def hand_speed_metric(frames, keypoints_mapping, velocities, phase_rows):
+    speed = np.linalg.norm(velocities[:, keypoints_mapping['left_wrist']], axis=1)
+
+    # ダウンスイングからフィニッシュまでの手首の最大速度
+    start, end = phase_rows['top'], phase_rows['finish'] + 1
+    values = OrderedDict([('hand_speed_impact', float(speed[phase_rows['impact']]))])
+    if not np.isnan(speed[start:end]).all():
+        peak = start + np.nanargmax(speed[start:end])
+        values['peak_hand_speed'] = float(speed[peak])
+        values['peak_hand_speed_frame'] = int(frames.frame_indices[peak])
+    return values, {'hand_speed': speed}
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python swing_analysis.py <json_file> [metric ...]")
+        sys.exit(1)
+
+    frames = load_swing_data(sys.argv[1])
+    try:
+        result = analyze_swing(frames, sys.argv[2:] or None)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    for name, value in result['values'].items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,54 @@
-import json
 import numpy as np
 import sys
-import matplotlib.pyplot as plt
 from joint_mappings import keypoint_indices  # Import joint mappings from separate file
+from swing_sequence import load_swing_data
 
-def load_swing_data(json_file):
+def get_joint_coordinates(frames, joint_name, keypoints_mapping):
     """
-    JSONファイルからスイングデータをロードする
+    指定された関節名の座標を各フレームから抽出する
     """
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-    return data['frames']
+    return frames.joints[:, keypoints_mapping[joint_name]]
 
-def get_joint_coordinates(frames, joint_name, keypoints_mapping):
+def find_crossing_indices(z_coords, z_mid):
     """
-    指定された関節名の座標を各フレームから抽出する
+    中点を超えるフレームと、上昇して超えたかどうかを np.diff でまとめて検出する
+    上昇: z[i-1] < z_mid <= z[i]、減少: z[i-1] > z_mid >= z[i]
     """
-    joint_index = keypoints_mapping[joint_name]
-    coordinates = []
-    for frame in frames:
-        joint = next((j for j in frame['joints'] if j['joint_index'] == joint_index), None)
-        if joint:
-            coordinates.append([
-                joint['coordinates']['x'],
-                joint['coordinates']['y'],
-                joint['coordinates']['z']
-            ])
-        else:
-            coordinates.append([np.nan, np.nan, np.nan])
-    return np.array(coordinates)
+    up = np.diff((z_coords >= z_mid).astype(np.int8)) == 1
+    down = np.diff((z_coords > z_mid).astype(np.int8)) == -1
+    indices = np.flatnonzero(up | down) + 1
+    return indices, up[indices - 1]
 
 def find_crossing_points(z_coords, z_mid):
     """
     Z座標が中点を上昇して超えるポイントと、減少して超えるポイントを検出する
     """
-    crossing_points = []
-    for i in range(1, len(z_coords)):
-        if z_coords[i-1] < z_mid and z_coords[i] >= z_mid:  # 上昇して中点を超える
-            crossing_points.append((i, 'up'))
-        elif z_coords[i-1] > z_mid and z_coords[i] <= z_mid:  # 減少して中点を超える
-            crossing_points.append((i, 'down'))
-    return crossing_points
+    indices, is_up = find_crossing_indices(z_coords, z_mid)
+    return [(int(i), 'up' if up else 'down') for i, up in zip(indices, is_up)]
 
 def find_top_impact(crossing_points, z_coords):
     """
     中点を上昇・減少で超えるポイント間でトップとインパクトを検出する
+    条件を満たす区間が複数ある場合は最後の区間を用いる
     """
     top_frame = None
     impact_frame = None
 
-    for i in range(1, len(crossing_points) - 1):
-        if crossing_points[i-1][1] == 'up' and crossing_points[i][1] == 'down':
-            start, end = crossing_points[i-1][0], crossing_points[i][0]
-            top_frame = np.argmax(z_coords[start:end]) + start
+    indices = np.array([point[0] for point in crossing_points], dtype=np.int64)
+    is_up = np.array([point[1] == 'up' for point in crossing_points], dtype=bool)
+    candidates = np.arange(1, len(crossing_points) - 1)
 
-        if crossing_points[i][1] == 'down' and crossing_points[i+1][1] == 'up':
-            start, end = crossing_points[i][0], crossing_points[i+1][0]
-            impact_frame = np.argmin(z_coords[start:end]) + start
+    # 上昇 → 減少 の区間の最大値がトップ
+    tops = candidates[is_up[candidates - 1] & ~is_up[candidates]]
+    if len(tops) > 0:
+        start, end = indices[tops[-1] - 1], indices[tops[-1]]
+        top_frame = np.argmax(z_coords[start:end]) + start
+
+    # 減少 → 上昇 の区間の最小値がインパクト
+    impacts = candidates[~is_up[candidates] & is_up[candidates + 1]]
+    if len(impacts) > 0:
+        start, end = indices[impacts[-1]], indices[impacts[-1] + 1]
+        impact_frame = np.argmin(z_coords[start:end]) + start
 
     return top_frame, impact_frame
 
@@ -67,46 +59,145 @@ def find_finish(z_coords, impact_frame):
     finish_frame = np.argmax(z_coords[impact_frame:]) + impact_frame
     return finish_frame
 
-def detect_swing_phases(frames, keypoints_mapping):
+def detect_swing_phases(frames, keypoints_mapping, verbose=True):
     """
     スイングの各フェーズのframe_indexを検出する
+    verbose が False の場合は検出失敗の理由を表示しない
     """
     # 左手の座標を取得（left_wrist）
     left_wrist_coords = get_joint_coordinates(frames, 'left_wrist', keypoints_mapping)
     z_coords = left_wrist_coords[:, 2]
 
     # Z座標の中点を計算
-    z_mid = (min(z_coords) + max(z_coords)) / 2
+    z_mid = (np.nanmin(z_coords) + np.nanmax(z_coords)) / 2
 
     # 中点を超える上昇ポイントと減少ポイントを検出
     crossing_points = find_crossing_points(z_coords, z_mid)
 
     if len(crossing_points) < 3:
-        print("十分な中点交差ポイントが見つかりませんでした")
+        if verbose:
+            print("十分な中点交差ポイントが見つかりませんでした")
         return None
 
     # トップとインパクトを検出
     top_frame, impact_frame = find_top_impact(crossing_points, z_coords)
 
+    if top_frame is None or impact_frame is None:
+        if verbose:
+            print("トップ、インパクト、フィニッシュの検出に失敗しました")
+        return None
+
     # フィニッシュはインパクト後の最大のZ座標を持つフレームとする
     finish_frame = find_finish(z_coords, impact_frame)
 
-    if top_frame is None or impact_frame is None or finish_frame is None:
-        print("トップ、インパクト、フィニッシュの検出に失敗しました")
-        return None
-
     return {
-        'address': frames[0]['frame_index'],  # アドレスはフレームの最初とする
-        'top_of_swing': frames[top_frame]['frame_index'],
-        'impact': frames[impact_frame]['frame_index'],
-        'finish': frames[finish_frame]['frame_index']
+        'address': int(frames.frame_indices[0]),  # アドレスはフレームの最初とする
+        'top': int(frames.frame_indices[top_frame]),
+        'impact': int(frames.frame_indices[impact_frame]),
+        'finish': int(frames.frame_indices[finish_frame])
     }
 
+class OnlineSwingPhaseDetector:
+    """
+    フレームを1つずつ受け取り、各フェーズが確定した時点でイベントを発行する状態機械
+    全体の中点の代わりに、それまでのZ座標の最小値と最大値から中点を求める
+      address: 最初のフレーム
+      top: 最小値から min_rise 以上上昇した後、中点を下回った時点でそれまでの最大値のフレーム
+      impact: トップの後、中点を上回った時点でそれまでの最小値のフレーム
+      finish: インパクトの後、最大値が settle_frames フレーム更新されないか、
+              最大値とインパクトの中点を下回った時点（または flush 時）で最大値のフレーム
+    """
+
+    def __init__(self, keypoints_mapping=keypoint_indices, joint_name='left_wrist', min_rise=0.2, settle_frames=15):
+        self.joint_index = keypoints_mapping[joint_name]
+        self.min_rise = min_rise
+        self.settle_frames = settle_frames
+        self.reset()
+
+    def reset(self):
+        """
+        次のスイングの検出を始める
+        """
+        self.state = 'address'
+        self.phases = {}
+        self.z_min = np.inf
+        self.z_mid = None
+        self.extreme = None  # 現在の状態で探している極値 (z, frame_index)
+        self.since_extreme = 0
+
+    def _emit(self, phase, frame_index, events):
+        self.phases[phase] = frame_index
+        events.append((phase, frame_index))
+
+    def push(self, frame_index, pose):
+        """
+        :param frame_index: フレーム番号
+        :param pose: (J, 3) の3D姿勢
+        :return: このフレームで確定したフェーズのリスト [(phase, frame_index)]
+        """
+        events = []
+        z = float(pose[self.joint_index, 2])
+        if np.isnan(z) or self.state == 'done':
+            return events
+
+        if self.state == 'address':
+            self._emit('address', frame_index, events)
+            self.z_min = z
+            self.state = 'backswing'
+            return events
+
+        if self.state == 'backswing':
+            if self.extreme is None:
+                # 上昇が始まるまでは最小値を更新する
+                self.z_min = min(self.z_min, z)
+                if z - self.z_min >= self.min_rise:
+                    self.extreme = (z, frame_index)
+            elif z > self.extreme[0]:
+                self.extreme = (z, frame_index)
+            elif z <= (self.z_min + self.extreme[0]) / 2:
+                self.z_mid = (self.z_min + self.extreme[0]) / 2
+                self._emit('top', self.extreme[1], events)
+                self.state = 'downswing'
+                self.extreme = (z, frame_index)
+
+        elif self.state == 'downswing':
+            if z < self.extreme[0]:
+                self.extreme = (z, frame_index)
+            elif z >= self.z_mid:
+                self.z_min = self.extreme[0]
+                self._emit('impact', self.extreme[1], events)
+                self.state = 'follow_through'
+                self.extreme = (z, frame_index)
+                self.since_extreme = 0
+
+        elif self.state == 'follow_through':
+            if z > self.extreme[0]:
+                self.extreme = (z, frame_index)
+                self.since_extreme = 0
+            else:
+                self.since_extreme += 1
+                if self.since_extreme >= self.settle_frames or z <= (self.z_min + self.extreme[0]) / 2:
+                    events += self.flush()
+
+        return events
+
+    def flush(self):
+        """
+        入力の終わりに、フォロースルー中であればフィニッシュを確定する
+        """
+        events = []
+        if self.state == 'follow_through':
+            self._emit('finish', self.extreme[1], events)
+            self.state = 'done'
+        return events
+
 def visualize_phases(frames, z_coords, phases):
     """
     フェーズ検出結果を可視化する
     """
-    frame_indices = np.array([frame['frame_index'] for frame in frames])
+    import matplotlib.pyplot as plt
+
+    frame_indices = frames.frame_indices
 
     plt.figure(figsize=(12, 6))
     plt.plot(frame_indices, z_coords, label='Left Wrist Z Coordinate')
@@ -114,7 +205,7 @@ def visualize_phases(frames, z_coords, phases):
     # フェーズポイントのプロット
     if phases:
         plt.scatter(phases['address'], z_coords[phases['address']], color='blue', label='Address', zorder=5)
-        plt.scatter(phases['top_of_swing'], z_coords[phases['top_of_swing']], color='orange', label='Top of Swing', zorder=5)
+        plt.scatter(phases['top'], z_coords[phases['top']], color='orange', label='Top of Swing', zorder=5)
         plt.scatter(phases['impact'], z_coords[phases['impact']], color='green', label='Impact', zorder=5)
         plt.scatter(phases['finish'], z_coords[phases['finish']], color='red', label='Finish', zorder=5)
 
@@ -0,0 +1,132 @@
+import argparse
+import os
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from joint_mappings import keypoint_indices
+from swing_sequence import load_swing_data
+from score_batch import score_frames, write_table
+
+
+def moving_average(values, window):
+    """
+    累積和による移動平均（長さは変わらない）
+    """
+    window = max(int(window), 1)
+    cumsum = np.concatenate([[0.], np.cumsum(values)])
+    padded = np.pad(cumsum, (window // 2, window - 1 - window // 2), mode='edge')
+    return (padded[window:] - padded[:-window]) / window
+
+
+def find_active_runs(active):
+    """
+    True が連続する区間 [start, end) をすべて取得する
+    """
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+def segment_swings(frames, keypoints_mapping=keypoint_indices, fps=30., joint_name='left_wrist',
+                   speed_threshold=1.0, rest_speed=0.1, min_rise=0.3, smooth_seconds=0.2, merge_seconds=0.4,
+                   margin_seconds=0.5, min_seconds=0.5):
+    """
+    長いセッションの3D姿勢を個々のスイングの区間に分割する（全体で線形時間）
+    手首の速度の包絡線が rest_speed (m/s) を超え続ける区間のうち、speed_threshold (m/s) を超えるフレームを含む区間を
+    動作区間とし（ゆっくりとしたバックスイングの始まりも含める）、間隔が merge_seconds 未満の区間を結合する。
+    区間の前の静止位置から手首が min_rise (m) 以上上がった区間をスイングとみなし、
+    アドレスとフィニッシュを含むように前後に margin_seconds ずつ広げる
+    :return: SwingSequence の行番号の区間 [(start, end)]（end は含まない）
+    """
+    num_frames = len(frames)
+    wrist = frames.joint(joint_name)
+
+    # 手首の速度の包絡線（欠損フレームは静止とみなす）
+    speed = np.zeros(num_frames)
+    if num_frames > 1:
+        speed[1:] = np.nan_to_num(np.linalg.norm(np.diff(wrist, axis=0), axis=1) * fps)
+    envelope = moving_average(speed, smooth_seconds * fps)
+
+    runs = find_active_runs(envelope > rest_speed)
+    if len(runs) == 0:
+        return []
+    runs = runs[np.maximum.reduceat(np.append(envelope, 0.), runs.ravel())[::2] > speed_threshold]
+    if len(runs) == 0:
+        return []
+
+    # 間隔の短い動作区間を結合する
+    gaps = runs[1:, 0] - runs[:-1, 1]
+    new_segment = np.concatenate([[True], gaps >= merge_seconds * fps])
+    starts = runs[new_segment, 0]
+    ends = runs[np.concatenate([new_segment[1:], [True]]), 1]
+
+    # 手首の高さの包絡線：動作区間の最大の高さと、動作前の高さを比べる
+    height = np.append(np.nan_to_num(wrist[:, 2], nan=-np.inf), -np.inf)
+    peak_height = np.maximum.reduceat(height, np.stack([starts, ends], axis=1).ravel())[::2]
+    rest_height = height[np.maximum(starts - 1, 0)]
+
+    keep = (peak_height - rest_height >= min_rise) & (ends - starts >= min_seconds * fps)
+    starts, ends = starts[keep], ends[keep]
+
+    # アドレスとフィニッシュの静止部分を含めるが、隣の区間とは重ならないようにする
+    margin = int(round(margin_seconds * fps))
+    bounds = (ends[:-1] + starts[1:]) // 2
+    seg_starts = np.maximum(starts - margin, np.concatenate([[0], bounds]))
+    seg_ends = np.minimum(ends + margin, np.concatenate([bounds, [num_frames]]))
+    return [(int(start), int(end)) for start, end in zip(seg_starts, seg_ends)]
+
+
+def score_segment(segment, fps=30.):
+    """
+    1区間のスイングを採点する。例外は error 列に記録する
+    """
+    index, frames = segment
+    row = {'segment': index, 'start_frame': int(frames.frame_indices[0]), 'end_frame': int(frames.frame_indices[-1]),
+           'error': ''}
+    try:
+        row.update(score_frames(frames, fps))
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def analyze_session(frames, num_workers=None, fps=30., **kwargs):
+    """
+    セッションをスイングごとに分割し、各スイングのフェーズ検出と採点をプロセスプールで並列に行う
+    fps は分割と採点の両方に使い、kwargs は segment_swings に渡す
+    """
+    segments = [(index, frames.slice(start, end))
+                for index, (start, end) in enumerate(segment_swings(frames, fps=fps, **kwargs))]
+    if len(segments) == 0:
+        return []
+
+    with Pool(num_workers or min(os.cpu_count(), len(segments))) as pool:
+        return pool.map(partial(score_segment, fps=fps), segments)
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser('Swing segmentation of practice sessions.')
+    parser.add_argument('json_file', type=str, help='swing JSON file of a whole session')
+    parser.add_argument('-o', '--output', type=str, default='session_scores.csv', help='output .csv or .parquet table')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--fps', type=float, default=30., help='frame rate of the session')
+    parser.add_argument('--speed-threshold', type=float, default=1.0, help='wrist speed of a swing (m/s)')
+    parser.add_argument('--rest-speed', type=float, default=0.1, help='wrist speed at rest (m/s)')
+    parser.add_argument('--min-rise', type=float, default=0.3, help='minimum wrist rise of a swing (m)')
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    frames = load_swing_data(args.json_file)
+    rows = analyze_session(frames, args.workers, fps=args.fps, speed_threshold=args.speed_threshold,
+                           rest_speed=args.rest_speed, min_rise=args.min_rise)
+    write_table(rows, args.output)
+
+    for row in rows:
+        status = row['error'] or f"sway {row['sway_score']:.1f}, X factor {row['x_factor_score']:.1f}"
+        print(f"Swing {row['segment']}: Frame {row['start_frame']} - {row['end_frame']} ({status})")
+    print(f"{len(rows)} swings found, results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
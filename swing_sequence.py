@@ -0,0 +1,93 @@
+import json
+import numpy as np
+from joint_mappings import keypoint_indices
+
+# スイングのフェーズ名（全スクリプト共通）
+phase_names = ['address', 'top', 'impact', 'finish']
+phase_aliases = {'top_of_swing': 'top'}
+
+
+class SwingSequence:
+    """
+    スイングデータ（frames/joints/coordinates 形式のJSON）を一度だけ解析し、(T, J, 3) の配列として保持する
+    欠けている関節の座標は NaN とする
+    """
+
+    def __init__(self, frame_indices, joints, keypoints_mapping=keypoint_indices):
+        self.frame_indices = np.asarray(frame_indices, dtype=np.int64)  # (T, )
+        self.joints = np.asarray(joints, dtype=np.float64)  # (T, J, 3)
+        self.keypoints_mapping = keypoints_mapping
+        self.frame_lookup = {int(frame_index): row for row, frame_index in enumerate(self.frame_indices)}
+
+    @classmethod
+    def from_frames(cls, frames, keypoints_mapping=keypoint_indices):
+        num_joints = max([len(keypoints_mapping)] + [joint['joint_index'] + 1
+                                                     for frame in frames for joint in frame['joints']])
+        joints = np.full((len(frames), num_joints, 3), np.nan)
+        for row, frame in enumerate(frames):
+            for joint in frame['joints']:
+                coordinates = joint.get('coordinates', {})
+                joints[row, joint['joint_index']] = [coordinates.get(axis, np.nan) for axis in ('x', 'y', 'z')]
+
+        return cls([frame['frame_index'] for frame in frames], joints, keypoints_mapping)
+
+    @classmethod
+    def load(cls, json_file, keypoints_mapping=keypoint_indices):
+        with open(json_file, 'r') as file:
+            data = json.load(file)
+        return cls.from_frames(data['frames'], keypoints_mapping)
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    def slice(self, start, end):
+        """
+        start から end（含まない）行目までの SwingSequence を取得する（配列はコピーしない）
+        """
+        return SwingSequence(self.frame_indices[start:end], self.joints[start:end], self.keypoints_mapping)
+
+    def row(self, frame_number):
+        """
+        フレーム番号に対応する配列の行番号を取得する
+        """
+        row = self.frame_lookup.get(int(frame_number))
+        if row is None:
+            raise ValueError(f"Frame {frame_number} が見つかりません。")
+        return row
+
+    def joint(self, joint_name):
+        """
+        指定された関節名の全フレームの座標 (T, 3) を取得する
+        """
+        return self.joints[:, self.keypoints_mapping[joint_name]]
+
+    def position(self, frame_number, joint_name):
+        """
+        指定されたフレーム番号と関節名に対応する3D座標を取得する
+        """
+        return get_joint_position(self, frame_number, joint_name, self.keypoints_mapping)
+
+
+def load_swing_data(json_file):
+    """
+    JSONファイルからスイングデータをロードする
+    """
+    return SwingSequence.load(json_file)
+
+
+def get_joint_position(frames, frame_number, joint_name, keypoints_mapping=keypoint_indices):
+    """
+    指定されたフレーム番号と関節名に対応する3D座標を取得する
+    """
+    row = frames.row(frame_number)
+    joint_index = keypoints_mapping[joint_name]
+    if joint_index >= frames.joints.shape[1] or np.isnan(frames.joints[row, joint_index]).any():
+        raise ValueError(f"Joint '{joint_name}' (index {joint_index}) がフレーム {frame_number} に見つかりません。")
+    return frames.joints[row, joint_index].copy()
+
+
+def normalize_phases(phases):
+    """
+    旧名（'top_of_swing'）のフェーズ名を共通のフェーズ名に揃える
+    """
+    return {phase_aliases.get(phase, phase): frame_index for phase, frame_index in phases.items()}
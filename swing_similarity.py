@@ -0,0 +1,183 @@
+import argparse
+import glob
+import os.path as osp
+import numpy as np
+from joint_mappings import keypoint_indices
+from swing_sequence import load_swing_data, normalize_phases, phase_names
+from swing_phase_detection import detect_swing_phases
+
+# アドレス→トップ、トップ→インパクト、インパクト→フィニッシュの各区間のサンプル数
+phase_samples = (32, 16, 16)
+
+
+def normalize_swing(frames, phases=None, keypoints_mapping=keypoint_indices, samples=phase_samples):
+    """
+    スイングをフェーズごとに一定のフレーム数にリサンプリングし、骨盤を原点、アドレス時の胴の長さを1とする座標に揃える
+    :return: (sum(samples), J * 3) の特徴量
+    """
+    if phases is None:
+        phases = detect_swing_phases(frames, keypoints_mapping, verbose=False)
+        if phases is None:
+            raise ValueError("フェーズの検出に失敗しました。")
+    phases = normalize_phases(phases)
+    rows = [frames.row(phases[phase]) for phase in phase_names]
+
+    # 各フェーズ区間の小数の行番号（区間の終点は次の区間の始点として含める）
+    positions = np.concatenate([np.linspace(start, end, num, endpoint=(i == len(samples) - 1))
+                                for i, (start, end, num) in enumerate(zip(rows[:-1], rows[1:], samples))])
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, len(frames) - 1)
+    weight = (positions - lower)[:, np.newaxis, np.newaxis]
+
+    # 欠損した関節は前後のフレームで補う代わりに、骨盤の位置とする
+    root = keypoints_mapping['center_hip']
+    joints = frames.joints - frames.joints[:, root:root + 1]
+    joints = np.nan_to_num(joints)
+    resampled = joints[lower] * (1 - weight) + joints[upper] * weight
+
+    torso = np.linalg.norm(joints[rows[0], keypoints_mapping['neck']])
+    if not torso > 0:
+        raise ValueError("アドレス時の胴の長さが0です。")
+    return (resampled / torso).reshape(len(positions), -1).astype(np.float32)
+
+
+def envelope(series, band):
+    """
+    Sakoe-Chiba 帯の幅 band での上側・下側の包絡線（LB_Keogh 用）
+    series: (..., L, D)
+    """
+    length = series.shape[-2]
+    pad_width = [(0, 0)] * (series.ndim - 2) + [(band, band), (0, 0)]
+    upper = np.pad(series, pad_width, mode='constant', constant_values=-np.inf)
+    lower = np.pad(series, pad_width, mode='constant', constant_values=np.inf)
+    windows_upper = np.stack([upper[..., i:i + length, :] for i in range(2 * band + 1)])
+    windows_lower = np.stack([lower[..., i:i + length, :] for i in range(2 * band + 1)])
+    return windows_upper.max(axis=0), windows_lower.min(axis=0)
+
+
+def lb_keogh(query_upper, query_lower, candidates):
+    """
+    クエリの包絡線と全候補 (N, L, D) の間の LB_Keogh（DTW の二乗距離の下界）をまとめて計算する
+    """
+    above = np.maximum(candidates - query_upper, 0)
+    below = np.maximum(query_lower - candidates, 0)
+    return (above ** 2 + below ** 2).sum(axis=(1, 2))
+
+
+def dtw_batch(query, candidates, band):
+    """
+    1つのクエリ (L, D) と複数の候補 (B, L, D) の DTW の二乗距離を候補方向にベクトル化して計算する（Sakoe-Chiba 帯）
+    """
+    length = query.shape[0]
+    # 各フレーム間の距離 (B, L, L) は一度にまとめて計算する
+    cost = ((query[np.newaxis, :, np.newaxis] - candidates[:, np.newaxis]) ** 2).sum(axis=-1)
+
+    total = np.full((len(candidates), length + 1, length + 1), np.inf)
+    total[:, 0, 0] = 0
+    for i in range(1, length + 1):
+        for j in range(max(1, i - band), min(length, i + band) + 1):
+            total[:, i, j] = cost[:, i - 1, j - 1] + np.minimum(np.minimum(total[:, i - 1, j - 1], total[:, i - 1, j]),
+                                                                total[:, i, j - 1])
+    return total[:, length, length]
+
+
+class SwingIndex:
+    """
+    リファレンススイングの特徴量の索引。特徴量は float16 で保持する
+    """
+
+    def __init__(self, names=None, embeddings=None):
+        self.names = list(names) if names is not None else []
+        self.embeddings = embeddings if embeddings is not None else \
+            np.zeros((0, sum(phase_samples), 3 * len(keypoint_indices)), dtype=np.float16)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, frames, phases=None):
+        embedding = normalize_swing(frames, phases)
+        self.names.append(name)
+        self.embeddings = np.concatenate([self.embeddings, embedding[np.newaxis].astype(np.float16)])
+
+    def save(self, index_file):
+        np.savez(index_file, names=np.array(self.names), embeddings=self.embeddings)
+
+    @classmethod
+    def load(cls, index_file):
+        data = np.load(index_file)
+        return cls(data['names'].tolist(), data['embeddings'])
+
+    def query(self, frames, k=5, phases=None, band_ratio=0.1, batch_size=64):
+        """
+        最も似ているスイング上位 k 件を DTW 距離の昇順で取得する
+        LB_Keogh の小さい順に DTW を計算し、下界が k 番目の距離を超えた候補は計算しない
+        :return: [(name, distance)]
+        """
+        query = normalize_swing(frames, phases)
+        band = max(int(round(band_ratio * query.shape[0])), 1)
+
+        query_upper, query_lower = envelope(query, band)
+        candidates = self.embeddings.astype(np.float32)
+        bounds = lb_keogh(query_upper, query_lower, candidates)
+
+        order = np.argsort(bounds)
+        best_indices = np.zeros(0, dtype=np.int64)
+        best_distances = np.zeros(0)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            if len(best_distances) == k:
+                batch = batch[bounds[batch] < best_distances[-1]]
+                if len(batch) == 0:
+                    break
+
+            distances = dtw_batch(query, candidates[batch], band)
+            best_indices = np.concatenate([best_indices, batch])
+            best_distances = np.concatenate([best_distances, distances])
+            top = np.argsort(best_distances)[:k]
+            best_indices, best_distances = best_indices[top], best_distances[top]
+
+        return [(self.names[i], float(np.sqrt(distance))) for i, distance in zip(best_indices, best_distances)]
+
+
+def build_index(json_files):
+    names, embeddings = [], []
+    for json_file in json_files:
+        try:
+            embeddings.append(normalize_swing(load_swing_data(json_file)).astype(np.float16))
+            names.append(json_file)
+        except ValueError as e:
+            print(f"{json_file}: {e}")
+
+    if len(embeddings) == 0:
+        return SwingIndex()
+    return SwingIndex(names, np.stack(embeddings))
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser('Swing similarity search.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='build an index of reference swings')
+    build_parser.add_argument('reference_dir', type=str, help='directory of reference swing JSON files')
+    build_parser.add_argument('-o', '--output', type=str, default='swing_index.npz', help='output index file')
+    query_parser = subparsers.add_parser('query', help='find the most similar reference swings')
+    query_parser.add_argument('index_file', type=str, help='index file built by the build command')
+    query_parser.add_argument('json_file', type=str, help='swing JSON file')
+    query_parser.add_argument('-k', type=int, default=5, help='number of similar swings')
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    if args.command == 'build':
+        json_files = sorted(glob.glob(osp.join(args.reference_dir, '**', '*.json'), recursive=True))
+        index = build_index(json_files)
+        index.save(args.output)
+        print(f"{len(index)} swings saved to {args.output}")
+    else:
+        index = SwingIndex.load(args.index_file)
+        for rank, (name, distance) in enumerate(index.query(load_swing_data(args.json_file), args.k)):
+            print(f"{rank + 1}: {name} ({distance:.3f})")
+
+
+if __name__ == "__main__":
+    main()
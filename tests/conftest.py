@@ -0,0 +1,5 @@
+import sys
+import os.path as osp
+
+# The modules of the repository are imported from its root, as the scripts do
+sys.path.insert(0, osp.dirname(osp.dirname(osp.realpath(__file__))))
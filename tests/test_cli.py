@@ -0,0 +1,39 @@
+import json
+import os.path as osp
+import subprocess
+import sys
+
+root = osp.dirname(osp.dirname(osp.realpath(__file__)))
+
+# Runs `cli.py score sample_output.json` and reports the heavy modules it imported and its duration
+probe = """
+import json, runpy, sys, time
+start = time.perf_counter()
+sys.argv = ['cli.py', 'score', 'sample_output.json']
+runpy.run_path('cli.py', run_name='__main__')
+elapsed = time.perf_counter() - start
+heavy = [name for name in ('torch', 'cv2', 'matplotlib') if name in sys.modules]
+print(json.dumps({'seconds': elapsed, 'heavy': heavy}))
+"""
+
+import_budget = 3.0  # seconds, scoring a swing takes about 0.3 s
+
+
+def test_score_does_not_import_heavy_modules():
+    output = subprocess.run([sys.executable, '-c', probe], cwd=root, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+
+    assert 'x_factor_score' in output
+    assert report['heavy'] == []
+    assert report['seconds'] < import_budget
+
+
+def test_score_rejects_unknown_metric():
+    result = subprocess.run([sys.executable, 'cli.py', 'score', 'sample_output.json', '-m', 'bogus'], cwd=root,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    assert result.returncode != 0
+    assert 'bogus' in result.stdout + result.stderr
+    assert 'x_factor' in result.stdout + result.stderr
+    assert 'Traceback' not in result.stderr
@@ -0,0 +1,64 @@
+import json
+import os.path as osp
+
+import gen_skes_batch
+
+# Stands in for gen_skes in the spawned workers: no models, and the worker is killed on the crash_* videos
+stub = """
+import os
+import time
+import numpy as np
+
+
+class HRNet:
+    def load_img_models(self, det_dim, argv=None):
+        return None, None, None, None
+
+
+def import_hrnet():
+    return HRNet()
+
+
+def load_model_layer(rf):
+    return None
+
+
+def generate_skeletons(video, output, **kwargs):
+    if 'crash' in video:
+        os._exit(1)
+    # Still running when the other worker is killed, so lost with the broken pool
+    time.sleep(2)
+    np.savez_compressed(output, reconstruction=np.zeros((1, 1, 17, 3)))
+"""
+
+
+def test_killed_workers_fail_only_their_videos(tmp_path, monkeypatch):
+    stub_dir = tmp_path / 'stub'
+    stub_dir.mkdir()
+    (stub_dir / 'gen_skes.py').write_text(stub)
+    # The spawned workers inherit sys.path, so they import the stub
+    monkeypatch.syspath_prepend(str(stub_dir))
+    monkeypatch.delitem(__import__('sys').modules, 'gen_skes', raising=False)
+
+    videos = []
+    # With two killed workers, the videos run again one at a time are not all done when a worker is killed
+    for name in ['a', 'crash_1', 'b', 'crash_2']:
+        video = tmp_path / 'videos' / (name + '.mp4')
+        video.parent.mkdir(exist_ok=True)
+        video.write_bytes(b'')
+        videos.append(str(video))
+    output_dir = str(tmp_path / 'output')
+
+    records = gen_skes_batch.run_batch(videos, output_dir, num_workers=4, input_root=str(tmp_path / 'videos'))
+    status = {osp.basename(record['video']): record['status'] for record in records}
+    assert status == {'a.mp4': 'ok', 'crash_1.mp4': 'error', 'b.mp4': 'ok', 'crash_2.mp4': 'error'}
+    assert osp.exists(osp.join(output_dir, 'a.npz')) and osp.exists(osp.join(output_dir, 'b.npz'))
+
+    with open(osp.join(output_dir, 'progress.jsonl')) as f:
+        progress = [json.loads(line) for line in f]
+    assert sorted(osp.basename(record['video']) for record in progress) == ['a.mp4', 'b.mp4', 'crash_1.mp4',
+                                                                            'crash_2.mp4']
+
+    # A resumed run only retries the failed videos
+    records = gen_skes_batch.run_batch(videos, output_dir, num_workers=4, input_root=str(tmp_path / 'videos'))
+    assert sorted(osp.basename(record['video']) for record in records) == ['crash_1.mp4', 'crash_2.mp4']
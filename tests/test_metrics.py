@@ -0,0 +1,41 @@
+import json
+from urllib.request import urlopen
+
+from tools import metrics
+
+
+def test_http_server_scrape():
+    registry = metrics.Registry()
+    frames = registry.counter('test_frames_total', 'Frames', ['stage'])
+    misses = registry.counter('test_misses_total', 'Misses')
+    depth = registry.gauge('test_queue_depth', 'Queue depth', ['queue'])
+    latency = registry.summary('test_stage_seconds', 'Latency', ['stage'])
+
+    frames.inc(stage='decode')
+    frames.inc(2, stage='decode')
+    depth.set(4, queue='lifter')
+    latency.observe(0.01, stage='detect')
+
+    server = metrics.start_http_server(0, registry=registry)
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        with urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            text = response.read().decode()
+        with urlopen(url + '/metrics.json') as response:
+            snapshot = json.loads(response.read().decode())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    lines = text.splitlines()
+    assert '# TYPE test_frames_total counter' in lines
+    assert 'test_frames_total{stage="decode"} 3' in lines
+    assert 'test_misses_total 0' in lines
+    assert 'test_queue_depth{queue="lifter"} 4' in lines
+    assert 'test_stage_seconds_count{stage="detect"} 1' in lines
+
+    assert snapshot['test_frames_total'] == {'decode': 3}
+    assert snapshot['test_misses_total'] == {'': 0}
+    assert snapshot['test_queue_depth'] == {'lifter': 4}
+    assert snapshot['test_stage_seconds']['detect']['count'] == 1
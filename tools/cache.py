@@ -0,0 +1,183 @@
+"""
+Content-addressed cache of the results of the pipeline (2D keypoints, 3D poses).
+An entry is keyed by the SHA-256 of the video content and of the configuration that produced it
+(model checkpoints, detector options...), so a renamed video hits the cache and a changed model misses it.
+Every entry is an npz file. The least recently used entries are evicted when the cache grows over its size bound.
+"""
+import hashlib
+import json
+import os
+import os.path as osp
+import time
+import zipfile
+import numpy as np
+
+meta_name = '__meta__'
+
+
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """
+    Arguments:
+    root -- the cache directory
+    max_bytes -- the size bound of the entries
+    """
+
+    def __init__(self, root, max_bytes=10 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.digests_file = osp.join(root, 'digests.json')
+        os.makedirs(root, exist_ok=True)
+
+    def file_digest(self, path):
+        """
+        SHA-256 of a file. The digests are remembered by (path, size, modification time),
+        so the videos and the checkpoints are only read again when they change. None if the file does not exist
+        """
+        if not osp.isfile(path):
+            return None
+        path = osp.abspath(path)
+        stat = os.stat(path)
+        digests = self._load_digests()
+        entry = digests.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+
+        digest = hash_file(path)
+        digests = self._load_digests()
+        digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        with open(self.digests_file + '.part%d' % os.getpid(), 'w') as f:
+            json.dump(digests, f)
+        os.replace(self.digests_file + '.part%d' % os.getpid(), self.digests_file)
+        return digest
+
+    def _load_digests(self):
+        try:
+            with open(self.digests_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def key(kind, **config):
+        """
+        The key of a result: the SHA-256 of its kind and of its configuration (JSON-serializable values)
+        """
+        config = dict(config, kind=kind)
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key):
+        return osp.join(self.root, key[:2], key + '.npz')
+
+    def get(self, key):
+        """
+        :return: dict of the arrays of the entry, None on a miss
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files if name != meta_name}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # A corrupted entry is a miss
+            self._remove(path)
+            return None
+
+        # The modification time orders the entries for the LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, arrays, **meta):
+        """
+        Store the arrays of a result, with metadata shown by entries() (e.g. video=<path>, video_digest=<digest>)
+        """
+        path = self.path(key)
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        meta = dict(meta, created=time.time())
+        part_file = path + '.part%d' % os.getpid()
+        with open(part_file, 'wb') as f:
+            np.savez_compressed(f, **arrays, **{meta_name: np.array(json.dumps(meta, default=str))})
+        os.replace(part_file, path)
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (key, size in bytes, last access time, metadata), the least recently used first
+        """
+        entries = []
+        for directory in sorted(os.listdir(self.root)):
+            directory = osp.join(self.root, directory)
+            if not osp.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.npz'):
+                    continue
+                path = osp.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    with np.load(path) as data:
+                        meta = json.loads(str(data[meta_name])) if meta_name in data.files else {}
+                except (OSError, ValueError, zipfile.BadZipFile):
+                    continue
+                entries.append((name[:-len('.npz')], stat.st_size, stat.st_mtime, meta))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is within max_bytes
+        :return: the number of removed entries
+        """
+        entries = []
+        for directory in os.listdir(self.root):
+            directory = osp.join(self.root, directory)
+            if osp.isdir(directory):
+                for name in os.listdir(directory):
+                    if name.endswith('.npz'):
+                        try:
+                            stat = os.stat(osp.join(directory, name))
+                        except FileNotFoundError:
+                            # Evicted by another process sharing the cache
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, osp.join(directory, name)))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        num_removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            num_removed += 1
+        return num_removed
+
+    def invalidate(self, videos=None):
+        """
+        Remove the entries of videos (paths), or every entry if videos is None
+        :return: the number of removed entries
+        """
+        digests = None if videos is None else {self.file_digest(video) for video in videos} - {None}
+        num_removed = 0
+        for key, _, _, meta in self.entries():
+            if digests is None or meta.get('video_digest') in digests:
+                self._remove(self.path(key))
+                num_removed += 1
+        return num_removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,5 +1,23 @@
 # For better visualization, give different colors to different bones
 
+# RGB values of the colors, for renderers that do not use matplotlib
+color_rgb = {
+    'peru': (205, 133, 63),
+    'indianred': (205, 92, 92),
+    'coral': (255, 127, 80),
+    'brown': (165, 42, 42),
+    'tan': (210, 180, 140),
+    'olive': (128, 128, 0),
+    'purple': (128, 0, 128),
+    'deepskyblue': (0, 191, 255),
+    'dodgerblue': (30, 144, 255),
+    'red': (255, 0, 0),
+    'yellow': (255, 255, 0),
+    'pink': (255, 192, 203),
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+}
+
 h36m_elbow_knee_v1 = [5, 15]
 h36m_elbow_knee_v2 = [2, 12]
 h36m_wrist_ankle_v1 = [6, 16]
@@ -2,12 +2,14 @@ import torch
 import numpy as np
 import sys
 import os.path as osp
+from collections import OrderedDict, deque
 
 
 pre_dir = osp.join(osp.dirname(osp.realpath(__file__)), '..')
 sys.path.insert(0, pre_dir)
 from common.camera import normalize_screen_coordinates, camera_to_world
 from common.generators import *
+from tools import tracing, metrics
 sys.path.pop(0)
 
 
@@ -41,6 +43,44 @@ def evaluate(test_generator, model_pos):
         return prediction
 
 
+def evaluate_batched(seqs, model_pos, pad, causal_shift=0, augment=True):
+    """
+    Lift the 2D sequences of all people with a single forward pass.
+    The sequences are edge-padded to a common length. The model is convolutional along the time axis,
+    so the outputs of the valid frames are the same as lifting every sequence on its own.
+    """
+    lengths = [seq.shape[0] for seq in seqs]
+    max_length = max(lengths)
+
+    batch_2d = np.stack([np.pad(seq, ((pad + causal_shift, pad - causal_shift + max_length - seq.shape[0]),
+                                      (0, 0), (0, 0)), 'edge') for seq in seqs])
+    if augment:
+        # Append flipped versions
+        batch_2d_flip = batch_2d.copy()
+        batch_2d_flip[:, :, :, 0] *= -1
+        batch_2d_flip[:, :, kps_left + kps_right] = batch_2d_flip[:, :, kps_right + kps_left]
+        batch_2d = np.concatenate((batch_2d, batch_2d_flip), axis=0)
+
+    with torch.no_grad(), tracing.span('gast_forward', sequences=len(seqs), frames=max_length):
+        inputs_2d = torch.from_numpy(batch_2d.astype('float32'))
+        if torch.cuda.is_available():
+            inputs_2d = inputs_2d.cuda()
+
+        predicted_3d_pos = model_pos(inputs_2d)
+
+        if augment:
+            # Undo flipping and take average with non-flipped version
+            num_seqs = len(seqs)
+            predicted_3d_pos[num_seqs:, :, :, 0] *= -1
+            predicted_3d_pos[num_seqs:, :, joints_left + joints_right] = \
+                predicted_3d_pos[num_seqs:, :, joints_right + joints_left]
+            predicted_3d_pos = (predicted_3d_pos[:num_seqs] + predicted_3d_pos[num_seqs:]) / 2
+
+        predicted_3d_pos = predicted_3d_pos.cpu().numpy()
+
+    return [predicted_3d_pos[i, :length] for i, length in enumerate(lengths)]
+
+
 def gen_pose(kpts, valid_frames, width, height, model_pos, pad, causal_shift=0):
     assert len(kpts.shape) == 4, 'The shape of kpts: {}'.format(kpts.shape)
     assert kpts.shape[0] == len(valid_frames)
@@ -51,15 +91,15 @@ def gen_pose(kpts, valid_frames, width, height, model_pos, pad, causal_shift=0):
         norm_seq_kps = normalize_screen_coordinates(seq_kps, w=width, h=height)
         norm_seqs.append(norm_seq_kps)
 
-    gen = UnchunkedGenerator(None, None, norm_seqs, pad=pad, causal_shift=causal_shift, augment=True,
-                             kps_left=kps_left, kps_right=kps_right, joints_left=joints_left, joints_right=joints_right)
-    prediction = evaluate(gen, model_pos)
+    # All tracked people are lifted in one batch
+    prediction = evaluate_batched(norm_seqs, model_pos, pad, causal_shift)
 
     prediction_to_world = []
     for i in range(len(prediction)):
         sub_prediction = prediction[i]
 
-        sub_prediction = camera_to_world(sub_prediction, R=rot, t=0)
+        with tracing.span('world_transform'):
+            sub_prediction = camera_to_world(sub_prediction, R=rot, t=0)
 
         # sub_prediction[:, :, 2] -= np.expand_dims(np.amin(sub_prediction[:, :, 2], axis=1), axis=1).repeat([17], axis=1)
         # sub_prediction[:, :, 2] -= np.amin(sub_prediction[:, :, 2])
@@ -70,6 +110,130 @@ def gen_pose(kpts, valid_frames, width, height, model_pos, pad, causal_shift=0):
     return prediction_to_world
 
 
+class StreamingPoseLifter:
+    """
+    Lift 2D keypoints that arrive frame by frame to 3D poses.
+    The 3D poses of a frame are returned as soon as the receptive field after it is filled,
+    so the memory does not depend on the length of the video.
+    As in gen_pose, every person is lifted from its own sequence of valid frames, which is edge-padded at both ends.
+    A person missing for more than pad frames ends its sequence, and starts a new one when it is visible again.
+
+    Arguments:
+    model_pos -- GAST-Net model (non-causal)
+    num_person -- the number of person slots
+    width, height -- the size of the video
+    pad -- padding on each side, (receptive field - 1) // 2
+    chunk_size -- the minimum number of frames lifted in one forward pass. 1 lifts every frame as soon as possible
+    """
+
+    def __init__(self, model_pos, num_person, width, height, pad, chunk_size=1):
+        self.model_pos = model_pos
+        self.num_person = num_person
+        self.width = width
+        self.height = height
+        self.pad = pad
+        self.chunk_size = chunk_size
+
+        self.num_frames = 0
+        # The input window of every person starting at the window of its next output frame
+        self.inputs = [None] * num_person
+        self.frame_ids = [deque() for _ in range(num_person)]
+        self.gaps = [0] * num_person
+        self.ended = [False] * num_person
+        # frame index: [3D poses, 2D keypoints, valid, number of missing 3D poses]
+        self.pending = OrderedDict()
+
+    def push(self, kpts, valid):
+        """
+        :param kpts: (M, 17, 2) repaired h36m keypoints of one frame
+        :param valid: (M, ) whether every person is visible
+        :return: list of (frame index, 3D poses (M, 17, 3), kpts, valid) of the completed frames, in frame order
+        """
+        frame_index = self.num_frames
+        self.num_frames += 1
+        self.pending[frame_index] = [np.zeros((self.num_person, 17, 3), dtype=np.float32), kpts, valid,
+                                     int(np.sum(valid))]
+
+        norm_kpts = normalize_screen_coordinates(kpts, w=self.width, h=self.height)
+        for i in range(self.num_person):
+            if valid[i]:
+                if self.inputs[i] is None:
+                    # Edge padding at the start of the sequence
+                    self.inputs[i] = [norm_kpts[i]] * self.pad
+                self.inputs[i].append(norm_kpts[i])
+                self.frame_ids[i].append(frame_index)
+                self.gaps[i] = 0
+            elif self.inputs[i] is not None:
+                self.gaps[i] += 1
+                if self.gaps[i] > self.pad:
+                    self._end_sequence(i)
+
+        self._lift(self.chunk_size)
+        completed = self._pop_completed()
+        metrics.queue_depth.set(len(self.pending), queue='lifter')
+        return completed
+
+    def flush(self):
+        """
+        End the sequences of all people and return the remaining frames
+        """
+        for i in range(self.num_person):
+            if self.inputs[i] is not None:
+                self._end_sequence(i)
+        self._lift(self.chunk_size)
+        completed = self._pop_completed()
+        metrics.queue_depth.set(len(self.pending), queue='lifter')
+        return completed
+
+    def _end_sequence(self, i):
+        # Edge padding at the end of the sequence
+        self.inputs[i] += [self.inputs[i][-1]] * self.pad
+        self.ended[i] = True
+
+    def _lift(self, min_ready):
+        people = []
+        windows = []
+        for i in range(self.num_person):
+            if self.inputs[i] is None:
+                continue
+
+            num_ready = len(self.inputs[i]) - 2 * self.pad
+            if num_ready > 0 and (num_ready >= min_ready or self.ended[i]):
+                people.append(i)
+                windows.append(np.asarray(self.inputs[i], dtype=np.float32))
+            elif self.ended[i]:
+                self.inputs[i] = None
+                self.ended[i] = False
+
+        if len(people) == 0:
+            return
+
+        # The windows are already padded
+        predictions = evaluate_batched(windows, self.model_pos, pad=0)
+        for i, window, prediction in zip(people, windows, predictions):
+            num_ready = len(window) - 2 * self.pad
+            with tracing.span('world_transform'):
+                prediction = camera_to_world(prediction[:num_ready], R=rot, t=0)
+
+            for pose in prediction:
+                entry = self.pending[self.frame_ids[i].popleft()]
+                entry[0][i] = pose
+                entry[3] -= 1
+
+            if self.ended[i]:
+                self.inputs[i] = None
+                self.ended[i] = False
+            else:
+                self.inputs[i] = self.inputs[i][num_ready:]
+
+    def _pop_completed(self):
+        completed = []
+        while len(self.pending) > 0 and next(iter(self.pending.values()))[3] == 0:
+            frame_index, (poses, kpts, valid, _) = self.pending.popitem(last=False)
+            completed.append((frame_index, poses, kpts, valid))
+        return completed
+
+
 def gen_pose_frame(kpts, width, height, model_pos, pad, causal_shift=0):
     # kpts: (M, T, N, 2)
     norm_seqs = []
@@ -77,14 +241,13 @@ def gen_pose_frame(kpts, width, height, model_pos, pad, causal_shift=0):
         norm_kpt = normalize_screen_coordinates(kpt, w=width, h=height)
         norm_seqs.append(norm_kpt)
 
-    gen = UnchunkedGenerator(None, None, norm_seqs, pad=pad, causal_shift=causal_shift, augment=True,
-                             kps_left=kps_left, kps_right=kps_right, joints_left=joints_left, joints_right=joints_right)
-    prediction = evaluate(gen, model_pos)
+    prediction = evaluate_batched(norm_seqs, model_pos, pad, causal_shift)
 
     prediction_to_world = []
     for i in range(len(prediction)):
         sub_prediction = prediction[i][0]
-        sub_prediction = camera_to_world(sub_prediction, R=rot, t=0)
+        with tracing.span('world_transform'):
+            sub_prediction = camera_to_world(sub_prediction, R=rot, t=0)
         sub_prediction[:, 2] -= np.amin(sub_prediction[:, 2])
         prediction_to_world.append(sub_prediction)
 
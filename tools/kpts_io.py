@@ -0,0 +1,321 @@
+"""
+Compact binary container of 2D keypoints.
+
+A .kpts file stores every column as one contiguous, aligned block that can be memory-mapped:
+    keypoints: (T, M, J, 2) float32
+    scores:    (T, M, J)    float32
+    bboxs:     (T, M, 4)    float32
+    track_ids: (T, M)       int32, -1 for an empty person slot
+The blocks are stored frame-major so that frames can be appended while a video is processed.
+The readers return (M, T, ...) views of them, like the JSON loaders.
+
+File layout: MAGIC | column blocks | JSON footer | footer length (uint64) | MAGIC
+"""
+import json
+import os
+import os.path as osp
+import re
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+
+KPTS_EXT = '.kpts'
+MAGIC = b'KPTS0001'
+ALIGN = 64
+
+# name: (dtype, per-person shape without the joint axis, empty value)
+columns = {
+    'keypoints': ('<f4', (None, 2), 0),
+    'scores': ('<f4', (None,), 0),
+    'bboxs': ('<f4', (4,), 0),
+    'track_ids': ('<i4', (), -1),
+}
+
+_ws = re.compile(r'[ \t\n\r]*')
+
+
+class KptsWriter:
+    """
+    Write a .kpts file frame by frame.
+
+    Arguments:
+    kpts_file -- output path
+    num_person -- the number of person slots of every frame
+    num_joints -- the number of joints, inferred from the first written frame if None
+    label, label_index -- optional metadata, as in the NTU JSON files
+    """
+
+    def __init__(self, kpts_file, num_person, num_joints=None, label=None, label_index=None):
+        self.kpts_file = kpts_file
+        self.num_person = num_person
+        self.num_joints = num_joints
+        self.label = label
+        self.label_index = label_index
+
+        self.num_frames = 0
+        self._pending = 0  # empty frames written before the number of joints is known
+        self._parts = {name: open('{}.{}.part'.format(kpts_file, name), 'wb') for name in columns}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _frame_shape(self, name):
+        shape = columns[name][1]
+        return (self.num_person, ) + tuple(self.num_joints if dim is None else dim for dim in shape)
+
+    def _write_empty(self, count):
+        if count <= 0:
+            return
+        for name, (dtype, _, empty) in columns.items():
+            self._parts[name].write(np.full((count, *self._frame_shape(name)), empty, dtype=dtype).tobytes())
+
+    def skip(self, frame_index):
+        """
+        Store the frames up to frame_index (1-based, included) that have not been written yet as empty frames
+        """
+        count = frame_index - self.num_frames
+        if self.num_joints is None:
+            self._pending += max(count, 0)
+        else:
+            self._write_empty(count)
+        self.num_frames = max(self.num_frames, frame_index)
+
+    def write(self, frame_index, kpts, scores, bboxs=None, track_ids=None, slots=None):
+        """
+        :param frame_index: 1-based frame index. Skipped frames are stored as empty frames
+        :param kpts: (m, J, 2)
+        :param scores: (m, J) or (m, J, 1)
+        :param bboxs: (m, 4) or None
+        :param track_ids: (m, ) or None
+        :param slots: The person slot of every row, the first m slots if None
+        """
+        if frame_index <= self.num_frames:
+            raise ValueError('Frame {} is written after frame {}'.format(frame_index, self.num_frames))
+
+        kpts = np.asarray(kpts, dtype=np.float32)
+        if self.num_joints is None:
+            self.num_joints = kpts.shape[-2]
+            self._write_empty(self._pending)
+            self._pending = 0
+        self.skip(frame_index - 1)
+
+        if slots is None:
+            slots = np.arange(len(kpts))
+        values = {'keypoints': kpts,
+                  'scores': np.asarray(scores, dtype=np.float32).reshape(len(kpts), -1),
+                  'bboxs': bboxs,
+                  'track_ids': track_ids}
+        for name, (dtype, _, empty) in columns.items():
+            frame = np.full(self._frame_shape(name), empty, dtype=dtype)
+            if values[name] is not None and len(slots) > 0:
+                frame[slots] = values[name]
+            self._parts[name].write(frame.tobytes())
+        self.num_frames = frame_index
+
+    def close(self):
+        if self.num_joints is None:
+            self.num_joints = 17
+            self._write_empty(self._pending)
+            self._pending = 0
+
+        footer = {'label': self.label, 'label_index': self.label_index, 'num_person': self.num_person,
+                  'num_frames': self.num_frames, 'num_joints': self.num_joints, 'columns': {}}
+
+        for part in self._parts.values():
+            part.close()
+
+        with open(self.kpts_file, 'wb') as fw:
+            fw.write(MAGIC)
+            for name, (dtype, _, _) in columns.items():
+                fw.write(b'\0' * (-fw.tell() % ALIGN))
+                footer['columns'][name] = {'dtype': dtype, 'offset': fw.tell(),
+                                           'shape': [self.num_frames, *self._frame_shape(name)]}
+                with open(self._parts[name].name, 'rb') as fr:
+                    shutil.copyfileobj(fr, fw)
+
+            footer = json.dumps(footer).encode()
+            fw.write(footer)
+            fw.write(struct.pack('<Q', len(footer)))
+            fw.write(MAGIC)
+
+        self.abort()
+
+    def abort(self):
+        """
+        Remove the temporary column files without writing the .kpts file
+        """
+        for part in self._parts.values():
+            part.close()
+            if osp.exists(part.name):
+                os.remove(part.name)
+
+
+def is_kpts_file(file_path):
+    with open(file_path, 'rb') as fr:
+        return fr.read(len(MAGIC)) == MAGIC
+
+
+def read_kpts(kpts_file, mmap_mode='r'):
+    """
+    Read a .kpts file. The columns are memory-mapped unless mmap_mode is None
+    :return: dict of keypoints (M, T, J, 2), scores (M, T, J), bboxs (M, T, 4), track_ids (M, T),
+             label and label_index
+    """
+    with open(kpts_file, 'rb') as fr:
+        fr.seek(-8 - len(MAGIC), os.SEEK_END)
+        footer_length = struct.unpack('<Q', fr.read(8))[0]
+        if fr.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a keypoints file'.format(kpts_file))
+        fr.seek(-8 - len(MAGIC) - footer_length, os.SEEK_END)
+        footer = json.loads(fr.read(footer_length).decode())
+
+    kpts_info = {'label': footer['label'], 'label_index': footer['label_index']}
+    for name, column in footer['columns'].items():
+        shape = tuple(column['shape'])
+        if mmap_mode is not None and np.prod(shape) > 0:
+            data = np.memmap(kpts_file, dtype=column['dtype'], mode=mmap_mode, offset=column['offset'], shape=shape)
+        else:
+            data = np.fromfile(kpts_file, dtype=column['dtype'], count=int(np.prod(shape)),
+                               offset=column['offset']).reshape(shape)
+        # (T, M, ...) --> (M, T, ...)
+        kpts_info[name] = np.swapaxes(data, 0, 1)
+
+    return kpts_info
+
+
+class _JsonStream:
+    """
+    Incremental JSON tokenizer that only keeps the unparsed part of the document in memory
+    """
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _ws.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of the JSON document')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expecting one of {!r} but got {!r} in the JSON document'.format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_kpts(fp, meta, chunk_size=1 << 20):
+    """
+    Yield the items of the 'data' list of a keypoints JSON file one by one.
+    The other top-level values (label, label_index) are stored in meta.
+    """
+    stream = _JsonStream(fp, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'data':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        else:
+            meta[key] = stream.value()
+
+        if stream.expect(',}') == '}':
+            break
+
+
+def import_json_kpts(json_file, kpts_file, num_person=2, chunk_size=1 << 20):
+    """
+    Convert a keypoints JSON file to a .kpts file without loading the whole JSON document
+    """
+    meta = {}
+    with open(json_file, 'r') as fr, KptsWriter(kpts_file, num_person) as writer:
+        for frame_info in iter_json_kpts(fr, meta, chunk_size):
+            frame_index = frame_info['frame_index']
+
+            slots, poses, scores, bboxs, track_ids = [], [], [], [], []
+            for index, skeleton_info in enumerate(frame_info['skeleton']):
+                if len(skeleton_info['bbox']) == 0 or index+1 > num_person:
+                    continue
+
+                slots.append(index)
+                poses.append(skeleton_info['pose'])
+                scores.append(np.asarray(skeleton_info['score'], dtype=np.float32).reshape(-1))
+                bboxs.append(skeleton_info['bbox'][:4])
+                track_ids.append(skeleton_info.get('track_id', -1))
+
+            if len(slots) == 0:
+                writer.skip(frame_index)
+            else:
+                writer.write(frame_index, poses, scores, bboxs, track_ids, slots)
+
+        writer.label = meta.get('label')
+        writer.label_index = meta.get('label_index')
+
+
+def load_kpts(file_path, num_person=None, mmap_mode='c'):
+    """
+    Load 2D keypoints from a .kpts file or a keypoints JSON file
+    :param num_person: The maximum number of people
+    :param mmap_mode: Memory-map mode of .kpts files. The default 'c' (copy-on-write) keeps the arrays writable
+    :return: keypoints (M, T, J, 2), scores (M, T, J), label, label_index
+    """
+    if is_kpts_file(file_path):
+        kpts_info = read_kpts(file_path, mmap_mode)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_file = osp.join(tmp_dir, 'keypoints' + KPTS_EXT)
+            import_json_kpts(file_path, tmp_file, 2 if num_person is None else num_person)
+            kpts_info = read_kpts(tmp_file, mmap_mode=None)
+
+    keypoints = kpts_info['keypoints'][:num_person]
+    scores = kpts_info['scores'][:num_person]
+    return keypoints, scores, kpts_info['label'], kpts_info['label_index']
@@ -0,0 +1,119 @@
+"""
+Helpers of the live mode of gen_skes: a frame source that never falls behind and per-stage latency statistics.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+import cv2
+import numpy as np
+from tools import metrics
+
+
+class LiveCapture:
+    """
+    Read frames from a camera or a video file in a background thread.
+    Only the newest frame is kept: when the consumer is slower than the source, older frames are dropped
+    instead of queued, so the latency does not grow with time.
+
+    Arguments:
+    source -- a camera index ('0', 1, ...) or a video path. A video file is played at its native frame rate
+    """
+
+    def __init__(self, source):
+        self.is_camera = str(source).isdigit()
+        self.cap = cv2.VideoCapture(int(source) if self.is_camera else source)
+        assert self.cap.isOpened(), 'Cannot capture source {}'.format(source)
+
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.
+
+        self.num_read = 0
+        self.num_dropped = 0
+        self._latest = None
+        self._stopped = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        start = time.time()
+        try:
+            while not self._stopped:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+
+                # Pace a video file like a camera
+                if not self.is_camera:
+                    delay = start + self.num_read / self.fps - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                with self._cond:
+                    if self._latest is not None:
+                        self.num_dropped += 1
+                        metrics.dropped_frames.inc(reason='live_overrun')
+                    metrics.frames_total.inc(stage='capture')
+                    self._latest = (self.num_read, time.time(), frame)
+                    self.num_read += 1
+                    self._cond.notify()
+        except Exception as e:
+            # Raised again by read(), the consumer would otherwise wait forever
+            self._error = e
+        finally:
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
+
+    def read(self):
+        """
+        Wait for a frame that has not been read yet
+        :return: (frame index, capture time, frame), None when the source is exhausted
+        :raise: The exception that stopped the reader thread
+        """
+        with self._cond:
+            while self._latest is None and not self._stopped:
+                self._cond.wait()
+            if self._latest is None and self._error is not None:
+                raise self._error
+            latest, self._latest = self._latest, None
+            return latest
+
+    def release(self):
+        self._stopped = True
+        self._thread.join()
+        self.cap.release()
+
+
+class LatencyStats:
+    """
+    Latencies of the processing stages over the most recent frames
+    :param window: The number of frames kept for every stage
+    """
+
+    def __init__(self, window=300):
+        self.window = window
+        self.samples = OrderedDict()
+
+    def add(self, stage, seconds):
+        if stage not in self.samples:
+            self.samples[stage] = deque(maxlen=self.window)
+        self.samples[stage].append(seconds)
+
+    def summary(self):
+        """
+        :return: {stage: {'mean', 'p50', 'p95', 'max'}} in milliseconds
+        """
+        summary = OrderedDict()
+        for stage, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000
+            p50, p95 = np.percentile(ms, [50, 95])
+            summary[stage] = {'mean': ms.mean(), 'p50': p50, 'p95': p95, 'max': ms.max()}
+        return summary
+
+    def __str__(self):
+        return ' | '.join('{} {:.1f}/{:.1f}ms'.format(stage, stats['p50'], stats['p95'])
+                          for stage, stats in self.summary().items())
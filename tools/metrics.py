@@ -0,0 +1,300 @@
+"""
+Operational metrics of the pipeline: counters, gauges and latency summaries in a registry,
+exported in the Prometheus text format by a local HTTP server and dumped periodically to a JSON file.
+
+    from tools import metrics
+    metrics.frames_total.inc(stage='decode')
+    metrics.queue_depth.set(3, queue='lifter')
+
+    metrics.enable()                      # stage latencies from the tools/tracing spans
+    metrics.start_http_server(9100)       # curl http://127.0.0.1:9100/metrics
+    metrics.JsonDumper('metrics.json', 10).start()
+
+The counters and gauges are always updated. The stage latencies are only collected once enable() is called.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from tools import tracing
+
+
+class Metric:
+    """
+    A metric with one value per combination of label values
+    :param name: The Prometheus name of the metric
+    :param documentation: The help text
+    :param labelnames: The names of the labels, given as keyword arguments when the metric is updated
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+        if not self.labelnames and self.kind != 'summary':
+            # A metric without labels is exported as 0 before its first update
+            self.values[()] = 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} expects the labels {}, got {}'.format(self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in pairs) + '}'
+
+    def samples(self):
+        """
+        :return: list of (name suffix, label key, extra labels, value)
+        """
+        with self._lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def exposition(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, self._format_labels(key, extra), _format_value(value)))
+        return '\n'.join(lines)
+
+    def snapshot(self):
+        """
+        :return: the value of every label combination, {label values joined by '/': value}
+        """
+        with self._lock:
+            return OrderedDict(('/'.join(key), value) for key, value in self.values.items())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Summary(Metric):
+    """
+    Latencies in seconds, exported with the 0.5, 0.9 and 0.99 quantiles estimated by tracing.Histogram
+    """
+    kind = 'summary'
+    quantiles = (0.5, 0.9, 0.99)
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = tracing.Histogram()
+            self.values[key].add(seconds)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, histogram in self.values.items():
+                for q in self.quantiles:
+                    samples.append(('', key, (('quantile', str(q)), ), histogram.percentile(q * 100)))
+                samples.append(('_sum', key, (), histogram.total))
+                samples.append(('_count', key, (), histogram.count))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return OrderedDict(('/'.join(key), histogram.summary()) for key, histogram in self.values.items())
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+    """
+    The metrics of a process. The metrics are created once and shared by name
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labelnames):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, documentation, labelnames)
+            metric = self.metrics[name]
+        if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError('{} is already registered as a {} with the labels {}'.format(
+                name, metric.kind, metric.labelnames))
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def summary(self, name, documentation, labelnames=()):
+        return self._get(Summary, name, documentation, labelnames)
+
+    def exposition(self):
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return OrderedDict((metric.name, metric.snapshot()) for metric in metrics)
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+summary = registry.summary
+
+# The metrics of the pipeline
+stage_seconds = summary('pipeline_stage_seconds', 'Latency of every stage of the pipeline', ['stage'])
+frames_total = counter('pipeline_frames_total', 'Frames that went through every stage of the pipeline', ['stage'])
+dropped_frames = counter('pipeline_dropped_frames_total', 'Frames dropped by the pipeline', ['reason'])
+detection_misses = counter('pipeline_detection_misses_total', 'Frames in which the detector found nobody')
+tracker_resets = counter('pipeline_tracker_resets_total', 'Person slots taken over by a new track ID')
+queue_depth = gauge('pipeline_queue_depth', 'Items waiting in the queues of the pipeline', ['queue'])
+
+
+def _observe_span(name, start, end, args):
+    stage_seconds.observe(end - start, stage=name)
+
+
+def enable():
+    """
+    Collect the latencies of the tools/tracing spans in pipeline_stage_seconds
+    """
+    tracing.add_sink(_observe_span)
+
+
+def disable():
+    tracing.remove_sink(_observe_span)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port, host='127.0.0.1', registry=registry):
+    """
+    Serve /metrics in the Prometheus text format and /metrics.json in a background thread
+    :param port: The port, 0 picks a free one (server.server_address[1])
+    :return: The server, stopped with server.shutdown()
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/metrics':
+                body = registry.exposition().encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/metrics.json':
+                body = json.dumps(registry.snapshot()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Serving metrics on http://{}:{}/metrics'.format(*server.server_address[:2]))
+    return server
+
+
+class JsonDumper:
+    """
+    Write the snapshot of the registry to a JSON file every interval seconds and when stopped.
+    Every dump also holds the per second rate of every counter since the previous dump (e.g. the fps of every stage),
+    and since the start of the dumper
+
+    Arguments:
+    path -- the JSON file, replaced atomically
+    interval -- seconds between two dumps
+    """
+
+    def __init__(self, path, interval=10., registry=registry):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._start = None
+        self._previous = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._start = self._previous = (time.time(), self._counters(self.registry.snapshot()))
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.dump()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        now = time.time()
+        snapshot = self.registry.snapshot()
+        counters = self._counters(snapshot)
+        rates = self._rates(now, counters, self._previous)
+        average_rates = self._rates(now, counters, self._start)
+        self._previous = (now, counters)
+
+        with open(self.path + '.part', 'w') as f:
+            json.dump({'time': now, 'metrics': snapshot, 'rates': rates, 'average_rates': average_rates}, f,
+                      indent=1)
+        os.replace(self.path + '.part', self.path)
+
+    def _counters(self, snapshot):
+        return OrderedDict((name, snapshot[name]) for name, metric in self.registry.metrics.items()
+                           if isinstance(metric, Counter))
+
+    @staticmethod
+    def _rates(now, counters, since):
+        if since is None:
+            return OrderedDict()
+        since_time, since_counters = since
+        elapsed = max(now - since_time, 1e-9)
+        return OrderedDict((name, OrderedDict((key, (value - since_counters.get(name, {}).get(key, 0)) / elapsed)
+                                              for key, value in values.items()))
+                           for name, values in counters.items())
@@ -1,6 +1,7 @@
-import json
 import numpy as np
+from functools import reduce
 from tools.mpii_coco_h36m import coco_h36m
+from tools.kpts_io import load_kpts
 import os
 
 
@@ -11,35 +12,23 @@ num_joints = 17
 img_3d = 100.
 ratio_2d_3d = 500.
 
+# Repair of low-score knees and ankles, e.g. when the lower body is occluded.
+# Every rule maps each replaced joint to its replacement joint,
+# and is applied when exactly its replaced joints are low-score
+score_threshold = 0.3
+revise_rules = [
+    {2: 1, 3: 1, 5: 4, 6: 4},
+    {2: 1, 3: 1, 6: 5},
+    {3: 2, 5: 4, 6: 4},
+    {3: 2, 6: 5},
+    {3: 2},
+    {6: 5},
+]
 
-def load_json(file_path):
-    with open(file_path, 'r') as fr:
-        video_info = json.load(fr)
-
-    label = video_info['label']
-    label_index = video_info['label_index']
-
-    num_frames = video_info['data'][-1]['frame_index']
-    keypoints = np.zeros((num_person, num_frames, num_joints, 2), dtype=np.float32)
-    scores = np.zeros((num_person, num_frames, num_joints), dtype=np.float32)
-
-    for frame_info in video_info['data']:
-        frame_index = frame_info['frame_index']
 
-        for index, skeleton_info in enumerate(frame_info['skeleton']):
-            pose = skeleton_info['pose']
-            score = skeleton_info['score']
-            bbox = skeleton_info['bbox']
-
-            if len(bbox) == 0 or index+1 > num_person:
-                continue
-
-            pose = np.asarray(pose, dtype=np.float32)
-            score = np.asarray(score, dtype=np.float32)
-            score = score.reshape(-1)
-
-            keypoints[index, frame_index-1] = pose
-            scores[index, frame_index-1] = score
+def load_json(file_path):
+    # Both keypoints JSON files and .kpts files are supported, JSON files are parsed incrementally
+    keypoints, scores, label, label_index = load_kpts(file_path, num_person)
 
     return keypoints, scores, label, label_index
 
@@ -55,60 +44,81 @@ def h36m_coco_format(keypoints, scores):
         kpts = keypoints[i]
         score = scores[i]
 
-        new_score = np.zeros_like(score, dtype=np.float32)
-
         if np.sum(kpts) != 0.:
             kpts, valid_frame = coco_h36m(kpts)
             h36m_kpts.append(kpts)
             valid_frames.append(valid_frame)
-
-            new_score[:, h36m_coco_order] = score[:, coco_order]
-            new_score[:, 0] = np.mean(score[:, [11, 12]], axis=1, dtype=np.float32)
-            new_score[:, 8] = np.mean(score[:, [5, 6]], axis=1, dtype=np.float32)
-            new_score[:, 7] = np.mean(new_score[:, [0, 8]], axis=1, dtype=np.float32)
-            new_score[:, 10] = np.mean(score[:, [1, 2, 3, 4]], axis=1, dtype=np.float32)
-
-            h36m_scores.append(new_score)
+            h36m_scores.append(coco_h36m_scores(score))
 
     h36m_kpts = np.asarray(h36m_kpts, dtype=np.float32)
     h36m_scores = np.asarray(h36m_scores, dtype=np.float32)
     return h36m_kpts, h36m_scores, valid_frames
 
 
-def revise_kpts(h36m_kpts, h36m_scores, valid_frames):
+def coco_h36m_scores(score):
+    # score: (..., 17) in the MSCOCO order --> (..., 17) in the h36m order
+    new_score = np.zeros_like(score, dtype=np.float32)
+
+    new_score[..., h36m_coco_order] = score[..., coco_order]
+    new_score[..., 0] = np.mean(score[..., [11, 12]], axis=-1, dtype=np.float32)
+    new_score[..., 8] = np.mean(score[..., [5, 6]], axis=-1, dtype=np.float32)
+    new_score[..., 7] = np.mean(new_score[..., [0, 8]], axis=-1, dtype=np.float32)
+    new_score[..., 10] = np.mean(score[..., [1, 2, 3, 4]], axis=-1, dtype=np.float32)
+
+    return new_score
+
+
+def h36m_coco_format_frame(keypoints, scores, threshold=score_threshold, rules=revise_rules):
+    """
+    Per-frame counterpart of h36m_coco_format followed by revise_kpts
+    :param keypoints: (M, 17, 2) MSCOCO keypoints of all person slots in one frame
+    :param scores: (M, 17)
+    :return: repaired h36m keypoints (M, 17, 2), h36m scores (M, 17), whether every person is visible (M, )
+    """
+    # coco_h36m treats every person as one frame
+    h36m_kpts, valid_index = coco_h36m(keypoints)
+    h36m_scores = coco_h36m_scores(scores)
 
-    new_h36m_kpts = np.zeros_like(h36m_kpts)
+    valid = np.zeros(len(keypoints), dtype=bool)
+    valid[valid_index] = True
+
+    h36m_kpts = repair_low_score_joints(h36m_kpts, h36m_scores, threshold, rules)
+    h36m_kpts[~valid] = 0.
+    return h36m_kpts, h36m_scores, valid
+
+
+def repair_low_score_joints(kpts, scores, threshold=score_threshold, rules=revise_rules):
+    """
+    Replace low-score joints following the first rule whose joints are exactly the low-score ones
+    :param kpts: (..., N, 2)
+    :param scores: (..., N)
+    :param threshold: Joints with scores lower than the threshold are low-score joints
+    :param rules: list of {replaced joint: replacement joint} dicts
+    :return: The repaired copy of kpts
+    """
+    rule_joints = sorted(set().union(*rules))
+    low_score = scores[..., rule_joints] < threshold
+
+    new_kpts = kpts.copy()
+    for rule in rules:
+        matched = np.all(low_score == np.isin(rule_joints, list(rule)), axis=-1)
+        if not matched.any():
+            continue
+
+        matched_kpts = kpts[matched]
+        matched_kpts[:, list(rule.keys())] = matched_kpts[:, list(rule.values())]
+        new_kpts[matched] = matched_kpts
+
+    return new_kpts
+
+
+def revise_kpts(h36m_kpts, h36m_scores, valid_frames, threshold=score_threshold, rules=revise_rules):
+    valid_mask = np.zeros(h36m_kpts.shape[:2], dtype=bool)
     for index, frames in enumerate(valid_frames):
-        kpts = h36m_kpts[index, frames]
-        score = h36m_scores[index, frames]
-
-        # threshold_score = score > 0.3
-        # if threshold_score.all():
-        #     continue
-
-        index_frame = np.where(np.sum(score < 0.3, axis=1) > 0)[0]
-
-        for frame in index_frame:
-            less_threshold_joints = np.where(score[frame] < 0.3)[0]
-
-            intersect = [i for i in [2, 3, 5, 6] if i in less_threshold_joints]
-
-            if [2, 3, 5, 6] == intersect:
-                kpts[frame, [2, 3, 5, 6]] = kpts[frame, [1, 1, 4, 4]]
-            elif [2, 3, 6] == intersect:
-                kpts[frame, [2, 3, 6]] = kpts[frame, [1, 1, 5]]
-            elif [3, 5, 6] == intersect:
-                kpts[frame, [3, 5, 6]] = kpts[frame, [2, 4, 4]]
-            elif [3, 6] == intersect:
-                kpts[frame, [3, 6]] = kpts[frame, [2, 5]]
-            elif [3] == intersect:
-                kpts[frame, 3] = kpts[frame, 2]
-            elif [6] == intersect:
-                kpts[frame, 6] = kpts[frame, 5]
-            else:
-                continue
-
-        new_h36m_kpts[index, frames] = kpts
+        valid_mask[index, frames] = True
+
+    new_h36m_kpts = repair_low_score_joints(h36m_kpts, h36m_scores, threshold, rules)
+    new_h36m_kpts[~valid_mask] = 0.
     return new_h36m_kpts
 
 
@@ -121,30 +131,37 @@ def load_kpts_json(kpts_json):
 
 
 def revise_skes(prediction, re_kpts, valid_frames):
+    num_person, num_frames = re_kpts.shape[:2]
     new_prediction = np.zeros((*re_kpts.shape[:-1], 3), dtype=np.float32)
+
+    valid_mask = np.zeros((num_person, num_frames), dtype=bool)
     for i, frames in enumerate(valid_frames):
         new_prediction[i, frames] = prediction[i]
-
-        # The origin of (x, y) is in the upper right corner,
-        # while the (x,y) coordinates in the image are in the upper left corner.
-        distance = re_kpts[i, frames[1:], :, :2] - re_kpts[i, frames[:1], :, :2]
-        distance = np.mean(distance[:, [1, 4, 11, 14]], axis=-2, keepdims=True)
-        new_prediction[i, frames[1:], :, 0] -= distance[..., 0] / ratio_2d_3d
-        new_prediction[i, frames[1:], :, 1] += distance[..., 1] / ratio_2d_3d
+        valid_mask[i, frames] = True
 
     # The origin of (x, y) is in the upper right corner,
     # while the (x,y) coordinates in the image are in the upper left corner.
-    # Calculate the relative distance between two people
-    if len(valid_frames) == 2:
-        intersec_frames = [frame for frame in valid_frames[0] if frame in valid_frames[1]]
-        absolute_distance = re_kpts[0, intersec_frames[:1], :, :2] - re_kpts[1, intersec_frames[:1], :, :2]
-        absolute_distance = np.mean(absolute_distance[:, [1, 4, 11, 14]], axis=-2, keepdims=True) / 2.
-
-        new_prediction[0, valid_frames[0], :, 0] -= absolute_distance[..., 0] / ratio_2d_3d
-        new_prediction[0, valid_frames[0], :, 1] += absolute_distance[..., 1] / ratio_2d_3d
-
-        new_prediction[1, valid_frames[1], :, 0] += absolute_distance[..., 0] / ratio_2d_3d
-        new_prediction[1, valid_frames[1], :, 1] -= absolute_distance[..., 1] / ratio_2d_3d
+    # roots: (M, T, 2), the mean of hips and shoulders of every person in every frame
+    roots = np.mean(re_kpts[:, :, [1, 4, 11, 14], :2], axis=2)
+    first_frames = np.array([frames[0] for frames in valid_frames])
+    distance = roots - roots[np.arange(num_person), first_frames][:, np.newaxis]
+    distance = np.where(valid_mask[..., np.newaxis], distance, 0.) / ratio_2d_3d
+    new_prediction[..., 0] -= distance[..., np.newaxis, 0]
+    new_prediction[..., 1] += distance[..., np.newaxis, 1]
+
+    # Calculate the relative distance between people, i.e. the offset of every person
+    # from the center of all people in the first frame where all of them are visible
+    if num_person > 1:
+        intersec_frames = reduce(np.intersect1d, valid_frames)
+        if len(intersec_frames) > 0:
+            anchor_roots = roots[:, intersec_frames[0]]
+        else:
+            anchor_roots = roots[np.arange(num_person), first_frames]
+        absolute_distance = (anchor_roots - np.mean(anchor_roots, axis=0)) / ratio_2d_3d
+        absolute_distance = np.where(valid_mask[..., np.newaxis], absolute_distance[:, np.newaxis], 0.)
+
+        new_prediction[..., 0] -= absolute_distance[..., np.newaxis, 0]
+        new_prediction[..., 1] += absolute_distance[..., np.newaxis, 1]
 
     # Pre-processing the case where the movement of Z axis is relatively large, such as 'sitting down'
     # Remove the absolute distance
@@ -155,6 +172,56 @@ def revise_skes(prediction, re_kpts, valid_frames):
     return new_prediction
 
 
+class SkesReviser:
+    """
+    Streaming counterpart of revise_skes for 3D poses that arrive frame by frame.
+    Every person is moved by the 2D movement of its root since its first frame. With several people,
+    the offset of every person is taken from the center of the people visible in its first frame.
+    The height is rebased on the lowest joint seen so far instead of the lowest joint of the whole video.
+    """
+
+    def __init__(self, num_person, ab_dis=False):
+        self.num_person = num_person
+        self.ab_dis = ab_dis
+
+        self.seen = np.zeros(num_person, dtype=bool)
+        self.first_roots = np.zeros((num_person, 2), dtype=np.float32)
+        self.offsets = np.zeros((num_person, 2), dtype=np.float32)
+        self.min_height = np.inf
+
+    def __call__(self, poses, re_kpts, valid):
+        """
+        :param poses: (M, 17, 3) 3D poses of one frame
+        :param re_kpts: (M, 17, 2) repaired h36m keypoints of the frame
+        :param valid: (M, ) whether every person is visible
+        :return: The revised copy of poses
+        """
+        poses = poses.copy()
+        if not valid.any():
+            return poses
+
+        roots = np.mean(re_kpts[:, [1, 4, 11, 14]], axis=1)
+        new_people = valid & ~self.seen
+        if new_people.any():
+            self.first_roots[new_people] = roots[new_people]
+            self.offsets[new_people] = roots[new_people] - np.mean(roots[valid], axis=0)
+            self.seen |= new_people
+
+        if self.num_person > 1:
+            # The origin of (x, y) is in the upper right corner,
+            # while the (x,y) coordinates in the image are in the upper left corner.
+            distance = (roots - self.first_roots + self.offsets) / ratio_2d_3d
+            poses[valid, :, 0] -= distance[valid, np.newaxis, 0]
+            poses[valid, :, 1] += distance[valid, np.newaxis, 1]
+        elif self.ab_dis:
+            poses[valid, :, 2] -= np.amin(poses[valid, :, 2], axis=1, keepdims=True)
+            return poses
+
+        self.min_height = min(self.min_height, np.amin(poses[valid, :, 2]))
+        poses[valid, :, 2] -= self.min_height
+        return poses
+
+
 def revise_skes_real_time(prediction, re_kpts, width):
     ratio_2d_3d_width = ratio_2d_3d * (width / 1920)
     # prediction: (M, N, 3)
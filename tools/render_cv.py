@@ -0,0 +1,263 @@
+"""
+OpenCV renderer of 3D pose animations.
+It draws the same layout as tools/vis_h36m.render_animation (the input video with the 2D poses next to the 3D poses)
+without matplotlib: the 3D skeletons are projected with a precomputed view matrix and drawn with OpenCV primitives,
+the frames are rendered in parallel and piped to the video encoder as they are produced.
+"""
+import os
+import shutil
+import subprocess as sp
+from multiprocessing import Pool
+import cv2
+import numpy as np
+from tools.color_edge import h36m_color_edge, color_rgb
+
+
+def view_matrix(azim, elev=15.):
+    """
+    Rotation from world coordinates to (right, up, towards the viewer) coordinates,
+    for the same view as matplotlib's ax.view_init(elev, azim)
+    """
+    azim, elev = np.radians(float(azim)), np.radians(float(elev))
+    right = [-np.sin(azim), np.cos(azim), 0]
+    up = [-np.sin(elev) * np.cos(azim), -np.sin(elev) * np.sin(azim), np.cos(elev)]
+    eye = [np.cos(elev) * np.cos(azim), np.cos(elev) * np.sin(azim), np.sin(elev)]
+    return np.array([right, up, eye], dtype=np.float32)
+
+
+def bgr(color):
+    r, g, b = color_rgb[color]
+    return b, g, r
+
+
+class SkeletonRenderer:
+    """
+    Draw one frame of the animation: the input frame with the 2D poses and one 3D panel per pose,
+    or a single 3D panel with all poses if com_reconstrcution is set for several people
+
+    Arguments:
+    parents -- skeleton.parents()
+    keypoints_metadata -- the metadata used by render_animation
+    azim -- azimuth of the 3D view in degrees
+    num_poses -- the number of 3D poses drawn every frame
+    size -- the height of the output in hundreds of pixels, like the figure size of render_animation
+    follow_root -- keep the root joint in the middle of the 3D panels (tools/visualization.render_animation)
+    """
+
+    def __init__(self, parents, keypoints_metadata, azim, num_poses, viewport, size=5, com_reconstrcution=False,
+                 follow_root=False, elev=15., radius=1.7):
+        self.parents = parents
+        self.bones = [(j, j_parent) for j, j_parent in enumerate(parents) if j_parent != -1]
+        self.draw_2d_bones = len(parents) == 17 and keypoints_metadata['layout_name'] != 'coco'
+        self.joints_right_2d = keypoints_metadata['keypoints_symmetry'][1]
+        self.bone_colors = [bgr(h36m_color_edge(j)) for j, _ in self.bones]
+
+        self.view = view_matrix(azim, elev)
+        self.combined = com_reconstrcution and num_poses > 1
+        self.num_panels = 1 if self.combined else num_poses
+        self.follow_root = follow_root
+        self.radius = radius
+        self.extent = radius if self.combined else radius / 2
+
+        self.panel_size = 2 * int(size * 50)
+        self.scale = self.panel_size / (2.6 * self.extent)
+        self.input_scale = self.panel_size / viewport[1]
+        # Even width and height for yuv420p
+        self.input_width = 2 * int(round(viewport[0] * self.input_scale / 2))
+        self.width = self.input_width + self.num_panels * self.panel_size
+        self.height = self.panel_size
+
+    def resize_input(self, frame):
+        """
+        Resize an input frame to the height of the output (done before the frame is sent to a worker process)
+        """
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        return cv2.resize(frame, (self.input_width, self.height), interpolation=cv2.INTER_AREA)
+
+    def project(self, points, center):
+        """
+        Orthographic projection of points (..., 3) to pixels of a 3D panel, with their depth
+        """
+        view_points = (points - center) @ self.view.T
+        u = self.panel_size / 2 + view_points[..., 0] * self.scale
+        v = self.panel_size / 2 - view_points[..., 1] * self.scale
+        return np.stack([u, v], axis=-1), view_points[..., 2]
+
+    def draw_panel(self, panel, poses, center):
+        # Ground square of the axis limits
+        ground = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float32) * self.extent
+        ground = np.concatenate([ground + center[:2], np.zeros((4, 1), dtype=np.float32)], axis=1)
+        ground_2d, _ = self.project(ground, center)
+        cv2.polylines(panel, [np.round(ground_2d).astype(np.int32)], True, (200, 200, 200), 1, cv2.LINE_AA)
+
+        # Painter's algorithm: the bones far from the viewer are drawn first
+        segments = []
+        for pose in poses:
+            points, depth = self.project(pose, center)
+            for (j, j_parent), color in zip(self.bones, self.bone_colors):
+                segments.append((depth[j] + depth[j_parent], points[j], points[j_parent], color))
+        segments.sort(key=lambda segment: segment[0])
+
+        for _, start, end, color in segments:
+            cv2.line(panel, tuple(np.round(start).astype(int)), tuple(np.round(end).astype(int)), color,
+                     max(self.panel_size // 160, 2), cv2.LINE_AA)
+
+    def draw_input(self, frame, keypoints):
+        keypoints = np.round(keypoints * self.input_scale).astype(int)
+        for person in keypoints:
+            if self.draw_2d_bones:
+                for j, j_parent in self.bones:
+                    cv2.line(frame, tuple(person[j]), tuple(person[j_parent]), bgr('pink'), 1, cv2.LINE_AA)
+            for j, point in enumerate(person):
+                color = bgr('red') if j in self.joints_right_2d else bgr('black')
+                cv2.circle(frame, tuple(point), 3, bgr('white'), -1, cv2.LINE_AA)
+                cv2.circle(frame, tuple(point), 2, color, -1, cv2.LINE_AA)
+        return frame
+
+    def render(self, frame, keypoints, poses):
+        """
+        :param frame: The input frame, resized by resize_input
+        :param keypoints: 2D poses of the frame (M, N, 2) in the input resolution
+        :param poses: list of 3D poses (N, 3) of the frame
+        :return: BGR image (height, width, 3)
+        """
+        image = np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        image[:, :self.input_width] = self.draw_input(frame.copy(), keypoints)
+
+        panels = [poses] if self.combined else [[pose] for pose in poses]
+        for n, panel_poses in enumerate(panels):
+            center = np.array([0, 0, self.radius / 2], dtype=np.float32)
+            if self.follow_root:
+                center[:2] = panel_poses[0][0, :2]
+            x = self.input_width + n * self.panel_size
+            self.draw_panel(image[:, x:x + self.panel_size], panel_poses, center)
+        return image
+
+
+class VideoEncoder:
+    """
+    Pipe raw BGR frames to ffmpeg, or to cv2.VideoWriter when ffmpeg is not installed
+    """
+
+    def __init__(self, output, width, height, fps, bitrate=3000):
+        self.pipe = None
+        self.writer = None
+        if shutil.which('ffmpeg') is not None:
+            if output.endswith('.gif'):
+                codec = []
+            else:
+                codec = ['-vcodec', 'libx264', '-pix_fmt', 'yuv420p', '-b:v', '{}k'.format(bitrate)]
+            command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                       '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-'] + codec + [output]
+            self.pipe = sp.Popen(command, stdin=sp.PIPE)
+        else:
+            self.writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    def write(self, image):
+        if self.pipe is not None:
+            self.pipe.stdin.write(image.tobytes())
+        else:
+            self.writer.write(image)
+
+    def close(self):
+        if self.pipe is not None:
+            self.pipe.stdin.close()
+            self.pipe.wait()
+        else:
+            self.writer.release()
+
+
+def read_frames(input_video_path, skip=0):
+    """
+    Decode the BGR frames of a video one by one
+    """
+    cap = cv2.VideoCapture(input_video_path)
+    index = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index >= skip:
+            yield frame
+        index += 1
+    cap.release()
+
+
+_renderer = None
+
+
+def _init_worker(renderer):
+    global _renderer
+    _renderer = renderer
+
+
+def _render_frame(task):
+    return _renderer.render(*task)
+
+
+def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrate, azim, output, viewport, limit=-1,
+                     downsample=1, size=5, input_video_path=None, com_reconstrcution=False, input_video_skip=0,
+                     follow_root=False, num_workers=None):
+    """
+    Render an animation with OpenCV. The options are the same as tools.vis_h36m.render_animation
+    :param keypoints: 2D poses (T, M, N, 2), or (T, N, 2) for a single person
+    :param poses: dict of 3D poses (T, N, 3)
+    :param output: .mp4 or .gif file
+    :param follow_root: keep the root joint in the middle of the 3D panels, like tools.visualization.render_animation
+    :param num_workers: The number of rendering processes, all CPUs if None. Frames are rendered in the main process if 1
+    """
+    if keypoints.ndim == 3:
+        keypoints = keypoints[:, np.newaxis]
+    poses = list(poses.values())
+
+    if input_video_path is None:
+        frames = (np.zeros((int(viewport[1]), int(viewport[0]), 3), dtype=np.uint8) for _ in range(keypoints.shape[0]))
+    else:
+        frames = read_frames(input_video_path, skip=input_video_skip)
+        keypoints = keypoints[input_video_skip:]
+        poses = [pose[input_video_skip:] for pose in poses]
+        if fps is None:
+            fps = cv2.VideoCapture(input_video_path).get(cv2.CAP_PROP_FPS)
+
+    num_frames = min([keypoints.shape[0]] + [len(pose) for pose in poses]) // downsample
+    if limit >= 1:
+        num_frames = min(limit, num_frames)
+    fps /= downsample
+
+    renderer = SkeletonRenderer(skeleton.parents(), keypoints_metadata, azim, len(poses), viewport, size,
+                                com_reconstrcution, follow_root)
+
+    def tasks():
+        group = []
+        for i, frame in enumerate(frames):
+            if i // downsample >= num_frames:
+                break
+            group.append(frame.astype(np.float32) if downsample > 1 else frame)
+            if len(group) < downsample:
+                continue
+
+            # Average every downsample frames, 2D poses and 3D poses
+            start = i + 1 - downsample
+            frame = (sum(group) / downsample).astype(np.uint8) if downsample > 1 else group[0]
+            group = []
+            yield (renderer.resize_input(frame), keypoints[start:i + 1].mean(axis=0),
+                   [pose[start:i + 1].mean(axis=0) for pose in poses])
+
+    pool = None
+    if num_workers == 1:
+        images = (renderer.render(*task) for task in tasks())
+    else:
+        pool = Pool(num_workers or os.cpu_count(), initializer=_init_worker, initargs=(renderer, ))
+        images = pool.imap(_render_frame, tasks(), chunksize=4)
+
+    encoder = VideoEncoder(output, renderer.width, renderer.height, fps, bitrate)
+    try:
+        for i, image in enumerate(images):
+            encoder.write(image)
+            print('{}/{}      '.format(i, num_frames), end='\r')
+    finally:
+        encoder.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
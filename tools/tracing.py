@@ -0,0 +1,210 @@
+"""
+Per-stage tracing of the pipeline.
+The stages are wrapped in spans:
+
+    from tools import tracing
+    with tracing.span('detect'):
+        bboxs, scores = yolo_det(frame, human_model)
+
+Tracing is disabled by default and span() then returns a shared no-op context manager, so an instrumented stage only
+costs a global lookup and a function call. When enabled, the durations of every stage are aggregated in histograms,
+and every span is kept as an event of a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+Other consumers of the spans (tools/metrics.py) are registered with add_sink.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class Histogram:
+    """
+    Histogram of durations with logarithmic buckets, 10 buckets per decade from 1us to 1000s.
+    The percentiles are estimated at the upper bound of their bucket, i.e. within 26% of the exact value
+    """
+    bounds = [10 ** (e / 10) for e in range(-60, 31)]  # seconds
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        :param q: percentile in [0, 100]
+        :return: seconds
+        """
+        if self.count == 0:
+            return 0.
+        rank = q / 100 * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if count > 0 and cumulative >= rank:
+                return min(self.bounds[bucket], self.max) if bucket < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        """
+        :return: dict of the count, the total in seconds and the mean, p50, p90, p99 and max in milliseconds
+        """
+        return OrderedDict([('count', self.count), ('total_s', self.total),
+                            ('mean_ms', self.total / max(self.count, 1) * 1000),
+                            ('p50_ms', self.percentile(50) * 1000), ('p90_ms', self.percentile(90) * 1000),
+                            ('p99_ms', self.percentile(99) * 1000), ('max_ms', self.max * 1000)])
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        for sink in _sinks:
+            sink(self.name, self.start, end, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Collect the spans of a run
+    :param max_events: The number of events kept for the Chrome trace. The histograms include every span
+    """
+
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self.histograms = OrderedDict()
+        self.events = []
+        self.num_dropped_events = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, args=None):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(end - start)
+
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, end, threading.get_ident(), args))
+            else:
+                self.num_dropped_events += 1
+
+    def summary(self):
+        """
+        :return: {stage: Histogram.summary()}, in the order the stages first ran
+        """
+        with self._lock:
+            return OrderedDict((name, histogram.summary()) for name, histogram in self.histograms.items())
+
+    def report(self):
+        lines = ['{:<16} {:>8} {:>10} {:>9} {:>9} {:>9} {:>9}'.format('stage', 'count', 'total_s', 'mean_ms',
+                                                                       'p50_ms', 'p99_ms', 'max_ms')]
+        for name, stats in self.summary().items():
+            lines.append('{:<16} {:>8} {:>10.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                name, stats['count'], stats['total_s'], stats['mean_ms'], stats['p50_ms'], stats['p99_ms'],
+                stats['max_ms']))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        """
+        Write the spans in the Chrome trace event format, with the stage histograms in the metadata
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        trace_events = []
+        for name, start, end, tid, args in events:
+            event = {'name': name, 'cat': 'pipeline', 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6}
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                       'metadata': {'stages': self.summary(), 'dropped_events': self.num_dropped_events}}, f,
+                      default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+
+_tracer = None
+# Functions called with (name, start, end, args) at the end of every span. The spans are no-ops while it is empty
+_sinks = []
+
+
+def add_sink(sink):
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def enable(max_events=1000000):
+    """
+    Start tracing with a new Tracer, which is returned
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(max_events)
+    add_sink(_tracer.record)
+    return _tracer
+
+
+def disable():
+    """
+    Stop tracing. The Tracer of the run is returned, None if tracing was not enabled
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        remove_sink(tracer.record)
+    return tracer
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **args):
+    """
+    Context manager measuring a stage. The keyword arguments are shown in the Chrome trace
+    """
+    if not _sinks:
+        return _null_span
+    return _Span(name, args)
+
@@ -4,6 +4,8 @@ import hashlib
 import cv2
 import os.path as osp
 
+from tools.preprocess import repair_low_score_joints
+
 
 spple_keypoints = [10, 8, 0, 7]
 h36m_coco_order = [9, 11, 14, 12, 15, 13, 16, 4, 1, 5, 2, 6, 3]
@@ -150,21 +152,7 @@ def h36m_coco_kpts(keypoints, scores):
             h36m_scores.append(new_score)
 
             kpts = coco_h36m_frame(kpts)
-            less_threshold_joints = np.where(new_score < 0.3)[0]
-            intersect = [i for i in [2, 3, 5, 6] if i in less_threshold_joints]
-
-            if [2, 3, 5, 6] == intersect:
-                kpts[[2, 3, 5, 6]] = kpts[[1, 1, 4, 4]]
-            elif [2, 3, 6] == intersect:
-                kpts[[2, 3, 6]] = kpts[[1, 1, 5]]
-            elif [3, 5, 6] == intersect:
-                kpts[[3, 5, 6]] = kpts[[2, 4, 4]]
-            elif [3, 6] == intersect:
-                kpts[[3, 6]] = kpts[[2, 5]]
-            elif [3] == intersect:
-                kpts[3] = kpts[2]
-            elif [6] == intersect:
-                kpts[6] = kpts[5]
+            kpts = repair_low_score_joints(kpts, new_score.reshape(-1))
 
             h36m_kpts.append(kpts)
 
@@ -6,7 +6,10 @@ from matplotlib.animation import FuncAnimation, writers
 from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 import subprocess as sp
+import threading
+import queue
 from tools.color_edge import h36m_color_edge
+from tools import metrics
 
 
 def get_resolution(filename):
@@ -55,6 +58,73 @@ def downsample_tensor(X, factor):
     return np.mean(X[:length].reshape(-1, factor, *X.shape[1:]), axis=1)
 
 
+def downsample_frames(frames, factor):
+    """
+    Streaming version of downsample_tensor for video frames: average every factor frames as they are decoded
+    """
+    total = None
+    count = 0
+    try:
+        for frame in frames:
+            if count == 0:
+                total = frame.astype(np.float32)
+            else:
+                total += frame
+            count += 1
+            if count == factor:
+                yield (total / factor).astype('uint8')
+                count = 0
+    finally:
+        frames.close()
+
+
+def prefetch_frames(frames, buffer_size=8):
+    """
+    Decode frames in a background thread while the previous frames are rendered.
+    At most buffer_size decoded frames are kept in memory
+    """
+    buffer = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    break
+            put(end)
+        except Exception as e:
+            put(e)
+        finally:
+            # Stop the ffmpeg process if the rendering finished before the end of the video
+            if hasattr(frames, 'close'):
+                frames.close()
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            metrics.queue_depth.set(buffer.qsize(), queue='render_prefetch')
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrate, azim, output, viewport, limit=-1,
                      downsample=1, size=5, input_video_path=None, com_reconstrcution=False, input_video_skip=0):
     """
@@ -69,7 +139,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
     plt.ioff()
 
     num_person = keypoints.shape[1]
-    if num_person == 2 and com_reconstrcution:
+    if num_person > 1 and com_reconstrcution:
 
         fig = plt.figure(figsize=(size * (1 + len(poses)), size))
         ax_in = fig.add_subplot(1, 2, 1)
@@ -86,7 +156,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
     lines_3d = []
     radius = 1.7
 
-    if num_person == 2 and com_reconstrcution:
+    if num_person > 1 and com_reconstrcution:
         ax = fig.add_subplot(1, 2, 2, projection='3d')
         ax.view_init(elev=15., azim=azim)
         ax.set_xlim3d([-radius, radius])
@@ -118,17 +188,13 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
             lines_3d.append([])
         poses = list(poses.values())
 
-    # Decode video
+    # Decode video, the frames are streamed from ffmpeg as the animation advances
     if input_video_path is None:
         # Black background
-        all_frames = np.zeros((keypoints.shape[0], viewport[1], viewport[0]), dtype='uint8')
+        black_frame = np.zeros((viewport[1], viewport[0]), dtype='uint8')
+        frames = (black_frame for _ in range(keypoints.shape[0]))
     else:
-        # Load video using ffmpeg
-        all_frames = []
-        for f in read_video(input_video_path, skip=input_video_skip, limit=limit):
-            all_frames.append(f)
-        effective_length = min(keypoints.shape[0], len(all_frames))
-        all_frames = all_frames[:effective_length]
+        frames = prefetch_frames(read_video(input_video_path, skip=input_video_skip))
 
         keypoints = keypoints[input_video_skip:]  # todo remove
         for idx in range(len(poses)):
@@ -139,7 +205,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
 
     if downsample > 1:
         keypoints = downsample_tensor(keypoints, downsample)
-        all_frames = downsample_tensor(np.array(all_frames), downsample).astype('uint8')
+        frames = downsample_frames(frames, downsample)
         for idx in range(len(poses)):
             poses[idx] = downsample_tensor(poses[idx], downsample)
         fps /= downsample
@@ -149,33 +215,27 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
     lines = []
     points = None
 
+    # The animation stops earlier if the video is shorter than the poses
+    num_frames = min([keypoints.shape[0]] + [len(pose) for pose in poses])
     if limit < 1:
-        limit = len(all_frames)
+        limit = num_frames
     else:
-        limit = min(limit, len(all_frames))
+        limit = min(limit, num_frames)
 
     parents = skeleton.parents()
     index = [i for i in np.arange(17)]
 
-    def update_video(i):
+    def update_video(frame_data):
         nonlocal initialized, image, lines, points
+        i, frame = frame_data
 
         joints_right_2d = keypoints_metadata['keypoints_symmetry'][1]
 
-        if num_person == 2:
-            joints_right_2d_two = []
-            joints_right_2d_two += joints_right_2d
-            joints_right_2d_second = [i + 17 for i in joints_right_2d]
-            joints_right_2d_two += joints_right_2d_second
-
-            colors_2d = np.full(34, 'black')
-            colors_2d[joints_right_2d_two] = 'red'
-        else:
-            colors_2d = np.full(17, 'black')
-            colors_2d[joints_right_2d] = 'red'
+        colors_2d = np.full(17*num_person, 'black')
+        colors_2d[[j + 17*m for m in range(num_person) for j in joints_right_2d]] = 'red'
 
         if not initialized:
-            image = ax_in.imshow(all_frames[i], aspect='equal')
+            image = ax_in.imshow(frame, aspect='equal')
 
             for j, j_parent in zip(index, parents):
                 if j_parent == -1:
@@ -207,7 +267,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
             points = ax_in.scatter(*keypoints[i].reshape(17*num_person, 2).T, 10, color=colors_2d, edgecolors='white', zorder=10)
             initialized = True
         else:
-            image.set_data(all_frames[i])
+            image.set_data(frame)
 
             for j, j_parent in zip(index, parents):
                 if j_parent == -1:
@@ -215,15 +275,15 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
 
                 if len(parents) == 17 and keypoints_metadata['layout_name'] != 'coco':
                     for m in range(num_person):
-                        lines[j + 16*m - 1][0].set_data([keypoints[i, m, j, 0], keypoints[i, m, j_parent, 0]],
+                        lines[(j - 1)*num_person + m][0].set_data([keypoints[i, m, j, 0], keypoints[i, m, j_parent, 0]],
                                                         [keypoints[i, m, j, 1], keypoints[i, m, j_parent, 1]])
 
                 if com_reconstrcution:
                     for k, pose in enumerate(poses):
                         pos = pose[i]
-                        lines_3d[0][j + k*16 - 1][0].set_xdata([pos[j, 0], pos[j_parent, 0]])
-                        lines_3d[0][j + k*16 - 1][0].set_ydata([pos[j, 1], pos[j_parent, 1]])
-                        lines_3d[0][j + k*16 - 1][0].set_3d_properties([pos[j, 2], pos[j_parent, 2]], zdir='z')
+                        lines_3d[0][(j - 1)*len(poses) + k][0].set_xdata([pos[j, 0], pos[j_parent, 0]])
+                        lines_3d[0][(j - 1)*len(poses) + k][0].set_ydata([pos[j, 1], pos[j_parent, 1]])
+                        lines_3d[0][(j - 1)*len(poses) + k][0].set_3d_properties([pos[j, 2], pos[j_parent, 2]], zdir='z')
                 else:
                     for n, ax in enumerate(ax_3d):
                         pos = poses[n][i]
@@ -237,13 +297,19 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
 
     fig.tight_layout()
 
-    anim = FuncAnimation(fig, update_video, frames=np.arange(0, limit), interval=1000 / fps, repeat=False)
-    if output.endswith('.mp4'):
-        Writer = writers['ffmpeg']
-        writer = Writer(fps=fps, metadata={}, bitrate=bitrate)
-        anim.save(output, writer=writer)
-    elif output.endswith('.gif'):
-        anim.save(output, dpi=80, writer='imagemagick')
-    else:
-        raise ValueError('Unsupported output format (only .mp4 and .gif are supported)')
+    # Frames are not cached by the animation, so only the prefetched frames are kept in memory
+    frame_data = zip(range(limit), frames)
+    anim = FuncAnimation(fig, update_video, frames=frame_data, save_count=limit, interval=1000 / fps, repeat=False,
+                         cache_frame_data=False)
+    try:
+        if output.endswith('.mp4'):
+            Writer = writers['ffmpeg']
+            writer = Writer(fps=fps, metadata={}, bitrate=bitrate)
+            anim.save(output, writer=writer)
+        elif output.endswith('.gif'):
+            anim.save(output, dpi=80, writer='imagemagick')
+        else:
+            raise ValueError('Unsupported output format (only .mp4 and .gif are supported)')
+    finally:
+        frames.close()
     plt.close()
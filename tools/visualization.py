@@ -6,6 +6,7 @@ from matplotlib.animation import FuncAnimation, writers
 from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 import subprocess as sp
+from tools.vis_h36m import downsample_frames, prefetch_frames
 
 
 elbow_knee_v1 = [5, 15]
@@ -121,28 +122,25 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
         trajectories.append(data[:, 0, [0, 1]])
     poses = list(poses.values())
 
-    # Decode video
+    # Decode video, the frames are streamed from ffmpeg as the animation advances
     if input_video_path is None:
         # Black background
-        all_frames = np.zeros((keypoints.shape[0], viewport[1], viewport[0]), dtype='uint8')
+        black_frame = np.zeros((viewport[1], viewport[0]), dtype='uint8')
+        frames = (black_frame for _ in range(keypoints.shape[0]))
     else:
-        # Load video using ffmpeg
-        all_frames = []
-        for f in read_video(input_video_path, skip=input_video_skip, limit=limit):
-            all_frames.append(f)
-        effective_length = min(keypoints.shape[0], len(all_frames))
-        all_frames = all_frames[:effective_length]
-        
+        frames = prefetch_frames(read_video(input_video_path, skip=input_video_skip))
+
         keypoints = keypoints[input_video_skip:] # todo remove
         for idx in range(len(poses)):
             poses[idx] = poses[idx][input_video_skip:]
-        
+            trajectories[idx] = trajectories[idx][input_video_skip:]
+
         if fps is None:
             fps = get_fps(input_video_path)
     
     if downsample > 1:
         keypoints = downsample_tensor(keypoints, downsample)
-        all_frames = downsample_tensor(np.array(all_frames), downsample).astype('uint8')
+        frames = downsample_frames(frames, downsample)
         for idx in range(len(poses)):
             poses[idx] = downsample_tensor(poses[idx], downsample)
             trajectories[idx] = downsample_tensor(trajectories[idx], downsample)
@@ -153,14 +151,17 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
     lines = []
     points = None
     
+    # The animation stops earlier if the video is shorter than the poses
+    num_frames = min([keypoints.shape[0]] + [len(pose) for pose in poses])
     if limit < 1:
-        limit = len(all_frames)
+        limit = num_frames
     else:
-        limit = min(limit, len(all_frames))
+        limit = min(limit, num_frames)
 
     parents = skeleton.parents()
-    def update_video(i):
+    def update_video(frame_data):
         nonlocal initialized, image, lines, points
+        i, frame = frame_data
 
         for n, ax in enumerate(ax_3d):
             ax.set_xlim3d([-radius/2 + trajectories[n][i, 0], radius/2 + trajectories[n][i, 0]])
@@ -171,7 +172,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
         colors_2d = np.full(keypoints.shape[1], 'black')
         colors_2d[joints_right_2d] = 'red'
         if not initialized:
-            image = ax_in.imshow(all_frames[i], aspect='equal')
+            image = ax_in.imshow(frame, aspect='equal')
             
             for j, j_parent in enumerate(parents):
                 if j_parent == -1:
@@ -193,7 +194,7 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
 
             initialized = True
         else:
-            image.set_data(all_frames[i])
+            image.set_data(frame)
 
             for j, j_parent in enumerate(parents):
                 if j_parent == -1:
@@ -215,13 +216,19 @@ def render_animation(keypoints, keypoints_metadata, poses, skeleton, fps, bitrat
 
     fig.tight_layout()
     
-    anim = FuncAnimation(fig, update_video, frames=np.arange(0, limit), interval=1000/fps, repeat=False)
-    if output.endswith('.mp4'):
-        Writer = writers['ffmpeg']
-        writer = Writer(fps=fps, metadata={}, bitrate=bitrate)
-        anim.save(output, writer=writer)
-    elif output.endswith('.gif'):
-        anim.save(output, dpi=80, writer='imagemagick')
-    else:
-        raise ValueError('Unsupported output format (only .mp4 and .gif are supported)')
+    # Frames are not cached by the animation, so only the prefetched frames are kept in memory
+    frame_data = zip(range(limit), frames)
+    anim = FuncAnimation(fig, update_video, frames=frame_data, save_count=limit, interval=1000/fps, repeat=False,
+                         cache_frame_data=False)
+    try:
+        if output.endswith('.mp4'):
+            Writer = writers['ffmpeg']
+            writer = Writer(fps=fps, metadata={}, bitrate=bitrate)
+            anim.save(output, writer=writer)
+        elif output.endswith('.gif'):
+            anim.save(output, dpi=80, writer='imagemagick')
+        else:
+            raise ValueError('Unsupported output format (only .mp4 and .gif are supported)')
+    finally:
+        frames.close()
     plt.close()